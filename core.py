@@ -4,6 +4,10 @@ Defines:
     FRAMERATE, Int, Constant
     Kb, float, Constant, Boltzmann Constant
     MASS, float, Constant, scale factor for mass
+    RESYNC, Int, Constant, collisions between exact recalculations of
+        the running energy and momentum totals
+    CONSERVATION_TOL, float, Constant, relative change in energy or
+        momentum over one collision that counts as a violation
     close(float1, float2=0), function,
         test for equality of floats and arrays
 """
@@ -21,6 +25,8 @@ logging.basicConfig(filename=time.strftime("%Y%m%d-%H%M%S") + ".log",
 FRAMERATE = 50.
 Kb = 1.38064852E-23
 MASS = 1.0E-26
+RESYNC = 1000
+CONSERVATION_TOL = 1.0E-9
 
 
 def close(float1, float2=0.):
@@ -0,0 +1,124 @@
+"""
+Mean squared displacement and diffusion coefficient from trajectories
+
+Tracers only change velocity at collisions, so their paths are straight
+lines between the nodes in a trajectory.Trajectory and can be resampled
+onto a uniform time grid exactly by linear interpolation.
+
+Defines:
+    resample(data, dt, t_end=None), function,
+        positions of a tracer at uniform time steps
+    msd_fft(x), function,
+        mean squared displacement of one path for every lag, via FFT
+    msd(trajectories, dt, t_end=None), function,
+        mean squared displacement averaged over tracers and replicas
+    fit_diffusion(lags, msds, dim, fit_range=None), function,
+        diffusion coefficient and error from mean squared displacements
+
+Ethan Mills
+"""
+import core
+import trajectory
+
+import numpy as _np
+import scipy.optimize as _spo
+
+
+def resample(data, dt, t_end=None):
+    """Return positions at every *dt* seconds as numpy.array (T, dim)
+
+    *data* is the output of Trajectory.get_data(), rows [t, x, y(, z)].
+    Times run from the first node to *t_end*, or the last node if None.
+    """
+    if dt <= 0:
+        raise ValueError("dt is {}, should be positive".format(dt))
+    times = data[:, 0]
+    if t_end is None:
+        t_end = times[-1]
+    if t_end > times[-1]:
+        raise ValueError(
+            "t_end is {}, trajectory ends at {}".format(t_end, times[-1]))
+    grid = _np.arange(times[0], t_end, dt)
+    return _np.column_stack(
+        [_np.interp(grid, times, data[:, i])
+         for i in xrange(1, data.shape[1])])
+
+
+def _autocorrelation(x):
+    """Return autocorrelation of 1D *x* for every lag, via FFT"""
+    n = len(x)
+    f = _np.fft.rfft(x, n=2 * n)
+    res = _np.fft.irfft(f * f.conjugate())[:n]
+    return res / (n - _np.arange(n))
+
+
+def msd_fft(x):
+    """Return mean squared displacement of path *x* for lags 0..T-1
+
+    *x* is numpy.array (T, dim) sampled at uniform time steps. Uses
+    MSD(m) = S1(m) - 2 S2(m), where S2 is the autocorrelation, so the
+    cost is O(T log T) rather than O(T^2).
+    """
+    n = len(x)
+    d = _np.sum(x * x, axis=1)
+    # d[m - 1] + d[n - m] for each lag m, d[-1] and d[n] taken as zero
+    padded = _np.concatenate(([0.], d, [0.]))
+    m = _np.arange(n)
+    terms = padded[m] + padded[n + 1 - m]
+    s1 = (2 * _np.sum(d) - _np.cumsum(terms)) / (n - m)
+    s2 = sum(_autocorrelation(x[:, i]) for i in xrange(x.shape[1]))
+    return s1 - 2 * s2
+
+
+def msd(trajectories, dt, t_end=None):
+    """Return lags, mean MSD and MSD of each tracer, as numpy.arrays
+
+    *trajectories* is a list of trajectory.Trajectory or of arrays from
+    Trajectory.get_data(), from any number of tracers and replicas. All
+    are resampled every *dt* seconds up to *t_end*, or up to the end of
+    the shortest if None. Lags are counted from the first node of each.
+    """
+    datas = []
+    for traj in trajectories:
+        if isinstance(traj, trajectory.Trajectory):
+            traj = traj.get_data()
+        datas.append(traj)
+    if t_end is None:
+        t_end = min(data[-1, 0] for data in datas)
+    msds = [msd_fft(resample(data, dt, t_end)) for data in datas]
+    length = min(len(i) for i in msds)
+    msds = _np.array([i[:length] for i in msds])
+    lags = dt * _np.arange(length)
+    core.logging.log(15, "msd from {} paths, {} lags".format(
+        len(msds), length))
+    return lags, _np.mean(msds, axis=0), msds
+
+
+def fit_diffusion(lags, msds, dim, fit_range=None):
+    """Return diffusion coefficient and its error as floats
+
+    Fits MSD = 2 * dim * D * t + c over *fit_range*, a tuple of times
+    (start, stop). By default the first quarter of the lags, past the
+    first 10%, to stay clear of the ballistic regime at short times and
+    the container limit at long ones.
+    *msds* is numpy.array (n_paths, T). With more than one path the
+    error is the standard error of D fitted to each path, otherwise it
+    comes from the fit.
+    *dim* is the number of dimensions the tracers move in.
+    """
+    if fit_range is None:
+        fit_range = (0.1 * lags[-1], 0.25 * lags[-1])
+    mask = (lags >= fit_range[0]) & (lags <= fit_range[1])
+    if _np.sum(mask) < 3:
+        raise ValueError("fit_range {} covers too few lags".format(
+            fit_range))
+    msds = _np.atleast_2d(msds)
+
+    def linear(t, D, c):
+        return 2 * dim * D * t + c
+
+    fits = [_spo.curve_fit(linear, lags[mask], i[mask]) for i in msds]
+    Ds = _np.array([fit[0][0] for fit in fits])
+    if len(Ds) > 1:
+        return _np.mean(Ds), _np.std(Ds, ddof=1) / _np.sqrt(len(Ds))
+    return Ds[0], _np.sqrt(fits[0][1][0, 0])
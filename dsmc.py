@@ -0,0 +1,512 @@
+"""
+Direct Simulation Monte Carlo engine for very dilute gases
+
+When balls are far apart compared with their size, where they collide
+hardly matters, only how often and how hard. DSMC moves every ball in a
+straight line for a time step, bouncing it off the wall exactly, then
+collides randomly chosen pairs of balls that share a cell of a grid,
+with the probability kinetic theory gives for hard spheres. This is
+Bird's no-time-counter (NTC) scheme: each cell tries
+    N (N - 1) (sigma g)_max dt / (2 V)
+pairs, and keeps each with probability sigma g / (sigma g)_max, where
+sigma is the cross section, g the relative speed and V the part of the
+cell inside the container. Every step is a handful of numpy operations
+on all balls, however many there are, so millions of balls are
+practical. Energy and momentum are conserved exactly, but collisions
+are only right on average and the balls take up no room, so use
+system.System for dense gases.
+
+Defines:
+    DSMCSystem, Class
+    makeGas(n, radius, ballsize=1, v=8., dim=3, temperature=None,
+        **kwargs), function, DSMCSystem of balls placed as
+        objects.distributeBalls would, without making Ball objects
+
+Ethan Mills
+"""
+import core
+import kernels
+import objects
+
+import matplotlib.collections as _collections
+import numpy as _np
+
+from core import FRAMERATE, Kb
+
+
+# most times a ball can hit the wall in one step. Steps are much shorter
+# than the time to cross the container, so more means a ball is stuck.
+_MAX_BOUNCES = 100
+
+
+class DSMCSystem:
+    """Contain all the balls as arrays; keep track of time; move balls
+    in fixed steps and collide random pairs in each cell between steps;
+    calculate state variables. Has the same interface as
+    stepped.SteppedSystem.
+
+    Methods:
+        init_system(figure, collection=False)
+        next_frame(f)
+        check_collide(end_t=0)
+        advance(step)
+        tick(step)
+        sync_balls()
+        get_balls()
+        get_container()
+        get_positions()
+        get_velocities()
+        get_time()
+        get_dt()
+        get_cell_size()
+        get_num_collisions()
+        total_KE()
+        mean_KE()
+        temperature()
+        pressure(step)
+        get_total_momentum()
+    """
+
+    def __init__(self, balls, container, dt=None, cell_size=None,
+                 seed=None):
+        """Initialise the system with objects
+
+        Args:
+            balls: list, objects.Ball to include in system, copied into
+                arrays as in stepped.SteppedSystem. Or dict of
+                numpy.arrays pos, vel, radius and mass, as from
+                System.get_state(), for when there are too many balls
+                to make Ball objects for.
+            container: objects.Container for system
+            dt: float, time step in seconds. If None, the time a ball at
+                the mean speed takes to cross a fifth of a cell or of
+                the mean free path, whichever is shorter.
+            cell_size: float, side of the cells pairs are chosen from.
+                If None, a third of the mean free path, but no smaller
+                than would hold one ball per cell on average, and no
+                larger than half the smallest semi-axis of the
+                container, so pairs are never picked from the whole gas.
+                Cells wider than the mean free path are logged as a
+                warning.
+            seed: int or None, seed for the random numbers, so a run can
+                be repeated
+        """
+        if isinstance(container, objects.Container) is False:
+            raise TypeError("container is not instance of Container")
+        if isinstance(balls, dict):
+            self._balls = None
+            state = balls
+        elif type(balls) is list:
+            self._balls = balls
+            state = {"pos": [ball.get_pos() for ball in balls],
+                     "vel": [ball.get_vel() for ball in balls],
+                     "radius": [ball.get_radius() for ball in balls],
+                     "mass": [ball.get_mass() for ball in balls]}
+        else:
+            raise TypeError("balls is not of type list or dict")
+        if dt is not None and dt <= 0:
+            raise ValueError("dt is {}, should be positive".format(dt))
+        if cell_size is not None and cell_size <= 0:
+            raise ValueError("cell_size is {}, should be positive".format(
+                cell_size))
+
+        self._container = container
+        self._pos = _np.array(state["pos"], dtype=float)
+        self._vel = _np.array(state["vel"], dtype=float)
+        self._radius = _np.array(state["radius"], dtype=float)
+        self._mass = _np.array(state["mass"], dtype=float)
+        self._axes = container.get_axes()
+        self._dim = container.get_dim()
+        if self._pos.shape[1] != self._dim:
+            raise ValueError("balls do not have {} components like "
+                             "container".format(self._dim))
+        outside = _np.sum(~container.contains(self._pos, self._radius))
+        if outside > 0:
+            raise ValueError("{} balls are not inside the container".format(
+                outside))
+        self._random = _np.random.RandomState(seed)
+
+        n = len(self._pos)
+        speed = _np.mean(_np.sqrt(_np.sum(self._vel * self._vel, axis=1)))
+        V = container.get_volume()
+        # mean free path, as in engines.characterise
+        path = V / (_np.sqrt(2) * n * self._sigma(2 * _np.mean(self._radius)))
+        if cell_size is None:
+            cell_size = min(max(path / 3., (V / n) ** (1. / self._dim)),
+                            0.5 * _np.min(self._axes))
+        self._cell_size = float(min(cell_size, 2 * _np.max(self._axes)))
+        if self._cell_size > path:
+            core.logging.log(30, "cells are {:.3g} mean free paths across, "
+                             "so balls collide from further apart than "
+                             "they travel between collisions".format(
+                                 self._cell_size / path))
+        if dt is None:
+            dt = 0.2 * min(self._cell_size, path) / speed
+        self._dt = float(dt)
+        self._make_cells()
+        # (sigma g)_max of each cell, started above anything possible
+        g_max = 2 * _np.sqrt(_np.max(_np.sum(self._vel * self._vel, axis=1)))
+        self._sg_max = _np.full(len(self._volume), self._sigma(
+            2 * _np.max(self._radius)) * g_max)
+        # fraction of a candidate pair carried over to the next step
+        self._remainder = _np.zeros(len(self._volume))
+
+        self._wall_momentum = _np.zeros(self._dim)
+        self._wall_impulse = 0.
+        self._num_collisions = 0
+        self._time = 0.
+        self._frame = 0
+        self._collection = None
+        core.logging.log(15, "DSMCSystem dt = {}, cell size {}, {} "
+                         "cells".format(self._dt, self._cell_size,
+                                        len(self._volume)))
+
+    def __repr__(self):
+        return "DSMCSystem(n={}, dt={}, cell_size={})".format(
+            len(self._pos), self._dt, self._cell_size)
+
+    def _sigma(self, d):
+        """Return cross section of balls whose radii add up to *d*,
+        a length in 2D"""
+        if self._dim == 3:
+            return _np.pi * d * d
+        return 2 * d
+
+    def _make_cells(self, samples=4, chunk=10000):
+        """Lay the grid over the container, and find the volume of each
+        cell the centres of balls can reach
+
+        Volumes come from a lattice of *samples* points along each side
+        of a cell, so cells cut by the wall are not counted as full.
+        """
+        self._shape = _np.ceil(
+            2 * self._axes / self._cell_size).astype(_np.int64)
+        self._origin = -0.5 * self._shape * self._cell_size
+        self._strides = _np.cumprod(
+            _np.concatenate(([1], self._shape[:0:-1])))[::-1]
+        cells = _np.indices(self._shape).reshape(self._dim, -1).T
+        ticks = (_np.arange(samples) + 0.5) / samples
+        lattice = _np.array(_np.meshgrid(*[ticks] * self._dim)).reshape(
+            self._dim, -1).T
+        radius = _np.mean(self._radius)
+        inside = _np.empty(len(cells))
+        for k in xrange(0, len(cells), chunk):
+            corner = self._origin + self._cell_size * cells[k:k + chunk]
+            points = (corner[:, None, :] +
+                      self._cell_size * lattice[None, :, :]).reshape(
+                          -1, self._dim)
+            inside[k:k + chunk] = _np.mean(self._container.contains(
+                points, _np.full(len(points), radius)).reshape(
+                    -1, len(lattice)), axis=1)
+        # a ball can sit in a cell no lattice point of which is inside
+        inside = _np.maximum(inside, 0.5 / len(lattice))
+        self._volume = inside * self._cell_size ** self._dim
+
+    def _cells(self):
+        """Return the cell number of each ball"""
+        cells = _np.floor((self._pos - self._origin) / self._cell_size)
+        cells = _np.clip(cells.astype(_np.int64), 0, self._shape - 1)
+        return _np.dot(cells, self._strides)
+
+    def init_system(self, figure, collection=False):
+        """Initialise system.
+
+        If animating, draw objects in their starting positions on
+        *figure*, as in System.init_system(). Without Ball objects the
+        balls are always drawn as one collection.
+        """
+        if figure is None:
+            return None
+        figure.add_artist(self._container.get_patch())
+        if collection or self._balls is None:
+            diameters = 2 * self._radius
+            self._collection = _collections.EllipseCollection(
+                diameters, diameters, _np.zeros(len(self._pos)),
+                units='xy', offsets=self._pos[:, :2],
+                transOffset=figure.transData)
+            figure.add_collection(self._collection)
+            return [self._collection]
+        ret = []
+        for ball in self._balls:
+            figure.add_patch(ball.get_patch())
+            ret.append(ball.get_patch())
+        return ret
+
+    def next_frame(self, f):
+        """Called by matplotlib.animation.FuncAnimation()
+
+        Advance time to when frame *f* occurs and draw objects.
+        """
+        self.check_collide()
+        self.tick((f / FRAMERATE) - self._time)
+        self._frame = f
+        if self._collection is not None:
+            self._collection.set_offsets(self._pos[:, :2])
+            return [self._collection]
+        self.sync_balls()
+        return [ball.get_patch() for ball in self._balls]
+
+    def check_collide(self, end_t=0):
+        """Step the system up to *end_t*, or the next frame if 0"""
+        if end_t == 0:
+            end_t = (self._frame + 1) / FRAMERATE
+        while end_t - self._time > self._dt:
+            self._step(self._dt)
+        self._step(end_t - self._time)
+
+    def advance(self, step):
+        """Move the system forward in time by *step* seconds"""
+        self.check_collide(self._time + step)
+
+    def tick(self, step):
+        """Move balls by *step* seconds, bouncing off the wall, without
+        colliding them with each other
+
+        Raises RuntimeError if a ball hits the wall more than
+        _MAX_BOUNCES times, which only a ball stuck at the wall does.
+        """
+        if step <= 0:
+            return None
+        remaining = _np.full(len(self._pos), float(step))
+        active = _np.arange(len(self._pos))
+        for bounce in xrange(_MAX_BOUNCES):
+            t = self._exit(active)
+            hit = t < remaining[active]
+            free = active[~hit]
+            self._pos[free] += self._vel[free] * remaining[free, None]
+            active = active[hit]
+            if len(active) == 0:
+                break
+            t = t[hit]
+            self._pos[active] += self._vel[active] * t[:, None]
+            remaining[active] -= t
+            vel, dp = kernels.reflect(
+                self._pos[active], self._vel[active], self._mass[active],
+                self._radius[active], self._axes)
+            self._vel[active] = vel
+            self._wall_momentum += _np.sum(dp, axis=0)
+            self._wall_impulse += _np.sum(_np.sqrt(_np.sum(dp * dp, axis=1)))
+        else:
+            raise RuntimeError("{} balls still hitting the wall after {} "
+                               "hits in one step".format(len(active),
+                                                         _MAX_BOUNCES))
+        self._time += step
+
+    def _exit(self, idx):
+        """Return time until balls *idx* leave the space their centres
+        can reach
+
+        From kernels.exit_time(), which ignores no times for being
+        close to zero, so a ball just short of the wall is never missed.
+        """
+        return kernels.exit_time(self._pos[idx], self._vel[idx],
+                                 self._radius[idx], self._axes)
+
+    def _step(self, step):
+        """Move balls by *step*, then collide pairs in each cell"""
+        if step <= 0:
+            return None
+        self.tick(step)
+        self._collide(step)
+
+    def _collide(self, step):
+        """Carry out the collisions of *step* seconds with the NTC scheme
+
+        Candidate pairs of every cell are picked at once. A ball can
+        only be in one collision at a time, so candidates sharing a ball
+        with an earlier one wait for the next round, and are judged on
+        the velocities after it.
+        """
+        cell = self._cells()
+        order = _np.argsort(cell, kind="mergesort")
+        ids, start, count = _np.unique(cell[order], return_index=True,
+                                       return_counts=True)
+        full = count >= 2
+        ids, start, count = ids[full], start[full], count[full]
+        expected = (0.5 * count * (count - 1) * self._sg_max[ids] * step /
+                    self._volume[ids] + self._remainder[ids])
+        tries = _np.floor(expected).astype(_np.int64)
+        self._remainder[ids] = expected - tries
+        if _np.sum(tries) == 0:
+            return None
+        c = _np.repeat(_np.arange(len(ids)), tries)
+        i = _np.floor(self._random.random_sample(len(c)) *
+                      count[c]).astype(_np.int64)
+        j = _np.floor(self._random.random_sample(len(c)) *
+                      (count[c] - 1)).astype(_np.int64)
+        # two different balls of the cell
+        j += j >= i
+        i = order[start[c] + i]
+        j = order[start[c] + j]
+        cell = ids[c]
+        pending = _np.arange(len(c))
+        while len(pending) > 0:
+            pairs = _np.column_stack((i[pending], j[pending])).ravel()
+            _, first = _np.unique(pairs, return_index=True)
+            first_use = _np.zeros(len(pairs), dtype=bool)
+            first_use[first] = True
+            ready = first_use[0::2] & first_use[1::2]
+            self._try(i[pending[ready]], j[pending[ready]],
+                      cell[pending[ready]])
+            pending = pending[~ready]
+
+    def _try(self, i, j, cell):
+        """Collide each pair of balls *i*, *j* from *cell* with
+        probability sigma g / (sigma g)_max, no ball in two pairs"""
+        g = self._vel[i] - self._vel[j]
+        speed = _np.sqrt(_np.sum(g * g, axis=1))
+        d = self._radius[i] + self._radius[j]
+        sg = self._sigma(d) * speed
+        # keep the bound above every sigma g seen
+        _np.maximum.at(self._sg_max, cell, sg)
+        keep = self._random.random_sample(len(i)) * self._sg_max[cell] < sg
+        i, j, g, speed, d = i[keep], j[keep], g[keep], speed[keep], d[keep]
+        if len(i) == 0:
+            return None
+        # line of centres at contact for a random impact parameter,
+        # spread evenly over the cross section
+        along = g / speed[:, None]
+        across = self._random.standard_normal((len(i), self._dim))
+        across -= _np.sum(across * along, axis=1)[:, None] * along
+        across /= _np.sqrt(_np.sum(across * across, axis=1))[:, None]
+        b = self._random.random_sample(len(i)) ** (1. / (self._dim - 1))
+        normal = (along * _np.sqrt(1 - b * b)[:, None] +
+                  across * b[:, None])
+        vel_i, vel_j = kernels.elastic(
+            _np.zeros_like(normal), self._vel[i], self._mass[i],
+            normal, self._vel[j], self._mass[j])
+        self._vel[i] = vel_i
+        self._vel[j] = vel_j
+        self._num_collisions += len(i)
+
+    def sync_balls(self):
+        """Copy positions and velocities back to the Ball objects, if
+        there are any"""
+        if self._balls is None:
+            return None
+        for ball, pos, vel in zip(self._balls, self._pos, self._vel):
+            ball.set_pos(pos)
+            ball.set_vel(vel)
+
+    def get_balls(self):
+        """Return list of balls, only up to date after sync_balls(). None
+        if made without Ball objects"""
+        return self._balls
+
+    def get_container(self):
+        """Return the container of the system"""
+        return self._container
+
+    def get_positions(self):
+        """Return positions of all balls as numpy.array, shape (n, dim)"""
+        return self._pos
+
+    def get_velocities(self):
+        """Return velocities of all balls as numpy.array, shape (n, dim)"""
+        return self._vel
+
+    def get_time(self):
+        """Return current time of system in seconds as float"""
+        return self._time
+
+    def get_dt(self):
+        """Return time step in seconds as float"""
+        return self._dt
+
+    def get_cell_size(self):
+        """Return side of the cells pairs are chosen from as float"""
+        return self._cell_size
+
+    def get_num_collisions(self):
+        """Return number of ball-ball collisions so far as int"""
+        return self._num_collisions
+
+    def total_KE(self):
+        """Return total system KE as float"""
+        return 0.5 * core.MASS * _np.sum(
+            self._mass * _np.sum(self._vel * self._vel, axis=1))
+
+    def mean_KE(self):
+        """Return mean ball KE as float"""
+        return self.total_KE() / len(self._pos)
+
+    def temperature(self):
+        """Return temperature of system as float"""
+        return (2. / self._dim) * self.mean_KE() / Kb
+
+    def pressure(self, step):
+        """Return pressure of system averaged over *step* seconds as float"""
+        p0 = self._wall_impulse * core.MASS
+        self.advance(step)
+        p1 = self._wall_impulse * core.MASS
+        F = (p1 - p0) / step
+        return F / self._container.get_area()
+
+    def get_total_momentum(self):
+        """Return total momentum of container and all balls. Should be zero"""
+        return (_np.sum(self._mass[:, None] * self._vel, axis=0) +
+                self._wall_momentum)
+
+
+def _lattice(n, radius, ballsize, dim, planar):
+    """Return positions of *n* balls on the grid distributeBalls uses,
+    in a cube (square) whose corners are *ballsize* inside the sphere
+    (circle) of *radius*, rather than one whose corners stick out"""
+    if dim == 3:
+        side_len = 2 * (radius - ballsize) / _np.sqrt(3)
+    else:
+        side_len = _np.sqrt(2) * (radius - ballsize)
+    if dim == 3:
+        per_row = int(_np.ceil(n ** (1. / 3.)))
+    else:
+        per_row = int(_np.ceil(_np.sqrt(n)))
+    if 2 * ballsize * per_row >= side_len:
+        raise ValueError("Too many balls. Got {}".format(n))
+    k = _np.arange(n)
+    ballspace = side_len / per_row
+    if dim == 3:
+        # rows are y, columns x and layers z, layers changing fastest
+        cells = _np.column_stack(((k // per_row) % per_row,
+                                  k // (per_row * per_row), k % per_row))
+    else:
+        cells = _np.column_stack((k % per_row, k // per_row))
+    pos = (cells + 0.5) * ballspace - side_len / 2
+    if dim == 3:
+        return pos
+    if planar:
+        return pos
+    return _np.column_stack((pos, _np.zeros(n)))
+
+
+def makeGas(n, radius, ballsize=1, v=8., dim=3, planar=False,
+            temperature=None, **kwargs):
+    """Return DSMCSystem of *n* balls in a Container of *radius*
+
+    Balls start on the same kind of grid as objects.distributeBalls
+    would put them on, but one that fits inside the container, and with
+    the same velocities for the same state of numpy.random. No Ball
+    objects are made, which would take longer than the run for millions
+    of balls. Other keyword arguments are passed to DSMCSystem.
+    """
+    if n <= 0 or n % 1 != 0:
+        raise ValueError("n is {}, should be a positive integer".format(n))
+    if ballsize <= 0:
+        raise ValueError("ballsize is {}, should be positive".format(ballsize))
+    n = int(n)
+    radius = abs(float(radius))
+    pos = _lattice(n, radius, ballsize, dim, planar)
+    if temperature is None:
+        vx, vy, vz = objects._distributeVelocities(n=n, v=v, dim=dim)
+    elif dim == 2 and not planar:
+        vx, vy, vz = objects._maxwellVelocities(n, temperature, dim=2, dof=3)
+    else:
+        vx, vy, vz = objects._maxwellVelocities(n, temperature, dim=dim,
+                                                dof=dim)
+    if dim == 2 and planar:
+        vel = _np.column_stack((vx, vy))
+    else:
+        vel = _np.column_stack((vx, vy, vz))
+    state = {"pos": pos, "vel": vel, "radius": _np.full(n, float(ballsize)),
+             "mass": _np.ones(n)}
+    return DSMCSystem(state, objects.Container(radius, dim=pos.shape[1]),
+                      **kwargs)
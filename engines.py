@@ -0,0 +1,388 @@
+"""
+Choose the fastest engine and its settings for a set of balls
+
+The engines are system.System one collision at a time (the reference),
+System with batch_tol set (vectorised prediction), System with orbits
+set (wall hits in closed form, spherical containers only) and
+stepped.SteppedSystem. dsmc.DSMCSystem is only used when asked for by
+name: it is right on average for dilute gases only, so it is never
+chosen. Which is fastest depends on the number of balls, how densely
+they are packed and how much their sizes vary.
+
+A cost model predicts the wall clock time of one simulated second for
+each engine. Kinetic theory gives how much work each does per simulated
+second: collisions for the event and batched engines, collisions
+between balls plus horizon checks for orbits, and time steps for the
+stepped engine. Each unit of work costs a fixed time plus a time per
+ball. calibrate() measures those constants once per process on small
+gases. The batch tolerance and the stepped engine's grid are chosen
+with the same model, and the time step is the largest the stepped
+engine allows.
+
+Every engine's cost is proportional to the speed of the balls, so which
+is fastest only depends on the number, packing and sizes of the balls
+and on the container. The batch tolerance also depends on the time
+between collisions, which is shorter for faster balls. A choice is
+made once for each container, number, packing, sizes and batch
+tolerance. Before it is trusted, the chosen engine is run next to the
+reference on copies of the balls, and their pressure and energy must
+agree. Otherwise the reference is used.
+
+Defines:
+    ENGINES, tuple, engine names
+    characterise(balls, container), function,
+        number, packing fraction and size dispersity of balls
+    calibrate(), function, constants of the cost model
+    costs(info, calibration, orbits=True), function,
+        predicted cost and settings of each engine
+    check(balls, container, name, settings), function,
+        compare an engine with the reference on copies of the balls
+    choose(balls, container, verify=True), function,
+        name and settings of the fastest engine
+    makeSystem(balls, container, engine="auto"), function,
+        build the chosen engine
+
+Ethan Mills
+"""
+import time
+
+import core
+import dsmc
+import objects
+import stepped
+import system
+
+import numpy as _np
+
+
+ENGINES = ("event", "batched", "stepped", "orbit", "dsmc")
+# tolerance used for the batched engine when asked for by name
+BATCH_TOL = 1E-9
+# tolerances choose() can give the batched engine. Each must be less
+# than BATCH_ACCURACY of the time between collisions of one ball.
+BATCH_TOLS = (1E-9, 1E-7, 1E-5)
+BATCH_ACCURACY = 1E-4
+# above this many balls a choice is checked against the batched engine,
+# which does the same collisions as the reference with numpy
+MAX_REFERENCE = 500
+# collisions run by check()
+CHECK_EVENTS = 1000
+# relative energy change check() allows in that time
+ENERGY_TOL = 1E-9
+
+_calibration = None
+_decisions = {}
+
+
+def characterise(balls, container):
+    """Return dict describing *balls* in *container*
+
+    Keys:
+        n: int, number of balls
+        dim: int, number of dimensions
+        packing: float, fraction of the container volume (area in 2D)
+            filled by balls
+        dispersity: float, largest radius / smallest radius
+        min_radius, max_radius, mean_radius: float, of the balls
+        speed: float, mean speed of balls
+        max_speed: float, speed of the fastest ball
+        pair_rate: float, estimate of collisions between balls per
+            second from kinetic theory
+        event_rate: float, as pair_rate, plus wall hits
+    """
+    dim = container.get_dim()
+    radius = _np.array([ball.get_radius() for ball in balls])
+    speeds = _np.array([_np.sqrt(_np.dot(ball.get_vel(), ball.get_vel()))
+                        for ball in balls])
+    speed = _np.mean(speeds)
+    V = container.get_volume()
+    A = container.get_area()
+    n = len(balls)
+    if dim == 3:
+        filled = _np.sum((4. / 3.) * _np.pi * radius ** 3)
+        cross_section = _np.pi * (2 * _np.mean(radius)) ** 2
+        chord = 4 * V / A
+    else:
+        filled = _np.sum(_np.pi * radius ** 2)
+        cross_section = 4 * _np.mean(radius)
+        chord = _np.pi * V / A
+    # collisions per ball per second
+    nu = _np.sqrt(2) * (n / V) * cross_section * speed
+    return {"n": n,
+            "dim": dim,
+            "volume": V,
+            "packing": filled / V,
+            "dispersity": _np.max(radius) / _np.min(radius),
+            "min_radius": _np.min(radius),
+            "max_radius": _np.max(radius),
+            "mean_radius": _np.mean(radius),
+            "speed": speed,
+            "max_speed": _np.max(speeds),
+            "radius": abs(container.get_radius()),
+            "pair_rate": 0.5 * n * nu,
+            "event_rate": 0.5 * n * nu + n * speed / chord}
+
+
+def _copy(balls, container):
+    """Return copies of *balls* and *container* to run probes on"""
+    copies = [objects.Ball(mass=ball.get_mass(), radius=ball.get_radius(),
+                           pos=list(ball.get_pos()),
+                           vel=list(ball.get_vel()))
+              for ball in balls]
+    # a fresh container of the same shape
+    return copies, container.inset(0.)
+
+
+def _build(name, balls, container, settings):
+    """Return engine *name* made with *settings*"""
+    if name == "stepped":
+        return stepped.SteppedSystem(balls, container, **settings)
+    if name == "dsmc":
+        return dsmc.DSMCSystem(balls, container, **settings)
+    return system.System(balls, container, **settings)
+
+
+def _candidate_pairs(info, cell):
+    """Return estimate of pairs a grid with cells of side *cell* looks
+    at, for balls described by *info*"""
+    return 0.5 * info["n"] * (info["n"] / info["volume"]) * (
+        3 * cell) ** info["dim"]
+
+
+def _work(name, info, settings):
+    """Return units of work per simulated second of engine *name*
+
+    Collisions for the event engines, batches for the batched engine,
+    and for the stepped engine time steps weighted by balls plus
+    candidate pairs per ball.
+    """
+    if name == "event":
+        return info["event_rate"]
+    if name == "batched":
+        # collisions within the tolerance of the first share its batch
+        return info["event_rate"] / (
+            1 + info["event_rate"] * settings["batch_tol"])
+    if name == "orbit":
+        # every ball is looked at again each horizon
+        return info["pair_rate"] + info["n"] * info["max_speed"] / \
+            info["radius"]
+    if settings["index"] == "multi":
+        cell = 2 * info["mean_radius"]
+    else:
+        cell = 2 * info["max_radius"]
+    dt = 0.1 * info["min_radius"] / info["max_speed"]
+    return (1 + _candidate_pairs(info, cell) / info["n"]) / dt
+
+
+def _probe_gas(n):
+    """Return balls and container used to calibrate the cost model"""
+    state = _np.random.get_state()
+    _np.random.seed(0)
+    balls = objects.distributeBalls(n, 12, ballsize=0.3, v=10., dim=3)
+    # leave the caller's random numbers as they were
+    _np.random.set_state(state)
+    return balls, objects.Container(12)
+
+
+def calibrate(sizes=(50, 200), events=100):
+    """Return dict of (fixed, per ball) seconds per unit of work of each
+    engine
+
+    Each engine runs on the gases of _probe_gas() for *sizes* balls,
+    for the time kinetic theory says *events* collisions take, or 20
+    time steps for the stepped engine. A straight line through the two
+    costs gives the constants. Measured once per process, later calls
+    return the same dict.
+    """
+    global _calibration
+    if _calibration is not None:
+        return _calibration
+    settings = {"event": {"batch_tol": None},
+                "batched": {"batch_tol": BATCH_TOL},
+                "orbit": {"orbits": True},
+                "stepped": {"index": "uniform"}}
+    start = time.time()
+    per_work = dict((name, []) for name in settings)
+    for n in sizes:
+        balls, cont = _probe_gas(n)
+        info = characterise(balls, cont)
+        for name in settings:
+            copies, fresh = _copy(balls, cont)
+            engine = _build(name, copies, fresh, settings[name])
+            engine.init_system(None)
+            if name == "stepped":
+                duration = 20 * engine.get_dt()
+            else:
+                duration = events / info["event_rate"]
+            t = time.time()
+            engine.advance(duration)
+            work = _work(name, info, settings[name]) * duration
+            per_work[name].append((time.time() - t) / work)
+    _calibration = {}
+    for name, cost in per_work.items():
+        per_ball = max((cost[1] - cost[0]) / (sizes[1] - sizes[0]), 0.)
+        _calibration[name] = (max(cost[0] - per_ball * sizes[0], 0.),
+                              per_ball)
+    core.logging.log(20, "calibrated cost model in {:.2f} s: {}".format(
+        time.time() - start, _calibration))
+    return _calibration
+
+
+def _batch_tol(info):
+    """Return the largest of BATCH_TOLS that stays accurate for balls
+    described by *info*"""
+    # time between collisions of one ball
+    between = info["n"] / (2 * info["pair_rate"]) if \
+        info["pair_rate"] > 0 else _np.inf
+    tols = [tol for tol in BATCH_TOLS if tol <= BATCH_ACCURACY * between]
+    return max(tols or [BATCH_TOL])
+
+
+def costs(info, calibration, orbits=True):
+    """Return dicts of predicted seconds per simulated second and of the
+    settings of each engine, for balls described by *info*
+
+    Each engine's settings are the cheapest the model finds among those
+    accurate enough. Leave out the orbit engine if not *orbits*.
+    """
+    settings = {"event": {"batch_tol": None},
+                "batched": {"batch_tol": _batch_tol(info)}}
+    if orbits:
+        settings["orbit"] = {"orbits": True}
+    # the grid that looks at fewer pairs, the largest time step
+    # SteppedSystem allows
+    if _work("stepped", info, {"index": "multi"}) < \
+            _work("stepped", info, {"index": "uniform"}):
+        settings["stepped"] = {"index": "multi"}
+    else:
+        settings["stepped"] = {"index": "uniform"}
+    predicted = {}
+    for name in settings:
+        fixed, per_ball = calibration[name]
+        predicted[name] = _work(name, info, settings[name]) * (
+            fixed + per_ball * info["n"])
+    return predicted, settings
+
+
+def _observe(engine, duration, blocks):
+    """Run *engine* for *duration* in *blocks*, return relative energy
+    change, mean pressure and its standard error"""
+    engine.init_system(None)
+    KE0 = engine.total_KE()
+    P = [engine.pressure(float(duration) / blocks) for k in xrange(blocks)]
+    return (abs(engine.total_KE() - KE0) / KE0, _np.mean(P),
+            _np.std(P, ddof=1) / _np.sqrt(blocks))
+
+
+def _reference(info):
+    """Return name and settings of the engine choices are checked
+    against, for balls described by *info*"""
+    if info["n"] > MAX_REFERENCE:
+        return "batched", {"batch_tol": BATCH_TOL}
+    return "event", {"batch_tol": None}
+
+
+def check(balls, container, name, settings, events=CHECK_EVENTS, blocks=10,
+          z_max=3.):
+    """Return True if engine *name* with *settings* gives the same
+    physics as the reference on copies of *balls*
+
+    Both run for the time *events* collisions take, measuring pressure
+    in *blocks* blocks. Their pressures must agree within *z_max*
+    standard errors and energy change by less than ENERGY_TOL.
+    Above MAX_REFERENCE balls the batched engine stands in for the
+    reference.
+    """
+    info = characterise(balls, container)
+    duration = events / info["event_rate"]
+    reference = _reference(info)
+    results = {}
+    for engine in (reference, (name, settings)):
+        copies, cont = _copy(balls, container)
+        results[engine[0]] = _observe(_build(engine[0], copies, cont,
+                                             engine[1]), duration, blocks)
+    ref, fast = results[reference[0]], results[name]
+    err = _np.sqrt(ref[2] ** 2 + fast[2] ** 2)
+    if err > 0:
+        z = abs(fast[1] - ref[1]) / err
+    else:
+        z = 0. if fast[1] == ref[1] else _np.inf
+    passed = z <= z_max and fast[0] <= ENERGY_TOL
+    core.logging.log(20 if passed else 30,
+                     "{} against {}: P {:.4g} +/- {:.2g} vs {:.4g} +/- {:.2g}"
+                     ", z {:.2f}, energy change {:.1e}, {}".format(
+                         name, reference[0], fast[1], fast[2], ref[1],
+                         ref[2], z, fast[0], "ok" if passed else "FAILED"))
+    return passed
+
+
+def _key(info, container):
+    """Return the configuration a choice is saved under
+
+    Speed is left out as it scales every engine's cost alike, but the
+    batch tolerance it allows is kept, so a choice made for a hot gas is
+    not used for a cold one with too loose a tolerance.
+    """
+    return (info["n"], info["dim"], tuple(container.get_axes()),
+            isinstance(container, objects.EllipticalContainer),
+            "{:.3g}".format(info["packing"]),
+            "{:.3g}".format(info["dispersity"]), _batch_tol(info))
+
+
+def choose(balls, container, verify=True):
+    """Return name and settings of the fastest engine for *balls*
+
+    The engine with the lowest cost from costs() is checked with
+    check() if *verify*, falling back to the reference if it fails.
+    Choices are saved per configuration, so later calls for balls of
+    the same number, packing and sizes in the same container, allowing
+    the same batch tolerance, cost nothing. Returns (name, settings
+    dict, costs dict), the costs predicted for the balls the choice was
+    made for.
+    """
+    info = characterise(balls, container)
+    key = _key(info, container)
+    if key in _decisions:
+        return _decisions[key]
+    predicted, settings = costs(
+        info, calibrate(),
+        orbits=not isinstance(container, objects.EllipticalContainer))
+    best = min(predicted, key=predicted.get)
+    reference = _reference(info)
+    core.logging.log(20, "chose {} engine {}: n {n}, packing {packing:.3g}, "
+                     "dispersity {dispersity:.3g}; predicted seconds per "
+                     "simulated second {costs}".format(
+                         best, settings[best], costs=predicted, **info))
+    choice = best, settings[best]
+    if verify and choice != reference and not check(balls, container,
+                                                    *choice):
+        core.logging.log(30, "{} engine disagrees with the reference, "
+                         "using {}".format(best, reference[0]))
+        choice = reference
+    _decisions[key] = choice + (predicted,)
+    return _decisions[key]
+
+
+def makeSystem(balls, container, engine="auto", verify=True):
+    """Return a System, SteppedSystem or DSMCSystem for *balls* in
+    *container*
+
+    *engine* is one of ENGINES, or "auto" to pick the fastest with
+    choose(), checked against the reference if *verify*.
+    """
+    if engine == "auto":
+        engine, settings, predicted = choose(balls, container, verify)
+    elif engine == "event":
+        settings = {"batch_tol": None}
+    elif engine == "batched":
+        settings = {"batch_tol": BATCH_TOL}
+    elif engine == "stepped":
+        settings = {"index": "auto"}
+    elif engine == "orbit":
+        settings = {"orbits": True}
+    elif engine == "dsmc":
+        settings = {}
+    else:
+        raise ValueError("engine is {}, should be auto or one of {}".format(
+            engine, ENGINES))
+    return _build(engine, balls, container, settings)
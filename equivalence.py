@@ -0,0 +1,232 @@
+"""
+Check that fast engines give the same physics as the reference System
+
+The reference is System carrying out one collision at a time with
+Ball.time_to_collision and Ball.collide. Each fast engine is run on
+balls made from the same seed, and compared on:
+    the sequence of collisions, up to the point where rounding errors,
+        which hard spheres amplify, make the runs diverge
+    conservation of energy and momentum
+    pressure and temperature, within their statistical errors
+The stepped and DSMC engines have no collision events, so only the last
+two are compared for them. The orbit engine has no wall events either, but logs
+the wall hits it works out in closed form, so its events are compared
+too.
+
+Defines:
+    make_balls(seed, n=60, radius=12., ballsize=0.5, v=10., dim=3),
+        function, the same balls every time for a seed
+    compare_events(ref, fast, tol=1E-6, window=8), function,
+        how far two event logs agree
+    compare(engine, seed=0, ...), function, compare one engine with the
+        reference
+    CONFIGS, dict, keyword arguments to make_balls for a dense gas and
+        a dilute one where balls almost only hit the wall
+    SKIP, dict, engines not compared for a configuration
+    BATCH_TOL, float, tolerance of the batched engine
+    check(names=("batched", "stepped", "orbit", "dsmc"), seeds=(0, 1, 2),
+        configs=("dense", "dilute"), **kwargs),
+        function, compare several engines, seeds and configurations,
+        print a summary
+
+Ethan Mills
+"""
+import core
+import engines
+import objects
+import system
+
+import numpy as _np
+
+
+# dense fills 16% of the container, and its lattice starts balls 0.1
+# apart, so many collisions come close together
+CONFIGS = {"dense": {"n": 125, "ballsize": 1.3},
+           "dilute": {"ballsize": 0.01}}
+# engines only right for some configurations. DSMC leaves out the
+# volume of the balls, so its pressure is too low for a dense gas.
+SKIP = {"dense": ("dsmc",)}
+# tolerance the batched engine is compared at, the largest
+# engines.choose() gives these gases, so that collisions close together
+# in the dense gas are carried out in one batch
+BATCH_TOL = 1E-5
+
+
+def make_balls(seed, n=60, radius=12., ballsize=0.5, v=10., dim=3):
+    """Return balls and container made from *seed*
+
+    Balls are placed by objects.distributeBalls in a container of
+    *radius*, with *dim* 2 giving planar balls.
+    """
+    _np.random.seed(seed)
+    # distributeBalls fills a cube whose corners can poke out of a
+    # sphere of the radius it is given
+    balls = objects.distributeBalls(n, radius * 0.8, ballsize=ballsize, v=v,
+                                    dim=dim, planar=(dim == 2))
+    return balls, objects.Container(radius, dim=dim)
+
+
+def compare_events(ref, fast, tol=1E-6, window=8):
+    """Return how far two event logs from System.log_events() agree
+
+    Each event of *ref* must be matched, in order, by one of the next
+    *window* unmatched events of *fast* between the same two objects
+    and within *tol* seconds. Collisions at almost the same time may
+    be done in either order, and the batched engine does them up to
+    its tolerance early.
+
+    Returns (number matched, time of the first unmatched event of *ref*
+    or None if all matched, largest time difference of matched events).
+    """
+    used = [False] * len(fast)
+    start = 0
+    matched = 0
+    max_dt = 0.
+    for t, i, j in ref:
+        pair = set((i, j))
+        found = None
+        for k in xrange(start, min(start + window, len(fast))):
+            if (not used[k] and set(fast[k][1:]) == pair and
+                    abs(fast[k][0] - t) <= tol):
+                found = k
+                break
+        if found is None:
+            return matched, t, max_dt
+        used[found] = True
+        max_dt = max(max_dt, abs(fast[found][0] - t))
+        matched += 1
+        while start < len(fast) and used[start]:
+            start += 1
+    return matched, None, max_dt
+
+
+def _measure(mySys, measure, blocks):
+    """Return wall pressure, its error and temperature of *mySys*"""
+    if isinstance(mySys, system.System):
+        stats = mySys.pressure_stats(measure, blocks)
+        return (stats["wall_pressure"], stats["wall_pressure_err"],
+                mySys.temperature())
+    P = [mySys.pressure(float(measure) / blocks) for i in xrange(blocks)]
+    return (_np.mean(P), _np.std(P, ddof=1) / _np.sqrt(blocks),
+            mySys.temperature())
+
+
+def _run(engine, seed, t_events, measure, blocks, config, batch_tol):
+    """Run *engine* on the balls for *seed*, return dict of results
+
+    The batched engine uses *batch_tol*.
+    """
+    balls, cont = make_balls(seed, **config)
+    if engine == "batched":
+        mySys = system.System(balls, cont, batch_tol=batch_tol)
+    else:
+        mySys = engines.makeSystem(balls, cont, engine)
+    exact = isinstance(mySys, system.System)
+    if exact:
+        log = mySys.log_events()
+    else:
+        log = None
+    mySys.init_system(None)
+    if exact:
+        KE0 = mySys.total_KE(exact=True)
+    else:
+        KE0 = mySys.total_KE()
+    mySys.check_collide(t_events)
+    P, P_err, T = _measure(mySys, measure, blocks)
+    if exact:
+        KE1 = mySys.total_KE(exact=True)
+        p = mySys.get_total_momentum(exact=True)
+    else:
+        KE1 = mySys.total_KE()
+        p = mySys.get_total_momentum()
+    scale = sum(ball.get_mass() * _np.sqrt(_np.dot(ball.get_vel(),
+                                                   ball.get_vel()))
+                for ball in balls)
+    return {"events": log,
+            "energy_drift": abs(KE1 - KE0) / KE0,
+            "momentum": _np.sqrt(_np.dot(p, p)) / scale,
+            "pressure": P,
+            "pressure_err": P_err,
+            "temperature": T}
+
+
+def compare(engine, seed=0, t_events=1., measure=5., blocks=10, tol=1E-6,
+            min_events=50, energy_tol=1E-9, momentum_tol=1E-9, z_max=3.,
+            batch_tol=BATCH_TOL, **config):
+    """Compare *engine* with the reference on the balls for *seed*
+
+    Both run for *t_events* seconds with their collisions logged, then
+    measure pressure for *measure* seconds in *blocks* blocks. The
+    batched engine uses *batch_tol*, and events are matched to within
+    it. Other keyword arguments go to make_balls().
+
+    Returns dict with keys:
+        reference, fast: dicts of results, energy_drift (relative),
+            momentum (relative to the sum of |p| of the balls),
+            pressure, pressure_err, temperature
+        matched, diverged_at, max_dt: from compare_events(), None for
+            the stepped and DSMC engines
+        pressure_z: difference in pressure in standard errors
+        passed: dict of bool for events (at least *min_events* matched,
+            or no divergence), energy and momentum (within the
+            tolerances) and pressure (within *z_max* errors)
+    """
+    ref = _run("event", seed, t_events, measure, blocks, config, batch_tol)
+    fast = _run(engine, seed, t_events, measure, blocks, config, batch_tol)
+    if engine == "batched":
+        # it does collisions up to its tolerance early
+        tol = max(tol, batch_tol)
+    res = {"engine": engine, "seed": seed, "reference": ref, "fast": fast,
+           "matched": None, "diverged_at": None, "max_dt": None}
+    passed = {}
+    if fast["events"] is not None:
+        res["matched"], res["diverged_at"], res["max_dt"] = compare_events(
+            ref["events"], fast["events"], tol)
+        passed["events"] = (res["diverged_at"] is None or
+                            res["matched"] >= min_events)
+    passed["energy"] = fast["energy_drift"] <= energy_tol
+    passed["momentum"] = fast["momentum"] <= momentum_tol
+    err = _np.sqrt(ref["pressure_err"] ** 2 + fast["pressure_err"] ** 2)
+    res["pressure_z"] = abs(fast["pressure"] - ref["pressure"]) / err
+    passed["pressure"] = res["pressure_z"] <= z_max
+    res["passed"] = passed
+    core.logging.log(20, "{} seed {}: matched {} events, diverged at {}, "
+                     "passed {}".format(engine, seed, res["matched"],
+                                        res["diverged_at"], passed))
+    return res
+
+
+def check(names=("batched", "stepped", "orbit", "dsmc"), seeds=(0, 1, 2),
+          configs=("dense", "dilute"), **kwargs):
+    """Compare each engine in *names* with the reference for each of
+    *seeds* and each of *configs*, names in CONFIGS, leaving out those
+    in SKIP
+
+    Keyword arguments go to compare(). Prints a line per run and
+    returns list of the results.
+    """
+    results = []
+    for name in configs:
+        config = dict(CONFIGS[name], **kwargs)
+        for engine in names:
+            if engine in SKIP.get(name, ()):
+                continue
+            for seed in seeds:
+                res = compare(engine, seed, **config)
+                res["config"] = name
+                results.append(res)
+                _summarise(res)
+    return results
+
+
+def _summarise(res):
+    """Print one line for the result *res* of compare()"""
+    fast = res["fast"]
+    print "{:7} {:8} seed {} events {:>5} diverged {:>8} dE {:.1e} " \
+        "dp {:.1e} P z {:.2f} T {:.4g} {}".format(
+            res["config"], res["engine"], res["seed"], res["matched"],
+            res["diverged_at"], fast["energy_drift"], fast["momentum"],
+            res["pressure_z"], fast["temperature"],
+            "ok" if all(res["passed"].values()) else
+            "FAILED " + ", ".join(
+                k for k, v in res["passed"].items() if not v))
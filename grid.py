@@ -0,0 +1,198 @@
+"""
+Spatial index for finding pairs of balls close enough to touch
+
+Defines:
+    CellGrid, Class
+    MultiGrid, Class
+
+Ethan Mills
+"""
+import itertools
+
+import numpy as _np
+
+
+class CellGrid:
+    """Uniform grid of square (cubic) cells for neighbour searches.
+
+    Balls are sorted by the cell their centre is in, so any two balls
+    that are within *cell_size* of each other are in the same or
+    neighbouring cells. All the work is done with numpy arrays.
+
+    Methods:
+        get_cell_size()
+        pairs(pos)
+        cross_pairs(pos_a, pos_b)
+    """
+
+    def __init__(self, cell_size, dim=3):
+        """Initialise grid
+
+        Args:
+            cell_size: float, side of each cell. Should be at least the
+                largest distance a pair is searched for at.
+            dim: int, number of components in positions, 2 or 3
+        """
+        # input checking
+        if type(cell_size) not in (int, float, _np.float64):
+            raise TypeError(
+                "cell_size is type {}, should be float".format(
+                    type(cell_size)))
+        if cell_size <= 0:
+            raise ValueError(
+                "cell_size is {}, should be positive".format(cell_size))
+        if dim not in (2, 3):
+            raise ValueError("dim is {}, should be 2 or 3".format(dim))
+
+        self._cell_size = float(cell_size)
+        self._dim = dim
+        # All neighbouring cells, and half of them so each pair of cells
+        # is only looked at once.
+        self._all_offsets = list(itertools.product((-1, 0, 1), repeat=dim))
+        self._offsets = [o for o in self._all_offsets if o > (0,) * dim]
+
+    def __repr__(self):
+        return "CellGrid(cell_size={}, dim={})".format(
+            self._cell_size, self._dim)
+
+    def get_cell_size(self):
+        """Return side length of cells as float"""
+        return self._cell_size
+
+    def _keys(self, pos):
+        """Return cell number of each position, and the grid shape"""
+        cells = _np.floor(pos[:, :self._dim] / self._cell_size)
+        cells = cells.astype(_np.int64)
+        # pad by one cell on each side so neighbours never wrap round
+        cells -= cells.min(axis=0) - 1
+        shape = cells.max(axis=0) + 2
+        strides = _np.cumprod(_np.concatenate(([1], shape[:0:-1])))[::-1]
+        return _np.dot(cells, strides), strides
+
+    def pairs(self, pos):
+        """Return indices i, j of candidate pairs as numpy.arrays
+
+        *pos* is numpy.array (n, dim) of positions. Each pair of balls in
+        the same or neighbouring cells appears once, with i != j.
+        """
+        n = len(pos)
+        if n < 2:
+            return _np.zeros(0, dtype=int), _np.zeros(0, dtype=int)
+        keys, strides = self._keys(pos)
+        order = _np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        i, j = self._in_cell(keys, order, sorted_keys)
+        # pairs in the same cell turn up twice
+        keep = i < j
+        ii = [i[keep]]
+        jj = [j[keep]]
+        for offset in self._offsets:
+            i, j = self._in_cell(keys + _np.dot(offset, strides), order,
+                                 sorted_keys)
+            ii.append(i)
+            jj.append(j)
+        return _np.concatenate(ii), _np.concatenate(jj)
+
+    def _in_cell(self, target, order, sorted_keys):
+        """Return all pairs of ball i with a ball j in cell *target[i]*"""
+        start = _np.searchsorted(sorted_keys, target, 'left')
+        counts = _np.searchsorted(sorted_keys, target, 'right') - start
+        i = _np.repeat(_np.arange(len(target)), counts)
+        # position of each j within its run of the sorted array
+        within = _np.arange(len(i)) - _np.repeat(
+            _np.cumsum(counts) - counts, counts)
+        j = order[_np.repeat(start, counts) + within]
+        return i, j
+
+    def cross_pairs(self, pos_a, pos_b):
+        """Return indices i, j of candidate pairs between two sets
+
+        i indexes *pos_a* and j indexes *pos_b*. Every ball in *pos_a*
+        is paired with every ball of *pos_b* in the same or a
+        neighbouring cell.
+        """
+        if len(pos_a) == 0 or len(pos_b) == 0:
+            return _np.zeros(0, dtype=int), _np.zeros(0, dtype=int)
+        keys, strides = self._keys(_np.concatenate((pos_a, pos_b)))
+        keys_a, keys_b = keys[:len(pos_a)], keys[len(pos_a):]
+        order = _np.argsort(keys_b, kind='mergesort')
+        sorted_keys = keys_b[order]
+        ii = []
+        jj = []
+        for offset in self._all_offsets:
+            i, j = self._in_cell(keys_a + _np.dot(offset, strides), order,
+                                 sorted_keys)
+            ii.append(i)
+            jj.append(j)
+        return _np.concatenate(ii), _np.concatenate(jj)
+
+
+class MultiGrid:
+    """Set of CellGrids with cell sizes growing by *ratio*, for balls of
+    very different sizes.
+
+    Each ball lives on the finest level whose cells are at least its
+    diameter. Pairs on the same level come from that level's grid, and
+    pairs across levels by putting the smaller balls into the grid of
+    the larger, so a few big balls don't force huge cells on all the
+    small ones. Same interface as CellGrid.
+
+    Methods:
+        get_levels()
+        pairs(pos)
+    """
+
+    def __init__(self, radius, dim=3, ratio=2., reach=0.):
+        """Initialise grid
+
+        Args:
+            radius: numpy.array, radius of each ball
+            dim: int, number of components in positions, 2 or 3
+            ratio: float, ratio between cell sizes of neighbouring
+                levels, more than 1
+            reach: float, how far apart the surfaces of balls can be
+                and still be a pair. Cells are this much bigger than
+                the largest ball on their level.
+        """
+        if ratio <= 1:
+            raise ValueError("ratio is {}, should be more than 1".format(
+                ratio))
+        radius = _np.asarray(radius, dtype=float)
+        smallest = 2 * _np.min(radius)
+        level = _np.ceil(_np.log(2 * radius / smallest) / _np.log(ratio))
+        # rounding can push a ball one level too far up, never down
+        level = _np.maximum(level.astype(int), 0)
+        used = _np.unique(level)
+        self._members = [_np.nonzero(level == l)[0] for l in used]
+        self._grids = [
+            CellGrid(float(2 * _np.max(radius[members]) + reach), dim=dim)
+            for members in self._members]
+
+    def __repr__(self):
+        return "MultiGrid(levels={})".format(
+            [grid.get_cell_size() for grid in self._grids])
+
+    def get_levels(self):
+        """Return list of (cell size, number of balls) on each level"""
+        return [(grid.get_cell_size(), len(members))
+                for grid, members in zip(self._grids, self._members)]
+
+    def pairs(self, pos):
+        """Return indices i, j of candidate pairs as numpy.arrays
+
+        As CellGrid.pairs(), but *pos* must hold the balls whose radii
+        the grid was made with, in the same order.
+        """
+        ii = []
+        jj = []
+        for k, (grid, members) in enumerate(zip(self._grids,
+                                                self._members)):
+            i, j = grid.pairs(pos[members])
+            ii.append(members[i])
+            jj.append(members[j])
+            # smaller balls against the balls on this level
+            for small in self._members[:k]:
+                i, j = grid.cross_pairs(pos[members], pos[small])
+                ii.append(members[i])
+                jj.append(small[j])
+        return _np.concatenate(ii), _np.concatenate(jj)
@@ -0,0 +1,509 @@
+"""
+Vectorised collision kernels, working on numpy arrays of many balls
+
+The physics is the same as Ball.time_to_collision and Ball.collide, but
+each function handles a whole batch of balls in one call.
+
+The container wall can be a sphere or an ellipsoid. A ball of radius r
+hits the wall when its centre is r from the nearest point of the wall.
+In a sphere that is a sphere r smaller, so along a straight path it is
+a quadratic in time. The surface r inside an ellipsoid is not an
+ellipsoid, so there the distance to the wall is found by Newton's
+method for the nearest point, and the time it falls to r by Newton's
+method along the path. The distance to the wall along a straight line
+is concave, so starting from a time the ball must have hit by, Newton's
+method comes down to the hit without overshooting. Two ellipsoids, r
+short of each semi-axis and shrunk by r over the shortest one, bound
+that surface and so bound the time of each ball. Only balls whose lower
+bound is before their next collision with another ball are solved.
+
+In a sphere a ball that only hits the wall never leaves the plane
+through the centre containing its velocity, and every chord it crosses
+is the same length. Each bounce turns its position and velocity through
+the same angle 2 psi about the centre, where psi is the angle between
+its path and the wall, so where it is and how many times it has hit the
+wall after any time have a closed form. orbit() works out those orbits,
+orbit_state() evaluates them and contact() finds when two balls on
+orbits first touch.
+
+Defines:
+    predict(pos, vel, radius, R, idx), function,
+        next collision of each ball in idx
+    wall(pos, vel, radius, axes, limit=None), function,
+        time until each ball hits the container wall
+    exit_time(pos, vel, radius, axes, limit=None), function,
+        as wall(), without ignoring balls just about to hit
+    clear(pos, radius, axes), function,
+        whether balls are clear of the container wall
+    normal(pos, radius, axes), function,
+        outward normal of the wall where each ball touches it
+    reflect(pos, vel, mass, radius=None, axes=None), function,
+        velocities of balls after hitting the container wall
+    elastic(pos1, vel1, mass1, pos2, vel2, mass2), function,
+        velocities of pairs of balls after colliding with each other
+    orbit(pos, vel, radius, R), function,
+        closed orbit of each ball bouncing round a sphere
+    orbit_state(orb, t, idx=None), function,
+        positions, velocities and wall hits of balls on their orbits
+    bounce(orb, idx, k), function,
+        where balls are just after their k-th wall hit
+    contact(orb, ia, ib, rad, ta, tb, window, max_segments=1000),
+        function, first time pairs of balls on orbits touch
+
+Ethan Mills
+"""
+import numpy as _np
+
+
+# times closer to zero than this are the collision that just happened,
+# as in core.close
+_CLOSE = 1E-6
+
+
+def _first_root(a, b, c):
+    """Return first time a*t^2 + b*t + c = 0 that is in the future
+
+    Follows Ball.time_to_collision: the earlier root if it is in the
+    future, otherwise the later one, otherwise numpy.inf. Roots closer
+    to zero than core.close() allows are ignored.
+    """
+    disc = b * b - 4 * a * c
+    valid = (disc >= 0) & (a > 0)
+    root = _np.sqrt(_np.where(valid, disc, 0.))
+    # masked rows get a = 1 so no nan reaches the comparisons
+    denom = 2 * _np.where(valid, a, 1.)
+    t1 = (-b - root) / denom
+    t2 = (-b + root) / denom
+    t = _np.where(t1 > _CLOSE, t1, _np.where(t2 > _CLOSE, t2, _np.inf))
+    t[~valid] = _np.inf
+    return t
+
+
+# relative accuracy of nearest points and of wall times, in lengths
+_TOL = 1E-12
+
+
+def _inset(radius, axes):
+    """Return 1 / (semi-axis - radius)^2 for each ball, shape (n, dim)"""
+    inset = _np.asarray(axes, dtype=float)[None, :] - radius[:, None]
+    return 1. / (inset * inset)
+
+
+def _is_sphere(axes):
+    """Return True if the semi-axes *axes* are all the same"""
+    return _np.all(axes == axes[0])
+
+
+def _exit_root(w, pos, vel):
+    """Return time each point leaves the ellipsoid sum(w x^2) = 1,
+    0 if it is already outside, numpy.inf if it is not moving"""
+    a = _np.sum(w * vel * vel, axis=1)
+    b = 2 * _np.sum(w * pos * vel, axis=1)
+    c = _np.sum(w * pos * pos, axis=1) - 1
+    root = _np.sqrt(_np.maximum(b * b - 4 * a * c, 0.))
+    moving = a > 0
+    t = (-b + root) / (2 * _np.where(moving, a, 1.))
+    t = _np.maximum(t, 0.)
+    t[~moving] = _np.inf
+    return t
+
+
+def _nearest(pos, axes, iterations=100):
+    """Return distance from each of *pos* to the wall of the ellipsoid
+    with semi-axes *axes*, negative outside, and the outward normal of
+    the wall at the nearest point
+
+    The nearest point is q = a^2 x / (a^2 + s) for the root s above
+    -min(a)^2 of
+        F(s) = sum (a x / (a^2 + s))^2 - 1,
+    which falls and is convex, found by Newton's method kept inside a
+    bracket by bisection. A point with no component along the shortest
+    axis can instead be nearest an end of it, when F stays negative as s
+    comes down to -min(a)^2.
+    """
+    axes = _np.asarray(axes, dtype=float)
+    y = _np.abs(pos)
+    a2 = axes * axes
+    ay = axes * y
+    short = a2 == _np.min(a2)
+    a2_min = _np.min(a2)
+    inside = _np.sum((y / axes) ** 2, axis=1) <= 1
+    # F at -min(a)^2 with the shortest axis left out
+    others = _np.where(short, 1., a2 - a2_min)
+    rest = _np.sum(_np.where(short, 0., ay / others) ** 2, axis=1) - 1
+    flat = _np.all(y[:, short] == 0, axis=1) & (rest <= 0) & inside
+
+    # F(lo) >= 0, as one term alone is 1 there, and F(hi) <= 0
+    lo = _np.maximum(_np.max(ay - a2, axis=1), -a2_min)
+    hi = _np.where(inside, 0., _np.sqrt(_np.sum(ay * ay, axis=1)))
+    s = lo.copy()
+    dx_old = hi - lo
+    active = _np.nonzero(~flat)[0]
+    for k in xrange(iterations):
+        if len(active) == 0:
+            break
+        d = a2[None, :] + s[active, None]
+        # no 0 / 0 for components that are 0 at a pole
+        term = _np.where(ay[active] == 0, 0.,
+                         ay[active] / _np.where(d == 0, 1., d))
+        f = _np.sum(term * term, axis=1) - 1
+        df = -2 * _np.sum(term * term / _np.where(d == 0, 1., d), axis=1)
+        lo[active] = _np.where(f >= 0, s[active], lo[active])
+        hi[active] = _np.where(f < 0, s[active], hi[active])
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            new = s[active] - f / df
+        # bisect when Newton leaves the bracket or is slower than it
+        slow = ~((new > lo[active]) & (new < hi[active])) | (
+            _np.abs(new - s[active]) > 0.5 * _np.abs(dx_old[active]))
+        new = _np.where(slow, 0.5 * (lo[active] + hi[active]), new)
+        dx_old[active] = new - s[active]
+        s[active] = new
+        done = _np.abs(dx_old[active]) <= _TOL * (a2_min + _np.abs(new))
+        active = active[~done]
+
+    d = _np.where(flat[:, None], 1., a2[None, :] + s[:, None])
+    q = _np.where(y == 0, 0., a2 * y / _np.where(d == 0, 1., d))
+    # a flat point is nearest the end of the shortest axis
+    first = _np.argmax(short)
+    q[flat] = _np.where(short, 0., a2 * y[flat] / others)
+    q[flat, first] = axes[first] * _np.sqrt(-rest[flat])
+    q *= _np.where(pos < 0, -1., 1.)
+    dist = _np.sqrt(_np.sum((q - pos) ** 2, axis=1))
+    n = q / a2
+    n /= _np.sqrt(_np.sum(n * n, axis=1))[:, None]
+    return _np.where(inside, dist, -dist), n
+
+
+def _bounds(pos, vel, radius, axes):
+    """Return times between which each ball must hit the wall
+
+    The centres can reach no further than the ellipsoid *radius* short
+    of each semi-axis, and can reach all of the ellipsoid shrunk by
+    *radius* over the shortest semi-axis.
+    """
+    outer = _exit_root(_inset(radius, axes), pos, vel)
+    scale = 1 - radius / _np.min(axes)
+    inner = _exit_root(1. / (axes[None, :] * scale[:, None]) ** 2, pos, vel)
+    return inner, outer
+
+
+def exit_time(pos, vel, radius, axes, limit=None, iterations=50):
+    """Return time until each ball reaches the wall as numpy.array
+
+    As wall(), but with no times ignored for being close to zero, so a
+    ball just short of the wall is never missed. One a rounding error
+    outside is taken to be on the wall. Balls whose lower bound is
+    *limit* or later get the lower bound.
+    """
+    axes = _np.asarray(axes, dtype=float)
+    if _is_sphere(axes):
+        return _exit_root(_inset(radius, axes), pos, vel)
+    t_lo, t = _bounds(pos, vel, radius, axes)
+    todo = _np.isfinite(t)
+    if limit is not None:
+        todo &= t_lo < limit
+    active = _np.nonzero(todo)[0]
+    size = _TOL * _np.max(axes)
+    for k in xrange(iterations):
+        if len(active) == 0:
+            break
+        d, n = _nearest(pos[active] + vel[active] * t[active, None], axes)
+        gap = d - radius[active]
+        rate = _np.sum(n * vel[active], axis=1)
+        # coming down from above the hit, gap <= 0 and the ball is
+        # moving out
+        step = _np.where(rate > 0, gap / _np.where(rate > 0, rate, 1.), 0.)
+        t[active] = _np.maximum(t[active] + step, 0.)
+        done = (gap >= -size) | (rate <= 0) | (t[active] == 0)
+        active = active[~done]
+    return _np.where(todo, t, t_lo)
+
+
+def wall(pos, vel, radius, axes, limit=None):
+    """Return time until each ball hits the wall as numpy.array
+
+    *pos*, *vel* are numpy.array (n, dim), *radius* numpy.array (n,)
+    and *axes* the semi-axes of the container, dim floats. Hits closer
+    to zero than core.close() allows are ignored, giving numpy.inf.
+    For an ellipsoid, balls that can't hit the wall before *limit*, a
+    float or numpy.array (n,), get a lower bound instead.
+    """
+    axes = _np.asarray(axes, dtype=float)
+    if _is_sphere(axes):
+        w = _inset(radius, axes)
+        return _first_root(_np.sum(w * vel * vel, axis=1),
+                           2 * _np.sum(w * pos * vel, axis=1),
+                           _np.sum(w * pos * pos, axis=1) - 1)
+    t = exit_time(pos, vel, radius, axes, limit)
+    t[t <= _CLOSE] = _np.inf
+    return t
+
+
+def clear(pos, radius, axes):
+    """Return numpy.array of bool, True for balls clear of the wall
+
+    *pos* is numpy.array (n, dim), *radius* numpy.array (n,).
+    """
+    axes = _np.asarray(axes, dtype=float)
+    inset = axes[None, :] - radius[:, None]
+    ok = _np.sum((pos / inset) ** 2, axis=1) < 1
+    if _is_sphere(axes):
+        return ok
+    # only those between the bounding ellipsoids need the distance
+    scale = 1 - radius / _np.min(axes)
+    sure = _np.sum((pos / (axes[None, :] * scale[:, None])) ** 2, axis=1) < 1
+    check = _np.nonzero(ok & ~sure)[0]
+    if len(check) > 0:
+        ok[check] = _nearest(pos[check], axes)[0] > radius[check]
+    return ok
+
+
+def normal(pos, radius, axes):
+    """Return unit outward normals of the wall at balls touching it
+
+    Arguments are as in wall(). The normal is that of the wall where it
+    is nearest the centre of the ball.
+    """
+    axes = _np.asarray(axes, dtype=float)
+    if _is_sphere(axes):
+        return pos / _np.sqrt(_np.sum(pos * pos, axis=1))[:, None]
+    return _nearest(pos, axes)[1]
+
+
+def predict(pos, vel, radius, R, idx):
+    """Return time and partner of the next collision of each ball in *idx*
+
+    Args:
+        pos, vel: numpy.array (n, dim), positions and velocities of all
+            balls
+        radius: numpy.array (n,), radii of all balls
+        R: float, radius of the container, or its dim semi-axes
+        idx: list or numpy.array of int, balls to predict for
+
+    Returns numpy.arrays of times (numpy.inf if there is no collision)
+    and partners, where partner is the index of the other ball or -1 for
+    the container.
+    """
+    idx = _np.asarray(idx, dtype=int)
+    r = pos[idx][:, None, :] - pos[None, :, :]
+    u = vel[idx][:, None, :] - vel[None, :, :]
+    rad = radius[idx][:, None] + radius[None, :]
+    t = _first_root(_np.sum(u * u, axis=2), 2 * _np.sum(r * u, axis=2),
+                    _np.sum(r * r, axis=2) - rad * rad)
+    # a ball never collides with itself
+    t[_np.arange(len(idx)), idx] = _np.inf
+    axes = _np.ones(pos.shape[1]) * R
+    partner = _np.argmin(t, axis=1)
+    times = t[_np.arange(len(idx)), partner]
+    hits = wall(pos[idx], vel[idx], radius[idx], axes, limit=times)
+    hits_wall = hits < times
+    partner[hits_wall] = -1
+    times[hits_wall] = hits[hits_wall]
+    return times, partner
+
+
+def reflect(pos, vel, mass, radius=None, axes=None):
+    """Return velocities after hitting the wall, and impulse on the wall
+
+    *pos*, *vel* are numpy.array (n, dim), *mass* numpy.array (n,).
+    For an ellipsoid give *radius* of the balls and *axes* of the
+    container as in wall(), otherwise the wall is a sphere.
+    """
+    if axes is None:
+        n = pos / _np.sqrt(_np.sum(pos * pos, axis=1))[:, None]
+    else:
+        n = normal(pos, radius, axes)
+    u_perp = _np.sum(vel * n, axis=1)[:, None] * n
+    return vel - 2 * u_perp, 2 * mass[:, None] * u_perp
+
+
+def elastic(pos1, vel1, mass1, pos2, vel2, mass2):
+    """Return velocities of pairs of balls after an elastic collision
+
+    Each row of *pos1*, *vel1*, *mass1* collides with the same row of
+    *pos2*, *vel2*, *mass2*. Only velocity along the line of centres
+    changes.
+    """
+    n = pos2 - pos1
+    n /= _np.sqrt(_np.sum(n * n, axis=1))[:, None]
+    u1 = _np.sum(vel1 * n, axis=1)
+    u2 = _np.sum(vel2 * n, axis=1)
+    total = mass1 + mass2
+    v1 = (u1 * (mass1 - mass2) + 2 * mass2 * u2) / total
+    v2 = (2 * mass1 * u1 + u2 * (mass2 - mass1)) / total
+    return (vel1 + (v1 - u1)[:, None] * n,
+            vel2 + (v2 - u2)[:, None] * n)
+
+
+def orbit(pos, vel, radius, R):
+    """Return the orbit of each ball bouncing round a sphere of radius *R*
+
+    *pos*, *vel* are numpy.array (n, dim), *radius* numpy.array (n,).
+    Times on the orbit are from when the balls are at *pos*.
+
+    Returns dict of numpy.arrays, one entry per ball:
+        pos, vel: where the orbit starts
+        first: time of the first wall hit, numpy.inf if never
+        period: time between wall hits
+        angle: 2 psi, the angle turned through at each hit
+        e1, e2: (n, dim), unit vectors in the plane of the orbit, e1
+            towards the first hit
+        inner: radius of the sphere the centre moves on
+        normal, tangent: components of velocity just after the first
+            hit along e1 and e2
+        kick: impulse of each wall hit per unit mass
+    """
+    inner = R - radius
+    speed = _np.sqrt(_np.sum(vel * vel, axis=1))
+    a = speed * speed
+    b = 2 * _np.sum(pos * vel, axis=1)
+    c = _np.sum(pos * pos, axis=1) - inner * inner
+    # balls are inside, so the later root is the way out. One a
+    # rounding error outside the wall is taken to be on it.
+    root = _np.sqrt(_np.maximum(b * b - 4 * a * c, 0.))
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        first = _np.where(a > 0, _np.maximum((-b + root) / (2 * a), 0.),
+                          _np.inf)
+    hit = pos + vel * _np.where(a > 0, first, 0.)[:, None]
+    dim = pos.shape[1]
+    e1 = _unit(hit, _np.eye(dim)[0])
+    along = _np.sum(vel * e1, axis=1)
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        # cos of the angle between the path and the normal. Kept off
+        # zero so a ball sliding round the wall has a finite period.
+        cos = _np.where(a > 0, _np.clip(along / speed, 1E-12, 1.), 1.)
+        period = _np.where(a > 0, 2 * inner * cos / speed, _np.inf)
+    # if the path goes through the centre any plane containing it will do
+    spare = _np.eye(dim)[_np.argmin(_np.abs(e1), axis=1)]
+    tangent = vel - along[:, None] * e1
+    fallback = spare - _np.sum(spare * e1, axis=1)[:, None] * e1
+    e2 = _unit(_np.where((_np.sum(tangent * tangent, axis=1) > 0)[:, None],
+                         tangent, fallback), _np.eye(dim)[-1])
+    sin = _np.sqrt(1 - cos * cos)
+    return {"pos": pos, "vel": vel, "first": first, "period": period,
+            "angle": _np.pi - 2 * _np.arccos(cos), "e1": e1, "e2": e2,
+            "inner": inner, "normal": -speed * cos, "tangent": speed * sin,
+            "kick": 2 * speed * cos}
+
+
+def _unit(v, default):
+    """Return rows of *v* scaled to length 1, *default* for zero rows"""
+    norm = _np.sqrt(_np.sum(v * v, axis=1))
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        return _np.where((norm > 0)[:, None], v / norm[:, None],
+                         default[None, :])
+
+
+def _take(orb, idx):
+    """Return the orbits of balls *idx*, all of them if None"""
+    if idx is None:
+        return orb
+    return dict((key, value[idx]) for key, value in orb.items())
+
+
+def _hits(orb, t):
+    """Return number of wall hits of each ball by time *t*"""
+    with _np.errstate(invalid='ignore'):
+        before = ~(t >= orb["first"])
+        k = _np.floor(_np.where(before, 0., t - orb["first"]) / orb["period"])
+    return _np.where(before, 0., k + 1)
+
+
+def bounce(orb, idx, k):
+    """Return position and velocity of balls *idx* just after their *k*-th
+    wall hit, counting from 0
+
+    *idx* and *k* are numpy.arrays of int of the same length.
+    """
+    orb = _take(orb, idx)
+    theta = k * orb["angle"]
+    cos = _np.cos(theta)[:, None]
+    sin = _np.sin(theta)[:, None]
+    radial = cos * orb["e1"] + sin * orb["e2"]
+    across = cos * orb["e2"] - sin * orb["e1"]
+    vel = orb["normal"][:, None] * radial + orb["tangent"][:, None] * across
+    return orb["inner"][:, None] * radial, vel
+
+
+def _state(orb, hits, t):
+    """Return positions and velocities at *t* of balls that have hit the
+    wall *hits* times"""
+    on_orbit = hits > 0
+    k = _np.where(on_orbit, hits - 1, 0.)
+    pos, vel = bounce(orb, None, k)
+    since = _np.where(on_orbit, t - orb["first"] - k * orb["period"], 0.)
+    straight = ~on_orbit[:, None]
+    return (_np.where(straight, orb["pos"] + orb["vel"] * t[:, None],
+                      pos + vel * since[:, None]),
+            _np.where(straight, orb["vel"], vel))
+
+
+def orbit_state(orb, t, idx=None):
+    """Return positions, velocities and number of wall hits of balls on
+    their orbits *t* seconds after the orbits start
+
+    *orb* is from orbit(), *t* float or numpy.array with one time per
+    ball, and *idx* the balls to look at, all of them if None.
+    """
+    orb = _take(orb, idx)
+    t = _np.broadcast_to(_np.asarray(t, dtype=float), orb["first"].shape)
+    hits = _hits(orb, t)
+    pos, vel = _state(orb, hits, t)
+    return pos, vel, hits
+
+
+def contact(orb, ia, ib, rad, ta, tb, window, max_segments=1000):
+    """Return when pairs of balls on their orbits first touch
+
+    Pair m is balls *ia*[m] and *ib*[m] of *orb*, touching when their
+    centres are *rad*[m] apart. Now is *ta*[m] seconds into the orbit of
+    the first and *tb*[m] into that of the second. Their paths are
+    followed piece by piece between wall hits, looking no further than
+    *window* seconds ahead and at no more than *max_segments* pieces.
+
+    Returns numpy.arrays of the time from now that each pair touches,
+    numpy.inf if not found, and how far ahead each pair was looked at.
+    """
+    n = len(ia)
+    found = _np.full(n, _np.inf)
+    done = _np.zeros(n)
+    orb_a = _take(orb, ia)
+    orb_b = _take(orb, ib)
+    # hits are counted rather than worked out from the time, so a piece
+    # starting exactly on a hit is on the new chord
+    hits_a = _hits(orb_a, ta)
+    hits_b = _hits(orb_b, tb)
+    active = _np.arange(n)
+    for segment in xrange(max_segments):
+        if len(active) == 0:
+            break
+        a = _take(orb_a, active)
+        b = _take(orb_b, active)
+        t = done[active]
+        now_a = ta[active] + t
+        now_b = tb[active] + t
+        pa, va = _state(a, hits_a[active], now_a)
+        pb, vb = _state(b, hits_b[active], now_b)
+        # time from now of the next hit of each ball
+        next_a = a["first"] + hits_a[active] * a["period"] - ta[active]
+        next_b = b["first"] + hits_b[active] * b["period"] - tb[active]
+        end = _np.minimum(_np.minimum(next_a, next_b), window)
+        r = pa - pb
+        u = va - vb
+        A = _np.sum(u * u, axis=1)
+        B = _np.sum(r * u, axis=1)
+        C = _np.sum(r * r, axis=1) - rad[active] * rad[active]
+        disc = B * B - A * C
+        # only approaching pairs can touch, which skips a collision that
+        # just happened
+        approach = (B < 0) & (disc >= 0) & (A > 0)
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            s = _np.maximum((-B - _np.sqrt(_np.where(approach, disc, 0.))) /
+                            A, 0.)
+        hit = approach & (t + s <= end)
+        found[active[hit]] = t[hit] + s[hit]
+        done[active] = end
+        hits_a[active] += next_a <= end
+        hits_b[active] += next_b <= end
+        active = active[~hit & (end < window)]
+    return found, done
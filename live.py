@@ -0,0 +1,221 @@
+"""
+Share the state of a running simulation with other processes
+
+A Publisher keeps time, container momentum and the position and
+velocity of every ball in a memory mapped file, in /dev/shm where there
+is one so it never touches disk. Any number of Readers in other
+processes can map the same file and look at the arrays directly, with
+no copying.
+
+Writes are guarded by a version counter, as in a seqlock: it is odd
+while the writer is part way through and goes up by two for each
+update. A reader copies the state between two reads of the counter and
+tries again unless both were the same even number, so it never sees
+half of one update and half of another, and the writer never waits.
+
+Every array looking at the file keeps the map alive, so close() only
+drops the Publisher's or Reader's own references and the memory is
+unmapped once the last array from view() is gone. Arrays a Reader
+gives out are read-only.
+
+Defines:
+    Publisher, Class
+    Reader, Class
+
+Ethan Mills
+"""
+import mmap
+import os
+import tempfile
+import time
+
+import numpy as _np
+
+
+# header of int64: version, number of balls, dim, capacity
+_HEADER = 4
+
+
+def _path(name):
+    """Return file used for shared state called *name*"""
+    if os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", name)
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def _views(buf, capacity, dim, writeable=True):
+    """Return header, time, container momentum, positions and velocities
+    as numpy arrays looking straight at *buf*
+
+    The arrays hold a reference to *buf*, so it stays mapped as long as
+    any of them exist.
+    """
+    header = _np.frombuffer(buf, dtype=_np.int64, count=_HEADER)
+    offset = 8 * _HEADER
+    data = _np.frombuffer(buf, dtype=float, count=1 + dim + 2 * capacity * dim,
+                          offset=offset)
+    if not writeable:
+        header.flags.writeable = False
+        data.flags.writeable = False
+    pos = data[1 + dim:1 + dim + capacity * dim].reshape(capacity, dim)
+    vel = data[1 + dim + capacity * dim:].reshape(capacity, dim)
+    return header, data[0:1], data[1:1 + dim], pos, vel
+
+
+def _size(capacity, dim):
+    """Return bytes needed for *capacity* balls in *dim* dimensions"""
+    return 8 * (_HEADER + 1 + dim + 2 * capacity * dim)
+
+
+class Publisher:
+    """Writes the state of a system to shared memory
+
+    Methods:
+        publish(t, pos, vel, momentum)
+        get_name()
+        get_version()
+        close(unlink=True)
+    """
+
+    def __init__(self, name, capacity, dim=3):
+        """Create shared state called *name*, replacing any old one
+
+        Args:
+            name: str, name other processes attach with
+            capacity: int, largest number of balls that will be written
+            dim: int, number of position components, 2 or 3
+        """
+        if dim not in (2, 3):
+            raise ValueError("dim is {}, should be 2 or 3".format(dim))
+        if capacity <= 0:
+            raise ValueError("capacity is {}, should be positive".format(
+                capacity))
+        self._name = name
+        self._dim = dim
+        self._capacity = capacity
+        size = _size(capacity, dim)
+        with open(_path(name), "w+b") as f:
+            f.truncate(size)
+            self._map = mmap.mmap(f.fileno(), size)
+        (self._header, self._time, self._momentum,
+         self._pos, self._vel) = _views(self._map, capacity, dim)
+        self._header[:] = [0, 0, dim, capacity]
+
+    def __repr__(self):
+        return "Publisher(name={}, capacity={}, dim={})".format(
+            repr(self._name), self._capacity, self._dim)
+
+    def get_name(self):
+        """Return name of the shared state as str"""
+        return self._name
+
+    def get_version(self):
+        """Return number of updates published so far as int"""
+        return int(self._header[0]) // 2
+
+    def publish(self, t, pos, vel, momentum):
+        """Write a new state
+
+        *t* is float, *pos* and *vel* numpy.array (n, dim) and
+        *momentum* the container momentum, numpy.array (dim,).
+        """
+        if self._map is None:
+            raise ValueError("{} is closed".format(self))
+        n = len(pos)
+        if n > self._capacity:
+            raise ValueError("{} balls, capacity is {}".format(
+                n, self._capacity))
+        # odd while writing
+        self._header[0] += 1
+        self._header[1] = n
+        self._time[0] = t
+        self._momentum[:] = momentum
+        self._pos[:n] = pos
+        self._vel[:n] = vel
+        self._header[0] += 1
+
+    def close(self, unlink=True):
+        """Stop publishing. If *unlink*, remove the shared state, though
+        Readers already attached can still use it"""
+        # not mmap.close(), which would pull the memory out from under
+        # any array still looking at it
+        self._header = self._time = self._momentum = None
+        self._pos = self._vel = None
+        self._map = None
+        if unlink and os.path.exists(_path(self._name)):
+            os.remove(_path(self._name))
+
+
+class Reader:
+    """Reads the state a Publisher in another process writes
+
+    Methods:
+        snapshot(timeout=1.)
+        view()
+        get_version()
+        close()
+    """
+
+    def __init__(self, name):
+        """Attach to shared state called *name*"""
+        with open(_path(name), "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        header = _np.frombuffer(self._map, dtype=_np.int64, count=_HEADER)
+        dim, capacity = int(header[2]), int(header[3])
+        (self._header, self._time, self._momentum,
+         self._pos, self._vel) = _views(self._map, capacity, dim,
+                                        writeable=False)
+        self._name = name
+
+    def __repr__(self):
+        return "Reader(name={})".format(repr(self._name))
+
+    def get_version(self):
+        """Return number of updates published so far as int"""
+        return int(self._header[0]) // 2
+
+    def view(self):
+        """Return dict of numpy arrays looking straight at the shared
+        state, keys time, momentum, pos and vel
+
+        No copying, but the values can change at any moment. Use
+        snapshot() for a consistent state. The arrays are read-only and
+        stay valid after close().
+        """
+        if self._map is None:
+            raise ValueError("{} is closed".format(self))
+        n = int(self._header[1])
+        return {"time": self._time, "momentum": self._momentum,
+                "pos": self._pos[:n], "vel": self._vel[:n]}
+
+    def snapshot(self, timeout=1.):
+        """Return copy of one complete update as dict
+
+        Keys are version (int), time (float), momentum, pos and vel
+        (numpy.arrays). Raises RuntimeError if no complete update could
+        be read within *timeout* seconds.
+        """
+        if self._map is None:
+            raise ValueError("{} is closed".format(self))
+        end = time.time() + timeout
+        while True:
+            before = int(self._header[0])
+            if before % 2 == 0:
+                n = int(self._header[1])
+                state = {"version": before // 2,
+                         "time": float(self._time[0]),
+                         "momentum": self._momentum.copy(),
+                         "pos": self._pos[:n].copy(),
+                         "vel": self._vel[:n].copy()}
+                if int(self._header[0]) == before:
+                    return state
+            if time.time() > end:
+                raise RuntimeError("no complete state of {} in {} s".format(
+                    self._name, timeout))
+
+    def close(self):
+        """Detach from the shared state. Arrays from view() keep the
+        memory mapped until they are gone."""
+        self._header = self._time = self._momentum = None
+        self._pos = self._vel = None
+        self._map = None
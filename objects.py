@@ -4,18 +4,24 @@ Contains object for use in System.
 Defines:
     Ball, Class
     Container, Class
+    EllipticalContainer, Class
     BigBall, Class
 
-    distributeBalls(n, radius, ballsize=1, v=8., dim=2), function,
+    distributeBalls(n, radius, ballsize=1, v=8., dim=2, planar=False,
+                    temperature=None), function,
         create Ball objects
 
 Ethan Mills
 @todo ellipse collisions
-@todo finish ellipse container
 @todo diatomic molecules
 """
+import math as _math
+
 import core
+import kernels
+import trajectory
 
+import matplotlib.patches as _patches
 import matplotlib.pyplot as _plt
 import numpy as _np
 import numpy.random as _rand
@@ -32,8 +38,11 @@ class Ball:
         get_radius()
         get_mass()
         get_patch()
+        get_tracker()
         set_pos(new_pos)
         set_vel(new_vel)
+        set_radius(new_radius)
+        set_tracker(tracker)
         move(step)
         time_to_collision(other)
         collide(other)
@@ -45,8 +54,10 @@ class Ball:
         args:
             mass: float
             radius: float
-            pos: numpy.array, 3 component Cartesian position vector
-            vel: numpy.array, 3 component Cartesian velocity vector
+            pos: numpy.array, 3 component Cartesian position vector, or
+                2 components for a disc in a 2D system
+            vel: numpy.array, Cartesian velocity vector with as many
+                components as pos
         """
 
         # input checking
@@ -66,20 +77,24 @@ class Ball:
             raise TypeError(
                 "pos is type {}, should be list or numpy array".format(
                     type(pos)))
-        if len(pos) != 3:
-            raise ValueError("pos has length {}, should be 3".format(len(pos)))
+        if len(pos) not in (2, 3):
+            raise ValueError(
+                "pos has length {}, should be 2 or 3".format(len(pos)))
         if type(vel) not in (list, _np.array, _np.ndarray):
             raise TypeError(
                 "vel is type {}, should be list or numpy array".format(
                     type(vel)))
-        if len(vel) != 3:
-            raise ValueError("vel has length {}, should be 3".format(len(vel)))
+        if len(vel) != len(pos):
+            raise ValueError(
+                "vel has length {}, should be {} like pos".format(
+                    len(vel), len(pos)))
 
         self._mass = float(mass)
         self._radius = float(radius)
         self._pos = _np.array(pos)
         self._vel = _np.array(vel)
-        self._patch = _plt.Circle(self._pos[:-1], self._radius)
+        self._patch = _plt.Circle(self._pos[:2], self._radius)
+        self._tracker = None
 
     def __repr__(self):
         return ("""Ball(mass={0._mass}, radius={0._radius}, pos={0._pos},\
@@ -117,6 +132,10 @@ class Ball:
         """
         return self._patch
 
+    def get_tracker(self):
+        """Return trajectory.Trajectory recording path, or None"""
+        return self._tracker
+
     def set_pos(self, new_pos):
         """Update position to *new_pos*
 
@@ -129,7 +148,7 @@ class Ball:
                     type(new_pos)))
 
         self._pos = _np.array(new_pos)
-        self._patch.center = self._pos[:-1]
+        self._patch.center = self._pos[:2]
 
     def set_vel(self, new_vel):
         """Update position to *new_vel*
@@ -145,6 +164,34 @@ class Ball:
 
         self._vel = _np.array(new_vel)
 
+    def set_radius(self, new_radius):
+        """Update radius to *new_radius*, a positive float"""
+        # input checking
+        if type(new_radius) not in (int, float):
+            raise TypeError(
+                "new_radius is type {}, should be int or float".format(
+                    type(new_radius)))
+        if new_radius <= 0:
+            raise ValueError(
+                "new_radius is {}, should be positive".format(new_radius))
+
+        self._radius = float(new_radius)
+        self._patch.set_radius(self._radius)
+
+    def set_tracker(self, tracker):
+        """Record path in *tracker*
+
+        *tracker* is trajectory.Trajectory, or None to stop recording.
+        System adds a node to it each time Ball collides.
+        """
+        if tracker is not None and not isinstance(tracker,
+                                                  trajectory.Trajectory):
+            raise TypeError(
+                "tracker is type {}, should be Trajectory".format(
+                    type(tracker)))
+
+        self._tracker = tracker
+
     def move(self, step):
         """Move Ball to where it should be in *step* seconds
 
@@ -169,18 +216,22 @@ class Ball:
         Retun time as float. If Ball does not collide with *other*,
         return None.
         """
+        if isinstance(other, EllipticalContainer):
+            return other.time_to_collision(self)
+        if len(self._pos) == 2:
+            return self._time_to_collision_2d(other)
         r1 = self.get_pos()
-        core.logging.debug("r1 {}".format(r1))
+        core.logging.debug("r1 %s", r1)
         v1 = self.get_vel()
-        core.logging.debug("v1 {}".format(v1))
+        core.logging.debug("v1 %s", v1)
         rad1 = self.get_radius()
-        core.logging.debug("rad1 {}".format(rad1))
+        core.logging.debug("rad1 %s", rad1)
         r2 = other.get_pos()
-        core.logging.debug("r2 {}".format(r2))
+        core.logging.debug("r2 %s", r2)
         v2 = other.get_vel()
-        core.logging.debug("v2 {}".format(v2))
+        core.logging.debug("v2 %s", v2)
         rad2 = other.get_radius()
-        core.logging.debug("rad2 {}".format(rad2))
+        core.logging.debug("rad2 %s", rad2)
         # Define a, b, c of the quadratic equation in dt
         a = _np.dot((v1 - v2), (v1 - v2))
         a = float(a)
@@ -200,17 +251,51 @@ class Ball:
         else:
             return None
 
+    def _time_to_collision_2d(self, other):
+        """time_to_collision() for 2 component Balls
+
+        Works on plain floats rather than numpy arrays, which is several
+        times faster for vectors this short.
+        """
+        # tolist() gives python floats, which are faster than numpy's
+        x1, y1 = self._pos.tolist()
+        vx1, vy1 = self._vel.tolist()
+        x2, y2 = other.get_pos().tolist()
+        vx2, vy2 = other.get_vel().tolist()
+        rx, ry = x1 - x2, y1 - y2
+        ux, uy = vx1 - vx2, vy1 - vy2
+        rad = self._radius + other.get_radius()
+        a = ux * ux + uy * uy
+        if a == 0:
+            return None
+        b = 2 * (rx * ux + ry * uy)
+        c = rx * rx + ry * ry - rad * rad
+        disc = b * b - 4 * a * c
+        if disc < 0:
+            return None
+        root = _math.sqrt(disc)
+        minimum = (-b - root) / (2 * a)
+        if minimum > 0 and not close(minimum, 0):
+            return minimum
+        maximum = (-b + root) / (2 * a)
+        if maximum > 0:
+            return maximum
+        else:
+            return None
+
     def collide(self, other):
         """Carry out collision with *other*
 
         *other* is Ball or Container.
         Update velocity of Ball and *other* as result of the collision.
         """
+        if len(self._pos) == 2:
+            return self._collide_2d(other)
         Pos = self.get_pos()
         Vel = self.get_vel()
         Mass = self.get_mass()
         if isinstance(other, Container):
-            r_norm = Pos / _np.sqrt(_np.dot(Pos, Pos))
+            r_norm = other.get_normal(Pos, self._radius)
             u_perp = _np.dot(Vel, r_norm) * r_norm
             v_para = Vel - u_perp
             v_perp = -u_perp
@@ -238,6 +323,38 @@ class Ball:
             self.set_vel(v1)
             other.set_vel(v2)
 
+    def _collide_2d(self, other):
+        """collide() for 2 component Balls, working on plain floats"""
+        x, y = self._pos.tolist()
+        vx, vy = self._vel.tolist()
+        mass = self._mass
+        if isinstance(other, Container):
+            if isinstance(other, EllipticalContainer):
+                nx, ny = other.get_normal(self._pos, self._radius).tolist()
+            else:
+                r = _math.sqrt(x * x + y * y)
+                nx, ny = x / r, y / r
+            u = vx * nx + vy * ny
+            other.add_momentum(_np.array([2 * mass * u * nx,
+                                          2 * mass * u * ny]))
+            self.set_vel(_np.array([vx - 2 * u * nx, vy - 2 * u * ny]))
+        else:
+            ox, oy = other.get_pos().tolist()
+            ovx, ovy = other.get_vel().tolist()
+            oMass = other.get_mass()
+            nx, ny = ox - x, oy - y
+            r = _math.sqrt(nx * nx + ny * ny)
+            nx, ny = nx / r, ny / r
+            # components of velocity along the line of centres
+            u1 = vx * nx + vy * ny
+            u2 = ovx * nx + ovy * ny
+            v1 = (u1 * (mass - oMass) + 2 * oMass * u2) / (mass + oMass)
+            v2 = (2 * mass * u1 + u2 * (oMass - mass)) / (mass + oMass)
+            self.set_vel(_np.array([vx + (v1 - u1) * nx,
+                                    vy + (v1 - u1) * ny]))
+            other.set_vel(_np.array([ovx + (v2 - u2) * nx,
+                                     ovy + (v2 - u2) * ny]))
+
 
 class Container:
     """
@@ -247,17 +364,26 @@ class Container:
         get_pos()
         get_vel()
         get_radius()
+        get_axes()
+        get_dim()
+        get_area(inset=0.)
+        get_volume(inset=0.)
         get_patch()
-        add_momentum(dp)
+        get_normal(pos, radius)
+        contains(pos, radius)
+        inset(distance)
+        add_momentum(dp, mag=None)
         get_momentum()
         get_mag_momentum()
     """
 
-    def __init__(self, radius):
+    def __init__(self, radius, dim=3):
         """Initialise the container with parameters
 
         Args:
             radius: float. Radius of container.
+            dim: int. 3 for a sphere, 2 for a circle holding 2 component
+                Balls.
         """
         # input checking
         if type(radius) not in (int, float):
@@ -266,10 +392,13 @@ class Container:
                     type(radius)))
         if radius <= 0:
             raise ValueError("radius is {}, should be positive".format(radius))
+        if dim not in (2, 3):
+            raise ValueError("dim is {}, should be 2 or 3".format(dim))
 
         self._radius = float(radius)
+        self._dim = dim
         self._patch = _plt.Circle((0, 0), self._radius, fill=False)
-        self._momentum = _np.array([0., 0., 0.])
+        self._momentum = _np.zeros(dim)
         self._mag_momentum = 0
 
     def __repr__(self):
@@ -284,11 +413,11 @@ class Container:
 
     def get_pos(self):
         """Return zero vector for use with collisions"""
-        return _np.array([0, 0, 0])
+        return _np.zeros(self._dim)
 
     def get_vel(self):
         """Return zero vector for use with collisions"""
-        return _np.array([0, 0, 0])
+        return _np.zeros(self._dim)
 
     def get_radius(self):
         """Return negative radius as float.
@@ -298,19 +427,71 @@ class Container:
         """
         return - self._radius
 
+    def get_axes(self):
+        """Return semi-axes as numpy.array, all the radius for a sphere"""
+        return _np.full(self._dim, self._radius)
+
+    def get_dim(self):
+        """Return number of dimensions as int"""
+        return self._dim
+
+    def get_area(self, inset=0.):
+        """Return area of the wall as float, or of the surface *inset*
+        inside it that the centres of balls of radius *inset* reach
+
+        Surface area of the sphere, or perimeter of the circle in 2D.
+        """
+        radius = self._radius - inset
+        if self._dim == 2:
+            return 2 * _np.pi * radius
+        return 4 * _np.pi * radius ** 2
+
+    def get_volume(self, inset=0.):
+        """Return volume as float, area of the circle in 2D, inside the
+        surface *inset* inside the wall"""
+        radius = self._radius - inset
+        if self._dim == 2:
+            return _np.pi * radius ** 2
+        return (4. / 3.) * _np.pi * radius ** 3
+
     def get_patch(self):
         """Return matplotlib.pyplot.Circle displaying Container"""
         return self._patch
 
-    def add_momentum(self, dp):
-        """Add momentum to container. *dp* is numpy.array"""
+    def get_normal(self, pos, radius):
+        """Return unit outward normal of the wall where a ball of
+        *radius* with centre at *pos* touches it, as numpy.array"""
+        return pos / _np.sqrt(_np.dot(pos, pos))
+
+    def contains(self, pos, radius):
+        """Return True if a ball at *pos* with *radius* is clear of the
+        wall. *pos* can also be numpy.array (n, dim), giving an array of
+        bool."""
+        pos = _np.asarray(pos, dtype=float)
+        radius = _np.asarray(radius, dtype=float)
+        inset = self.get_axes() - radius[..., None]
+        return _np.sum((pos / inset) ** 2, axis=-1) < 1
+
+    def inset(self, distance):
+        """Return new empty Container of the same shape, smaller by
+        *distance* all round"""
+        return Container(float(self._radius - distance), dim=self._dim)
+
+    def add_momentum(self, dp, mag=None):
+        """Add momentum to container. *dp* is numpy.array
+
+        If *dp* is the sum of several impulses, *mag* is the sum of
+        their magnitudes, otherwise None.
+        """
         # input checking
         if type(dp) not in (_np.array, _np.ndarray):
             raise TypeError(
                 "dp is type {}, should be numpy.array".format(type(dp)))
 
         self._momentum += dp
-        self._mag_momentum += _np.sqrt(_np.dot(dp, dp))
+        if mag is None:
+            mag = _np.sqrt(_np.dot(dp, dp))
+        self._mag_momentum += mag
 
     def get_momentum(self):
         """Return momentum as numpy.array"""
@@ -322,47 +503,180 @@ class Container:
 
 
 class EllipticalContainer(Container):
-    def __init__(self, radius, a, b):
-        # @todo input checking
-        # might not need radius
-        Container.__init__(self, radius)
-        self.a = a
-        self.b = b
+    """
+    Ellipsoidal container, or an ellipse in 2D. Has infinite mass.
 
-    def get_patch(self):
-        """override Container.get_patch"""
-        # @todo
-        None
+    A ball hits the wall when its centre is its radius from the nearest
+    point of the wall. That surface is not an ellipsoid, so wall times
+    are found by Newton's method in kernels.wall(), for many balls at
+    once.
 
-    def get_radius(self):
-        """probably override Container.get_radius()"""
-        None
+    Extends Container, get_radius() is minus the largest semi-axis.
+    """
+
+    def __init__(self, axes):
+        """Initialise the container with parameters
+
+        Args:
+            axes: list, semi-axes along x, y (and z). 2 for an ellipse
+                holding 2 component Balls, 3 for an ellipsoid.
+        """
+        # input checking
+        if len(axes) not in (2, 3):
+            raise ValueError(
+                "axes has {} components, should be 2 or 3".format(len(axes)))
+        if min(axes) <= 0:
+            raise ValueError("axes are {}, should be positive".format(axes))
+
+        Container.__init__(self, float(max(axes)), dim=len(axes))
+        self._axes = _np.array(axes, dtype=float)
+        self._patch = _patches.Ellipse((0, 0), 2 * self._axes[0],
+                                       2 * self._axes[1], fill=False)
+
+    def __repr__(self):
+        return "EllipticalContainer(axes={})".format(list(self._axes))
+
+    def __str__(self):
+        return """(EllipticalContainer, axes = {}, momentum = {},
+            mag_momentum = {})""".format(
+            self._axes,
+            self.get_momentum(),
+            self.get_mag_momentum())
+
+    def get_axes(self):
+        """Return semi-axes as numpy.array"""
+        return self._axes.copy()
+
+    def _surface(self, inset):
+        """Return area elements of the wall, and mean and Gaussian
+        curvature at each, as numpy.arrays
+
+        The wall is an integral of smooth periodic functions, so even
+        steps in angle, and Gauss-Legendre steps in cos(theta) for the
+        ellipsoid, converge to rounding error. Raises ValueError if
+        *inset* is more than the smallest radius of curvature, where
+        the surface that far inside folds over itself.
+        """
+        bend = min(self._axes) ** 2 / max(self._axes)
+        if inset < 0 or inset > bend:
+            raise ValueError("inset is {}, should be between 0 and the "
+                             "smallest radius of curvature {}".format(
+                                 inset, bend))
+        phi = (_np.arange(256) + 0.5) * (2 * _np.pi / 256)
+        if self._dim == 2:
+            a, b = self._axes
+            ds = _np.sqrt((a * _np.sin(phi)) ** 2 + (b * _np.cos(phi)) ** 2)
+            # a curve has one curvature, a b / ds^3, so H is half of it
+            return (ds * (2 * _np.pi / phi.size), 0.5 * a * b / ds ** 3,
+                    _np.zeros(phi.size))
+        a, b, c = self._axes
+        mu, w = _np.polynomial.legendre.leggauss(128)
+        mu, phi = mu[:, None], phi[None, :]
+        sin = _np.sqrt(1 - mu * mu)
+        # |dr/dmu x dr/dphi| for r = (a sin cos, b sin sin, c mu)
+        dA = _np.sqrt((1 - mu * mu) * ((b * c * _np.cos(phi)) ** 2 +
+                                       (a * c * _np.sin(phi)) ** 2) +
+                      (a * b * mu) ** 2)
+        x = sin * _np.cos(phi) * a
+        y = sin * _np.sin(phi) * b
+        z = mu * c
+        # distance from the centre to the tangent plane
+        h = 1. / _np.sqrt((x / a ** 2) ** 2 + (y / b ** 2) ** 2 +
+                          (z / c ** 2) ** 2)
+        abc = (a * b * c) ** 2
+        H = h ** 3 * (a * a + b * b + c * c - x * x - y * y - z * z) / (
+            2 * abc)
+        return ((w[:, None] * dA * (2 * _np.pi / phi.size)).ravel(),
+                H.ravel(), (h ** 4 / abc).ravel())
+
+    def get_area(self, inset=0.):
+        """Return area of the wall as float, or of the surface *inset*
+        inside it that the centres of balls of radius *inset* reach
+
+        Perimeter of the ellipse in 2D. The inset surface moves each
+        point of the wall *inset* along its normal, so has area element
+        (1 - inset k1)(1 - inset k2) times the wall's, k1 and k2 the
+        principal curvatures there.
+        """
+        dA, H, K = self._surface(inset)
+        return _np.sum(dA * (1 - 2 * H * inset + K * inset * inset))
+
+    def get_volume(self, inset=0.):
+        """Return volume as float, area of the ellipse in 2D, inside the
+        surface *inset* inside the wall
+
+        The shell between them is the integral of the inset surface's
+        area element from 0 to *inset*.
+        """
+        if self._dim == 2:
+            V = _np.pi * _np.prod(self._axes)
+        else:
+            V = (4. / 3.) * _np.pi * _np.prod(self._axes)
+        if inset == 0:
+            return V
+        dA, H, K = self._surface(inset)
+        return V - _np.sum(dA * (inset - H * inset ** 2 +
+                                 K * inset ** 3 / 3.))
+
+    def get_normal(self, pos, radius):
+        """Return unit outward normal of the wall where a ball of
+        *radius* with centre at *pos* touches it, as numpy.array"""
+        return kernels.normal(pos[None, :], _np.array([radius]),
+                              self._axes)[0]
+
+    def contains(self, pos, radius):
+        """Return True if a ball at *pos* with *radius* is clear of the
+        wall. *pos* can also be numpy.array (n, dim), giving an array of
+        bool."""
+        pos = _np.asarray(pos, dtype=float)
+        flat = _np.atleast_2d(pos)
+        radius = _np.broadcast_to(_np.asarray(radius, dtype=float),
+                                  flat.shape[:1])
+        ok = kernels.clear(flat, radius, self._axes)
+        if pos.ndim == 1:
+            return bool(ok[0])
+        return ok
+
+    def inset(self, distance):
+        """Return new empty EllipticalContainer of the same shape,
+        smaller by *distance* all round
+
+        Its semi-axes are *distance* shorter, which is only close to
+        the surface *distance* inside the wall. get_area(*distance*)
+        and get_volume(*distance*) give those of the surface itself.
+        """
+        return EllipticalContainer(list(self._axes - distance))
+
+    def time_to_collision(self, ball):
+        """Return time until *ball* hits the wall in seconds as float,
+        or None if it never does"""
+        t = kernels.wall(ball.get_pos()[None, :], ball.get_vel()[None, :],
+                         _np.array([ball.get_radius()]), self._axes)[0]
+        if t == _np.inf:
+            return None
+        return float(t)
 
 
 class BigBall(Ball):
     """Large ball for use in brownian motion
 
-    Extends Ball by tracking position nodes.
+    Extends Ball by tracking position nodes from the start.
     methods:
-        get_nodes: returns a list of positions where the velocity of
-            BillBall changed
+        get_nodes: returns positions where the velocity of BigBall
+            changed
     """
     def __init__(self, mass=1, radius=1, pos=[0, 0, 0], vel=[0, 0, 0]):
         Ball.__init__(self, mass, radius, pos, vel)
-        self._nodes = [[self.get_pos()[0]], [self.get_pos()[1]], [self.get_pos()[2]]]
-
-    def set_vel(self, new_vel):
-        """Extends Ball.set_vel to track nodes"""
-        self._nodes[0].append(self.get_pos()[0])
-        self._nodes[1].append(self.get_pos()[1])
-        self._nodes[2].append(self.get_pos()[2])
-        Ball.set_vel(self, new_vel)
+        self.set_tracker(trajectory.Trajectory(dim=len(self.get_pos())))
+        self._tracker.append(0., self.get_pos())
 
     def get_nodes(self):
         """
-        Return list of position vectors of points where velocity changed
+        Return numpy.array of position vectors of points where velocity
+        changed, shape (dim, n), dim the number of components of the
+        ball's position
         """
-        return self._nodes
+        return self._tracker.get_nodes()
 
 def _distributeVelocities(n, v, dim):
     vx = 2 * v * (_rand.random(n) - 0.5)
@@ -384,13 +698,42 @@ def _distributeVelocities(n, v, dim):
     return vx, vy, vz
 
 
-def distributeBalls(n, radius, ballsize=1, v=8., dim=2):
+def _maxwellVelocities(n, temperature, dim, dof):
+    """Return velocity components drawn from a Maxwell-Boltzmann
+    distribution at *temperature*, as _distributeVelocities
+
+    The drift is removed, then all velocities are scaled so the kinetic
+    energy is exactly *dof* / 2 kT per ball, which is what
+    System.temperature() reads back with *dof* dimensions.
+    """
+    if temperature <= 0:
+        raise ValueError("temperature is {}, should be positive".format(
+            temperature))
+    vel = _rand.standard_normal((n, dim))
+    vel -= _np.mean(vel, axis=0)
+    # Balls have mass 1, times core.MASS
+    KE = 0.5 * core.MASS * _np.sum(vel * vel)
+    vel *= _np.sqrt(0.5 * dof * n * core.Kb * temperature / KE)
+    if dim == 2:
+        return vel[:, 0], vel[:, 1], _np.zeros(n)
+    return vel[:, 0], vel[:, 1], vel[:, 2]
+
+
+def distributeBalls(n, radius, ballsize=1, v=8., dim=2, planar=False,
+                    temperature=None):
     """Arranges balls in a uniform grid with randomly distributed velocities
 
     Sum of velocities is zero.
     *v* is characteristic velocity, approximately equal to v_max/sqrt(3)
     *dim* is number of dimensions for balls to have vel components in.
     2 for animation.
+    *planar*, if True with *dim* 2, gives Balls with 2 component
+    positions and velocities, for use with Container(radius, dim=2).
+    *temperature*, if not None, replaces *v*: velocities are drawn from
+    the Maxwell-Boltzmann distribution and scaled so System.temperature()
+    is exactly *temperature*, so the velocities start in equilibrium.
+    Balls with 3 components in a 3D container count as 3 dimensions
+    even with *dim* 2.
     """
     if type(n) not in (int, float):
         raise TypeError("n is type {}, should be int".format(type(n)))
@@ -410,17 +753,25 @@ def distributeBalls(n, radius, ballsize=1, v=8., dim=2):
     # this to be positive
     radius = _np.abs(float(radius))
     if dim == 2:
-        return _distributeBalls2D(n=n, radius=radius, ballsize=ballsize, v=v)
+        return _distributeBalls2D(n=n, radius=radius, ballsize=ballsize, v=v,
+                                  planar=planar, temperature=temperature)
     elif dim == 3:
-        return _distributeBalls3D(n=n, radius=radius, ballsize=ballsize, v=v)
+        return _distributeBalls3D(n=n, radius=radius, ballsize=ballsize, v=v,
+                                  temperature=temperature)
 
 
-def _distributeBalls2D(n, radius, ballsize, v):
+def _distributeBalls2D(n, radius, ballsize, v, planar=False,
+                       temperature=None):
     side_len = _np.sqrt(2) * radius
     per_row = int(_np.ceil(_np.sqrt(n)))
     if 2 * ballsize * per_row >= side_len:
         raise ValueError("Too many balls. Got {}".format(n))
-    vx, vy, vz = _distributeVelocities(n=n, v=v, dim=2)
+    if temperature is None:
+        vx, vy, vz = _distributeVelocities(n=n, v=v, dim=2)
+    elif planar:
+        vx, vy, vz = _maxwellVelocities(n, temperature, dim=2, dof=2)
+    else:
+        vx, vy, vz = _maxwellVelocities(n, temperature, dim=2, dof=3)
     balls = []
     # number of balls already created
     ball = 0
@@ -430,24 +781,30 @@ def _distributeBalls2D(n, radius, ballsize, v):
             if ball < n:
                 x = ((col + 0.5) * ballspace) - (side_len / 2)
                 y = ((row + 0.5) * ballspace) - (side_len / 2)
-                balls.append(Ball(pos=[x, y, 0],
-                                  vel=[vx[ball], vy[ball], vz[ball]],
-                                  radius=ballsize
-                                  ))
+                if planar:
+                    pos = [x, y]
+                    vel = [vx[ball], vy[ball]]
+                else:
+                    pos = [x, y, 0]
+                    vel = [vx[ball], vy[ball], vz[ball]]
+                balls.append(Ball(pos=pos, vel=vel, radius=ballsize))
                 ball += 1
             else:
                 break
     return balls
 
 
-def _distributeBalls3D(n, radius, ballsize, v):
+def _distributeBalls3D(n, radius, ballsize, v, temperature=None):
     side_len = _np.sqrt(2) * radius
     print side_len
     per_row = int(_np.ceil(n**(1. / 3.)))
     print per_row
     if 2 * ballsize * per_row >= side_len:
         raise ValueError("Too many balls. Got {}".format(n))
-    vx, vy, vz = _distributeVelocities(n=n, v=v, dim=3)
+    if temperature is None:
+        vx, vy, vz = _distributeVelocities(n=n, v=v, dim=3)
+    else:
+        vx, vy, vz = _maxwellVelocities(n, temperature, dim=3, dof=3)
     balls = []
     # number of balls already created
     ball = 0
@@ -4,10 +4,13 @@
 import sys
 
 import core
+import diffusion
+import engines
 import objects
+import structure
 import system
+import video
 
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.optimize as spo
@@ -16,13 +19,24 @@ import scipy.optimize as spo
 sys.setrecursionlimit(100000)
 
 
-def pressure(num_balls, ballsize, v, dim):
+def pressure(num_balls, ballsize, v, dim, engine="event", temperature=None,
+             equil=2.):
+    """Return [P, T] for *num_balls* balls of radius *ballsize*
+
+    *engine* is passed to engines.makeSystem, by default the reference
+    engine. "auto" picks the fastest for these balls, once for each
+    configuration.
+    If *temperature* is not None, velocities start Maxwellian at that
+    temperature instead of at speed *v*, so *equil*, the seconds run
+    before measuring, can be much shorter.
+    """
     balls = objects.distributeBalls(
-        n=num_balls, radius=12, ballsize=ballsize, v=v, dim=dim)
+        n=num_balls, radius=12, ballsize=ballsize, v=v, dim=dim,
+        temperature=temperature)
     cont = objects.Container(12)
-    mySys = system.System(balls, cont)
+    mySys = engines.makeSystem(balls, cont, engine)
     mySys.init_system(None)
-    mySys.check_collide(2)
+    mySys.check_collide(equil)
     P = mySys.pressure(5)
     T = mySys.temperature()
     return [P, T]
@@ -46,15 +60,54 @@ def genPVdata(num_balls=60, ballsize=0.01):
     return res_3D  # res_2D, res_3D
 
 
-def plotPV(num_balls=27, ballsize=1.9):
+def genPVsweep(num_balls=60, ballsize=0.01, vs=range(2, 21, 1), v0=10.,
+               equil=2., measure=20.):
+    """
+    Generate the same data as genPVdata from a single run
+
+    For hard spheres, multiplying every velocity by a factor only
+    speeds up the same trajectory by that factor. Scaling the starting
+    velocities of one run at characteristic speed *v0* by v / v0 gives
+    exactly the run genPVdata would do at speed v, so pressure and
+    temperature there are (v / v0)**2 times those at *v0*.
+    The run equilibrates for *equil* seconds, then measures for
+    *measure* seconds with System.pressure_stats. Errors scale the same
+    way.
+
+    Returns lists [P, T, N, ballsize, P_err], one entry per v in *vs*
+    """
+    balls = objects.distributeBalls(
+        n=num_balls, radius=12, ballsize=ballsize, v=v0, dim=3)
+    cont = objects.Container(12)
+    mySys = system.System(balls, cont)
+    mySys.init_system(None)
+    mySys.check_collide(equil)
+    stats = mySys.pressure_stats(measure)
+    T0 = mySys.temperature()
+    res_3D = [[], [], [], [], []]
+    for v in vs:
+        scale = (float(v) / v0) ** 2
+        res_3D[0].append(stats["pressure"] * scale)
+        res_3D[1].append(T0 * scale)
+        res_3D[2].append(num_balls)
+        res_3D[3].append(ballsize)
+        res_3D[4].append(stats["pressure_err"] * scale)
+    return res_3D
+
+
+def plotPV(num_balls=27, ballsize=1.9, sweep=False):
     """
     Plot pressure against NkT with ideal and Van der Waals predictions
 
     Args:
         num_balls, int, number of balls
         ballsize, float, ball radius
+        sweep, bool, get every point from a single run with genPVsweep
     """
-    res_3D = genPVdata(num_balls, ballsize)
+    if sweep:
+        res_3D = genPVsweep(num_balls, ballsize)
+    else:
+        res_3D = genPVdata(num_balls, ballsize)
     plt.figure(1)
     # NkT_2D = [N * core.Kb * T for N, T in zip(res_2D[2], res_2D[1])]
     NkT_3D = [N * core.Kb * T for N, T in zip(res_3D[2], res_3D[1])]
@@ -73,7 +126,11 @@ def plotPV(num_balls=27, ballsize=1.9):
     expected_ideal = p * ((4. / 3.) * np.pi * 12.**3)
     line2 = plt.plot(p, expected_ideal, 'k-.', label="Ideal gas prediction")
     # line3 = plt.plot(res_2D[0], NkT_2D, 'bo', label="2D data")
-    line4 = plt.plot(res_3D[0], NkT_3D, 'ro', label="3D data")
+    if sweep:
+        line4 = plt.errorbar(res_3D[0], NkT_3D, xerr=res_3D[4], fmt='ro',
+                             label="3D data")
+    else:
+        line4 = plt.plot(res_3D[0], NkT_3D, 'ro', label="3D data")
     plt.legend()
     plt.xlabel("Pressure in Pascals")
     plt.ylabel("NkT in Pascals per cubic meter")
@@ -82,14 +139,21 @@ def plotPV(num_balls=27, ballsize=1.9):
     print res_3D
 
 
-def genMaxwellBData(v=15.):
+def genMaxwellBData(v=15., temperature=None, collision_times=5.):
+    """Return speeds of balls and temperature after equilibrating
+
+    Runs for *collision_times* characteristic collision times. If
+    *temperature* is not None, velocities start Maxwellian at that
+    temperature instead of at speed *v*, and need little or no run.
+    """
     # params
     rad = 12.
     ballsize = 0.2
     num_balls = 400
 
     # INITIALIZE SYSTEM
-    balls = objects.distributeBalls(num_balls, rad, ballsize, v, 3)
+    balls = objects.distributeBalls(num_balls, rad, ballsize, v, 3,
+                                    temperature=temperature)
     cont = objects.Container(rad)
     mySys = system.System(balls, cont)
     mySys.init_system(None)
@@ -98,8 +162,8 @@ def genMaxwellBData(v=15.):
         v = ball.get_vel()
         vels.append(np.dot(v, v))
     v_bar = np.mean(vels)
-    # 5 times charictersitic collision time
-    t = 5. * ((4. / 3.) * np.pi * rad**3) / (
+    # multiple of charictersitic collision time
+    t = collision_times * ((4. / 3.) * np.pi * rad**3) / (
         np.sqrt(v_bar) * 4. * np.pi * ballsize**2 * num_balls)
     mySys.advance(t)
     vels = []
@@ -127,27 +191,171 @@ def plotMaxwellB():
     plt.show()
 
 
+def plotRDF(num_balls=200, ballsize=0.6, v=10., equil=5., step=0.05,
+            snapshots=100, engine="event"):
+    """
+    Plot radial distribution function g(r) of a hard sphere gas
+
+    Equilibrates for *equil* seconds, then takes *snapshots* snapshots
+    *step* seconds apart. g(r) is 0 inside 2 * *ballsize*, and the
+    peak at contact shows the pair structure the Van der Waals
+    correction in plotPV comes from. *engine* is passed to
+    engines.makeSystem.
+    """
+    balls = objects.distributeBalls(
+        n=num_balls, radius=12, ballsize=ballsize, v=v, dim=3)
+    cont = objects.Container(15)
+    mySys = engines.makeSystem(balls, cont, engine)
+    mySys.init_system(None)
+    mySys.check_collide(equil)
+    rdf = structure.RadialDistribution(cont, 8 * ballsize, bins=40,
+                                       ballsize=ballsize)
+    rdf.collect(mySys, step, snapshots)
+    plt.plot(rdf.get_centres(), rdf.get_g(), 'r-')
+    plt.axvline(2 * ballsize, color='k', linestyle='--')
+    plt.xlabel("r")
+    plt.ylabel("g(r)")
+    plt.show()
+    return rdf
+
+
 def brownGen():
     """Generate brownian motion animation and plot"""
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=core.FRAMERATE, bitrate=1800)
-    balls = objects.distributeBalls(60, 5, ballsize=0.1, v=20.)
-    big_ball = objects.BigBall(pos=[7, 0, 0], radius=1., mass=5)
+    balls = objects.distributeBalls(60, 5, ballsize=0.1, v=20., planar=True)
+    big_ball = objects.BigBall(pos=[7, 0], vel=[0, 0], radius=1., mass=5)
     balls.append(big_ball)
-    cont = objects.Container(9)
+    cont = objects.Container(9, dim=2)
     mySys = system.System(balls, cont)
-    fig = plt.figure()
-    ax = plt.axes(xlim=(-20, 20), ylim=(-20, 20))
-    ax.axes.set_aspect('equal')
-    mySys.init_system(ax)
-    anim = animation.FuncAnimation(
-        fig, mySys.next_frame, frames=2000,
-        interval=20, blit=True, repeat=False
-    )
-    anim.save("mov.mp4", writer=writer)
+    # the big ball brighter than the rest
+    shades = [160] * (len(balls) - 1) + [255]
+    video.record(mySys, 2000, "mov.mp4", shades=shades)
     fig2 = plt.figure(2)
     ax2 = plt.axes(xlim=(-20, 20), ylim=(-20, 20))
     ax2.add_artist(plt.Circle((0, 0), 9, fill=False))
     nodes = big_ball.get_nodes()
     plt.plot(nodes[0], nodes[1])
-    plt.savefig("brown.png")
\ No newline at end of file
+    plt.savefig("brown.png")
+
+def brownDiffusion(replicas=4, t_end=20., dt=0.02):
+    """
+    Estimate the diffusion coefficient of the BigBall in brownGen()
+
+    Runs *replicas* independent systems for *t_end* seconds without
+    animating, then fits the mean squared displacement of the BigBall
+    resampled every *dt* seconds. Return D and its error as floats.
+    """
+    paths = []
+    for i in xrange(replicas):
+        balls = objects.distributeBalls(60, 5, ballsize=0.1, v=20.,
+                                        planar=True)
+        big_ball = objects.BigBall(pos=[7, 0], vel=[0, 0], radius=1.,
+                                   mass=5)
+        balls.append(big_ball)
+        cont = objects.Container(9, dim=2)
+        mySys = system.System(balls, cont)
+        mySys.init_system(None)
+        mySys.check_collide(t_end)
+        # finish the path at the current position
+        big_ball.get_tracker().append(mySys.get_time(), big_ball.get_pos())
+        paths.append(big_ball.get_tracker())
+    lags, mean_msd, msds = diffusion.msd(paths, dt)
+    D, err = diffusion.fit_diffusion(lags, msds, dim=2)
+    print "D", D, "+/-", err
+    plt.plot(lags, mean_msd, 'r-', label="Mean squared displacement")
+    plt.plot(lags, 4 * D * lags, 'k--', label="Fit, D = {:.3g}".format(D))
+    plt.legend()
+    plt.xlabel("Lag in seconds")
+    plt.ylabel("Mean squared displacement")
+    plt.show()
+    return D, err
+
+
+def _freeBalls(mySys, n, ballsize):
+    """Return *n* balls of radius *ballsize* at random places where they
+    fit in *mySys*, moving in random directions at the root mean square
+    speed of its balls so the temperature stays the same"""
+    cont = mySys.get_container()
+    axes = cont.get_axes()
+    pos = mySys.get_positions()
+    radius = np.array([ball.get_radius() for ball in mySys.get_balls()])
+    speed = np.sqrt(np.mean([np.dot(ball.get_vel(), ball.get_vel())
+                             for ball in mySys.get_balls()]))
+    balls = []
+    while len(balls) < n:
+        p = (2 * np.random.rand(len(axes)) - 1) * axes
+        if not cont.contains(p, ballsize):
+            continue
+        if np.any(np.sum((pos - p) ** 2, axis=1) <= (radius + ballsize) ** 2):
+            continue
+        vel = np.random.normal(size=len(axes))
+        balls.append(objects.Ball(radius=ballsize, pos=p,
+                                  vel=speed * vel / np.linalg.norm(vel)))
+        pos = np.vstack([pos, p])
+        radius = np.append(radius, ballsize)
+    return balls
+
+
+def warmSweep(param, values, num_balls=27, ballsize=1.9, v=10.,
+              equil=2., reequil=0.5, measure=5.):
+    """
+    Measure pressure and temperature over a sweep, reusing one system
+
+    Only the first point starts cold from distributeBalls. Each later
+    point starts from the equilibrated state of the one before, so only
+    needs *reequil* seconds to settle rather than *equil*.
+
+    Args:
+        param: str, what to sweep. "ballsize" shrinks the balls,
+            "num_balls" removes balls at random or adds them at random
+            free places, and "v" rescales the velocities. Ball sizes
+            are run largest first, since balls can always shrink
+            without overlapping. Other points are run in the order
+            given.
+        values: list of values of *param*
+        num_balls, ballsize, v: starting values of the other parameters
+        measure: float, seconds to measure pressure over at each point
+
+    Returns lists [P, T, N, ballsize, P_err] in the order the points
+    were run, and a dict of System.get_state() for each value.
+    """
+    if param not in ("ballsize", "num_balls", "v"):
+        raise ValueError("can't sweep {}".format(param))
+    if param == "ballsize":
+        values = sorted(values, reverse=True)
+        ballsize = values[0]
+    elif param == "num_balls":
+        num_balls = values[0]
+    else:
+        v = values[0]
+    balls = objects.distributeBalls(
+        n=num_balls, radius=12, ballsize=ballsize, v=v, dim=3)
+    cont = objects.Container(12)
+    mySys = system.System(balls, cont)
+    mySys.init_system(None)
+    mySys.check_collide(equil)
+    res_3D = [[], [], [], [], []]
+    states = {}
+    for value in values:
+        if param == "ballsize" and value != ballsize:
+            ballsize = value
+            mySys.resize_balls(ballsize)
+        elif param == "num_balls" and value < num_balls:
+            mySys.remove_balls(list(np.random.choice(
+                mySys.get_balls(), num_balls - value, replace=False)))
+            num_balls = value
+        elif param == "num_balls" and value > num_balls:
+            mySys.add_balls(_freeBalls(mySys, value - num_balls, ballsize))
+            num_balls = value
+        elif param == "v" and value != v:
+            mySys.rescale_velocities(value / float(v))
+            v = value
+        if value != values[0]:
+            mySys.advance(reequil)
+        stats = mySys.pressure_stats(measure)
+        res_3D[0].append(stats["pressure"])
+        res_3D[1].append(mySys.temperature())
+        res_3D[2].append(num_balls)
+        res_3D[3].append(ballsize)
+        res_3D[4].append(stats["pressure_err"])
+        states[value] = mySys.get_state()
+    return res_3D, states
@@ -0,0 +1,298 @@
+"""
+Fixed time step alternative to the event driven System
+
+Every step moves all balls, then finds and resolves any overlapping
+pairs and wall contacts at once with numpy arrays. For dense gases this
+is much faster than handling each collision in order, at the cost of
+collisions happening up to one step late. Check results against
+system.System, which is exact.
+
+Balls with a tracker when the system is made, such as a BigBall, get a
+node added to their path whenever a step changes their velocity.
+
+Defines:
+    SteppedSystem, Class
+
+Ethan Mills
+"""
+import core
+import grid
+import kernels
+import objects
+
+import matplotlib.collections as _collections
+import numpy as _np
+
+from core import FRAMERATE, Kb
+
+
+class SteppedSystem:
+    """Contain all the balls as arrays; keep track of time; move balls
+    in fixed steps and resolve collisions between steps; calculate state
+    variables. Has the same interface as system.System.
+
+    Methods:
+        init_system(figure, collection=False)
+        next_frame(f)
+        check_collide(end_t=0)
+        advance(step)
+        tick(step)
+        sync_balls()
+        get_balls()
+        get_container()
+        get_positions()
+        get_velocities()
+        get_time()
+        get_dt()
+        total_KE()
+        mean_KE()
+        temperature()
+        pressure(step)
+        get_total_momentum()
+    """
+
+    def __init__(self, balls, container, dt=None, index="auto"):
+        """Initialise the system with objects
+
+        The balls are copied into arrays, so they are only updated when
+        sync_balls() is called.
+
+        Args:
+            balls: list, objects.Ball to include in system
+            container: objects.Container for system
+            dt: float, time step in seconds. If None, the time for the
+                fastest ball to move a tenth of the smallest radius, which
+                needs at least one moving ball.
+            index: str, how to find pairs that might touch. "uniform"
+                for a grid.CellGrid, "multi" for a grid.MultiGrid, or
+                "auto" to use a MultiGrid when the largest ball is more
+                than twice the size of the smallest.
+        """
+        if type(balls) is not list:
+            raise TypeError("balls is not of type list")
+        if isinstance(container, objects.Container) is False:
+            raise TypeError("container is not instance of Container")
+        if dt is not None and dt <= 0:
+            raise ValueError("dt is {}, should be positive".format(dt))
+        if index not in ("auto", "uniform", "multi"):
+            raise ValueError("index is {}, should be auto, uniform or "
+                             "multi".format(index))
+
+        self._balls = balls
+        self._container = container
+        self._pos = _np.array([ball.get_pos() for ball in balls], dtype=float)
+        self._vel = _np.array([ball.get_vel() for ball in balls], dtype=float)
+        self._radius = _np.array([ball.get_radius() for ball in balls])
+        self._mass = _np.array([ball.get_mass() for ball in balls])
+        self._axes = container.get_axes()
+        self._dim = container.get_dim()
+        if dt is None:
+            speed = _np.sqrt(_np.max(_np.sum(self._vel * self._vel, axis=1)))
+            if speed == 0:
+                raise ValueError("all balls are at rest, dt must be given")
+            dt = 0.1 * _np.min(self._radius) / speed
+        self._dt = float(dt)
+        if index == "auto":
+            if _np.max(self._radius) > 2 * _np.min(self._radius):
+                index = "multi"
+            else:
+                index = "uniform"
+        if index == "multi":
+            self._grid = grid.MultiGrid(self._radius, dim=self._dim)
+        else:
+            self._grid = grid.CellGrid(2 * _np.max(self._radius),
+                                       dim=self._dim)
+        self._wall_momentum = _np.zeros(self._dim)
+        self._wall_impulse = 0.
+        self._tracked = _np.array([i for i, ball in enumerate(balls)
+                                   if ball.get_tracker() is not None],
+                                  dtype=int)
+        self._time = 0.
+        self._frame = 0
+        self._collection = None
+        core.logging.log(15, "SteppedSystem dt = {}, {}".format(
+            self._dt, self._grid))
+
+    def init_system(self, figure, collection=False):
+        """Initialise system.
+
+        If animating, draw objects in their starting positions on
+        *figure*, as in System.init_system().
+        """
+        if figure is None:
+            return None
+        figure.add_artist(self._container.get_patch())
+        if collection:
+            diameters = 2 * self._radius
+            self._collection = _collections.EllipseCollection(
+                diameters, diameters, _np.zeros(len(self._balls)),
+                units='xy', offsets=self._pos[:, :2],
+                transOffset=figure.transData)
+            figure.add_collection(self._collection)
+            return [self._collection]
+        ret = []
+        for ball in self._balls:
+            figure.add_patch(ball.get_patch())
+            ret.append(ball.get_patch())
+        return ret
+
+    def next_frame(self, f):
+        """Called by matplotlib.animation.FuncAnimation()
+
+        Advance time to when frame *f* occurs and draw objects.
+        """
+        self.check_collide()
+        self.tick((f / FRAMERATE) - self._time)
+        self._frame = f
+        if self._collection is not None:
+            self._collection.set_offsets(self._pos[:, :2])
+            return [self._collection]
+        self.sync_balls()
+        return [ball.get_patch() for ball in self._balls]
+
+    def check_collide(self, end_t=0):
+        """Step the system up to *end_t*, or the next frame if 0"""
+        if end_t == 0:
+            end_t = (self._frame + 1) / FRAMERATE
+        while end_t - self._time > self._dt:
+            self._step(self._dt)
+        self._step(end_t - self._time)
+
+    def advance(self, step):
+        """Move the system forward in time by *step* seconds"""
+        self.check_collide(self._time + step)
+
+    def tick(self, step):
+        """Move balls by *step* seconds without resolving collisions"""
+        if step <= 0:
+            return None
+        self._pos += self._vel * step
+        self._time += step
+
+    def _step(self, step):
+        """Move balls by *step*, then resolve contacts"""
+        if step <= 0:
+            return None
+        self.tick(step)
+        self._walls()
+        self._pairs()
+
+    def _walls(self):
+        """Reflect balls touching the container and moving outwards"""
+        out = ~self._container.contains(self._pos, self._radius)
+        if not _np.any(out):
+            return None
+        n = kernels.normal(self._pos[out], self._radius[out], self._axes)
+        u = _np.sum(self._vel[out] * n, axis=1)
+        hit = u > 0
+        idx = _np.nonzero(out)[0][hit]
+        du = 2 * u[hit, None] * n[hit]
+        self._vel[idx] -= du
+        self._add_nodes(idx)
+        dp = self._mass[idx, None] * du
+        self._wall_momentum += _np.sum(dp, axis=0)
+        self._wall_impulse += _np.sum(_np.sqrt(_np.sum(dp * dp, axis=1)))
+
+    def _pairs(self):
+        """Resolve all overlapping pairs that are moving together
+
+        A ball touching two others at once hits them one after the
+        other, so pairs are done in rounds of pairs with no ball in
+        common until none is moving together. Every collision is
+        elastic, so energy and momentum are conserved exactly.
+        """
+        i, j = self._grid.pairs(self._pos)
+        if len(i) == 0:
+            return None
+        r = self._pos[j] - self._pos[i]
+        dist2 = _np.sum(r * r, axis=1)
+        touch = self._radius[i] + self._radius[j]
+        near = dist2 < touch * touch
+        i, j, r, dist2 = i[near], j[near], r[near], dist2[near]
+        mi, mj = self._mass[i], self._mass[j]
+        hit = []
+        while True:
+            dv = self._vel[j] - self._vel[i]
+            closing = _np.sum(r * dv, axis=1)
+            coll = _np.nonzero(closing < 0)[0]
+            if len(coll) == 0:
+                break
+            # each ball goes to the first of its pairs this round
+            first = _np.full(len(self._pos), len(i))
+            _np.minimum.at(first, i[coll], coll)
+            _np.minimum.at(first, j[coll], coll)
+            coll = coll[(first[i[coll]] == coll) & (first[j[coll]] == coll)]
+            # impulse on j along the line of centres, for an elastic
+            # collision
+            J = (2 * mi[coll] * mj[coll] / (mi[coll] + mj[coll])) * \
+                closing[coll] / dist2[coll]
+            dp = J[:, None] * r[coll]
+            self._vel[i[coll]] += dp / mi[coll, None]
+            self._vel[j[coll]] -= dp / mj[coll, None]
+            hit.append(coll)
+        if len(hit) > 0:
+            hit = _np.concatenate(hit)
+            self._add_nodes(_np.concatenate((i[hit], j[hit])))
+
+    def _add_nodes(self, idx):
+        """Add a node to the path of any of balls *idx* being tracked"""
+        if len(self._tracked) == 0:
+            return None
+        for k in _np.intersect1d(idx, self._tracked):
+            self._balls[k].get_tracker().append(self._time, self._pos[k])
+
+    def sync_balls(self):
+        """Copy positions and velocities back to the Ball objects"""
+        for ball, pos, vel in zip(self._balls, self._pos, self._vel):
+            ball.set_pos(pos)
+            ball.set_vel(vel)
+
+    def get_balls(self):
+        """Return list of balls, only up to date after sync_balls()"""
+        return self._balls
+
+    def get_container(self):
+        """Return the container of the system"""
+        return self._container
+
+    def get_positions(self):
+        """Return positions of all balls as numpy.array, shape (n, dim)"""
+        return self._pos
+
+    def get_velocities(self):
+        """Return velocities of all balls as numpy.array, shape (n, dim)"""
+        return self._vel
+
+    def get_time(self):
+        """Return current time of system in seconds as float"""
+        return self._time
+
+    def get_dt(self):
+        """Return time step in seconds as float"""
+        return self._dt
+
+    def total_KE(self):
+        """Return total system KE as float"""
+        return 0.5 * core.MASS * _np.sum(
+            self._mass * _np.sum(self._vel * self._vel, axis=1))
+
+    def mean_KE(self):
+        """Return mean ball KE as float"""
+        return self.total_KE() / len(self._balls)
+
+    def temperature(self):
+        """Return temperature of system as float"""
+        return (2. / self._dim) * self.mean_KE() / Kb
+
+    def pressure(self, step):
+        """Return pressure of system averaged over *step* seconds as float"""
+        p0 = self._wall_impulse * core.MASS
+        self.advance(step)
+        p1 = self._wall_impulse * core.MASS
+        F = (p1 - p0) / step
+        return F / self._container.get_area()
+
+    def get_total_momentum(self):
+        """Return total momentum of container and all balls. Should be zero"""
+        return (_np.sum(self._mass[:, None] * self._vel, axis=0) +
+                self._wall_momentum)
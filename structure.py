@@ -0,0 +1,206 @@
+"""
+Radial distribution function g(r) of the balls in a system
+
+Pairs closer than r_max are found with a grid.CellGrid and their
+distances binned with numpy, so each snapshot costs about O(N) rather
+than O(N^2). Counts add up over as many snapshots as are given.
+
+Near the wall a ball has fewer neighbours than in an infinite gas, so
+g(r) is normalised by the number of pairs that points spread uniformly
+over the space the centres can reach would give, rather than by the
+bulk density. For a sphere or circle that comes from the exact
+distribution of the distance between two random points in it. An
+ellipsoid is a stretched sphere, so its distribution is an average of
+the sphere's over directions, which is integrated numerically. The
+centres of balls in an ellipsoid reach a surface a ball radius inside
+the wall, which is not an ellipsoid, so the distribution of the
+ellipsoid with shorter semi-axes is moved by the difference in the
+terms that depend on volume and area, the leading two in r. That holds
+while r_max is well inside the smallest semi-axis.
+
+Defines:
+    RadialDistribution, Class
+
+Ethan Mills
+"""
+import core
+import grid
+import objects
+
+import numpy as _np
+
+
+def _sphere_cdf(r, R, dim):
+    """Return probability two uniform random points in a sphere (circle
+    if *dim* is 2) of radius *R* are closer than *r*"""
+    x = _np.clip(r / (2. * R), 0., 1.)
+    if dim == 3:
+        # 3D: F(r) = (r/R)^3 - 9/16 (r/R)^4 + 1/32 (r/R)^6
+        return 8 * x ** 3 - 9 * x ** 4 + 2 * x ** 6
+    # 2D: integral of 16 x / pi (acos(x) - x sqrt(1 - x^2)) over x
+    return (2. / _np.pi) * (4 * x * x * _np.arccos(x) + _np.arcsin(x) -
+                            x * (1 + 2 * x * x) * _np.sqrt(1 - x * x))
+
+
+def _directions(dim, n=256):
+    """Return unit vectors and quadrature weights, summing to 1, for
+    averaging over directions in *dim* dimensions"""
+    if dim == 2:
+        phi = (_np.arange(n) + 0.5) * (2 * _np.pi / n)
+        return (_np.column_stack([_np.cos(phi), _np.sin(phi)]),
+                _np.full(n, 1. / n))
+    # Gauss-Legendre in cos(theta), even steps in phi
+    mu, w = _np.polynomial.legendre.leggauss(n // 2)
+    phi = (_np.arange(n) + 0.5) * (2 * _np.pi / n)
+    mu, phi = _np.meshgrid(mu, phi, indexing='ij')
+    w = _np.repeat(w / (2. * n), n)
+    sin = _np.sqrt(1 - mu * mu)
+    return (_np.column_stack([(sin * _np.cos(phi)).ravel(),
+                              (sin * _np.sin(phi)).ravel(), mu.ravel()]), w)
+
+
+def _ellipsoid_cdf(axes, r, n=256):
+    """Return probability two uniform random points in the ellipsoid
+    with semi-axes *axes* are closer than *r*
+
+    Points u apart in the ellipsoid are |u / axes| apart in the unit
+    sphere it is stretched from. Writing u = r w for a direction w, with
+    k = |w / axes|,
+        F(r) = mean over w of k^-dim F_1(r k) / mean over w of k^-dim
+    where F_1 is _sphere_cdf for the unit sphere, and the denominator is
+    the product of *axes*. The mean is taken with _directions(), with
+    *n* steps around each angle.
+    """
+    axes = _np.asarray(axes, dtype=float)
+    w, weights = _directions(len(axes), n)
+    k = _np.sqrt(_np.sum((w / axes) ** 2, axis=1))
+    weights = weights * k ** -len(axes)
+    r = _np.asarray(r, dtype=float)
+    F = _sphere_cdf(r[..., None] * k, 1., len(axes))
+    return _np.dot(F, weights) / _np.sum(weights)
+
+
+def _convex_cdf(r, V, A, dim):
+    """Return the leading two terms in *r* of the probability two
+    uniform random points in a convex body of volume *V* and surface
+    area *A* (perimeter in 2D) are closer than *r*
+
+    Points u apart both fall in the body in a volume V - |u| A / 4 in
+    3D, V - |u| A / pi in 2D, on average over directions (Cauchy's
+    formula), up to terms in |u|^2.
+    """
+    r = _np.asarray(r, dtype=float)
+    if dim == 3:
+        return (4. / 3.) * _np.pi * r ** 3 / V - 0.25 * _np.pi * r ** 4 * A / (
+            V * V)
+    return _np.pi * r ** 2 / V - (2. / 3.) * r ** 3 * A / (V * V)
+
+
+class RadialDistribution:
+    """Histogram of distances between pairs of balls, built up over many
+    snapshots, and the g(r) it gives.
+
+    Methods:
+        add(pos)
+        collect(mySys, step, snapshots)
+        get_edges()
+        get_centres()
+        get_counts()
+        get_snapshots()
+        get_g()
+    """
+
+    def __init__(self, container, r_max, bins=100, ballsize=0.):
+        """Initialise empty histogram
+
+        Args:
+            container: objects.Container or EllipticalContainer holding
+                the balls
+            r_max: float, largest distance to bin
+            bins: int, number of bins between 0 and *r_max*
+            ballsize: float, radius of the balls. Centres stay this far
+                from the wall, which sets the normalisation.
+        """
+        if r_max <= 0:
+            raise ValueError("r_max is {}, should be positive".format(r_max))
+        if type(bins) is not int or bins <= 0:
+            raise ValueError("bins is {}, should be a positive int".format(
+                bins))
+        self._dim = container.get_dim()
+        self._inner = container.inset(ballsize)
+        self._r_max = float(r_max)
+        self._edges = _np.linspace(0., self._r_max, bins + 1)
+        self._counts = _np.zeros(bins)
+        self._pairs = 0.
+        self._snapshots = 0
+        self._grid = grid.CellGrid(self._r_max, dim=self._dim)
+        if isinstance(container, objects.EllipticalContainer):
+            # centres fill the surface *ballsize* inside the wall, which
+            # is not quite the inset ellipsoid. Their leading terms
+            # differ by its volume and area.
+            cdf = (_ellipsoid_cdf(self._inner.get_axes(), self._edges) +
+                   _convex_cdf(self._edges, container.get_volume(ballsize),
+                               container.get_area(ballsize), self._dim) -
+                   _convex_cdf(self._edges, self._inner.get_volume(),
+                               self._inner.get_area(), self._dim))
+        else:
+            cdf = _sphere_cdf(self._edges, abs(self._inner.get_radius()),
+                              self._dim)
+        # fraction of random pairs in each bin
+        self._ideal = _np.diff(cdf)
+
+    def __repr__(self):
+        return "RadialDistribution(r_max={}, bins={})".format(
+            self._r_max, len(self._counts))
+
+    def add(self, pos):
+        """Add the pairs of one snapshot, *pos* numpy.array (n, dim)"""
+        pos = _np.asarray(pos, dtype=float)
+        i, j = self._grid.pairs(pos)
+        r = pos[i] - pos[j]
+        d = _np.sqrt(_np.sum(r * r, axis=1))
+        d = d[d < self._r_max]
+        idx = (d * (len(self._counts) / self._r_max)).astype(int)
+        self._counts += _np.bincount(idx, minlength=len(self._counts))
+        n = len(pos)
+        self._pairs += 0.5 * n * (n - 1)
+        self._snapshots += 1
+
+    def collect(self, mySys, step, snapshots):
+        """Run *mySys* and add a snapshot every *step* seconds
+
+        *mySys* is a system.System or stepped.SteppedSystem, which is
+        advanced by *step* * *snapshots* seconds in total.
+        """
+        for k in xrange(snapshots):
+            mySys.advance(step)
+            self.add(mySys.get_positions())
+        core.logging.log(15, "{} has {} snapshots".format(
+            self, self._snapshots))
+
+    def get_edges(self):
+        """Return bin edges as numpy.array"""
+        return self._edges.copy()
+
+    def get_centres(self):
+        """Return bin centres as numpy.array"""
+        return 0.5 * (self._edges[1:] + self._edges[:-1])
+
+    def get_counts(self):
+        """Return number of pairs counted in each bin as numpy.array"""
+        return self._counts.copy()
+
+    def get_snapshots(self):
+        """Return number of snapshots added as int"""
+        return self._snapshots
+
+    def get_g(self):
+        """Return g(r) in each bin as numpy.array
+
+        1 everywhere for balls that ignore each other, whatever the
+        shape of the container.
+        """
+        if self._snapshots == 0:
+            raise ValueError("no snapshots added")
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            return self._counts / (self._pairs * self._ideal)
@@ -10,7 +10,12 @@ import heapq
 
 import objects
 import core
+import grid
+import kernels
+import live
+import trajectory
 
+import matplotlib.collections as _collections
 import numpy as _np
 
 from core import close, FRAMERATE, Kb
@@ -22,17 +27,66 @@ class System:
     variables.
     """
 
-    def __init__(self, balls, container):
+    def __init__(self, balls, container, batch_tol=None, horizon=None,
+                 orbits=False, index=None):
         """Initialise the system with objects
 
         Args:
             balls: list, objects.Ball to include in system
             container: objects.Container for system
+            batch_tol: float or None. If a float, every collision within
+                *batch_tol* seconds of the next one that involves
+                different balls is carried out at the same time, with
+                the vectorised functions in kernels. If None, collisions
+                are carried out one at a time with Ball.collide.
+            horizon: float or None. If a float, collisions more than
+                *horizon* seconds ahead are not queued. Instead the ball
+                is looked at again after *horizon* seconds, and only
+                the balls near it in *index* are checked. Saves work
+                when collisions are rare and the container is large. If
+                None, the next collision is always queued however far
+                ahead it is. Batched predictions check every ball, so
+                a horizon needs *batch_tol* None unless *orbits*.
+            orbits: bool. If True, balls are moved along their orbits
+                round the container in closed form with kernels.orbit,
+                and wall hits are never queued. Only collisions between
+                balls are events, so runs where those are rare are much
+                faster. Needs a spherical container. If *horizon* is
+                None it is set to the time the fastest ball takes to
+                cross the radius of the container.
+            index: str or None. Needs a *horizon*. "uniform" or "multi"
+                keep a list of the balls near each ball, found with a
+                grid.CellGrid or grid.MultiGrid, and only those are
+                checked when one ball's next collision is predicted.
+                "auto" uses a MultiGrid when the largest ball is more
+                than twice the smallest, as in SteppedSystem. If None,
+                "auto" when there is a *horizon* and every ball is
+                checked otherwise. Orbit predictions always check
+                every ball.
         """
         if type(balls) is not list:
             raise TypeError("balls is not of type list")
         if isinstance(container, objects.Container) is False:
             raise TypeError("container is not instance of Container")
+        if orbits and isinstance(container, objects.EllipticalContainer):
+            raise ValueError("orbits need a spherical container")
+        if index not in (None, "uniform", "multi", "auto"):
+            raise ValueError("index is {}, should be None, uniform, multi "
+                             "or auto".format(index))
+        if index is not None and horizon is None:
+            raise ValueError("index needs a horizon")
+        if horizon is not None and batch_tol is not None and not orbits:
+            raise ValueError("horizon needs batch_tol None, batched "
+                             "predictions check every ball")
+        if horizon is not None and index is None and not orbits:
+            # without an index a horizon only adds work
+            index = "auto"
+        self._dim = container.get_dim()
+        for ball in balls:
+            if len(ball.get_pos()) != self._dim:
+                raise ValueError(
+                    "{} does not have {} components like container".format(
+                        ball, self._dim))
         self._balls = balls
         self._container = container
         self._objects = self._balls[:]
@@ -40,8 +94,30 @@ class System:
         self._collisions = []
         self._time = 0.
         self._frame = 0
+        self._batch_tol = batch_tol
+        self._horizon = horizon
+        self._orbits = orbits
+        self._orbit = None
+        self._grid_kind = index
+        self._near = None
+        self._history = None
+        self._event_log = None
+        self._publisher = None
+        self._publish_every = None
+        self._published = 0
+        self._reindex()
+        self._collection = None
+        self._samples = None
+        self._events = 0
+        self._violation = None
+        self._num_violations = 0
+        # running totals of KE and momentum, updated from per-collision
+        # deltas
+        self.resync()
+        if orbits and horizon is None and self._v_max > 0:
+            self._horizon = abs(container.get_radius()) / self._v_max
 
-    def init_system(self, figure):
+    def init_system(self, figure, collection=False):
         """Initialise system.
 
         Generate collisions heap. If animating, draw objects in their
@@ -50,15 +126,25 @@ class System:
         Args:
         figure: matplotlib.pyplot.axes object. Axes to draw objects on.
             Pass None if not animating.
+        collection: bool, draw all balls as a single
+            matplotlib.collections.EllipseCollection instead of one
+            Circle each. Much faster to redraw for large numbers of balls.
         """
         core.logging.log(10, "called init_func")
         ret = []
-        for i, ball in enumerate(self._balls):
-            self.next_collides(ball)
+        self.reset_queue()
 
         if figure is not None:
             # draw the figures
             figure.add_artist(self._container.get_patch())
+            if collection:
+                diameters = [2 * ball.get_radius() for ball in self._balls]
+                self._collection = _collections.EllipseCollection(
+                    diameters, diameters, _np.zeros(len(self._balls)),
+                    units='xy', offsets=self.get_positions()[:, :2],
+                    transOffset=figure.transData)
+                figure.add_collection(self._collection)
+                return [self._collection]
             for ball in self._balls:
                 figure.add_patch(ball.get_patch())
                 ret.append(ball.get_patch())
@@ -83,16 +169,45 @@ class System:
         self.check_collide()
         step = (f / FRAMERATE) - self._time
         self.tick(step)
+        self._frame = f
+        if self._collection is not None:
+            # one vectorised update instead of one per patch
+            self._collection.set_offsets(self.get_positions()[:, :2])
+            return [self._collection]
         for ball in self._balls:
             patches.append(ball.get_patch())
-        self._frame = f
         return patches
 
     def collide(self):
         """Perform next collision, then update the queue."""
+        if self._batch_tol is not None:
+            return self._collide_batch()
         next_coll = heapq.heappop(self._collisions)
         obj1, obj2 = next_coll[1]
+        if obj2 is None:
+            # reached the horizon without colliding, look again
+            if self._orbits:
+                # along with every other ball that reached it then
+                rescans = [obj1]
+                while (len(self._collisions) > 0 and
+                       self._collisions[0][0] == next_coll[0] and
+                       self._collisions[0][1][1] is None):
+                    rescans.append(heapq.heappop(self._collisions)[1][0])
+                return self._predict_orbits(rescans, now=next_coll[0])
+            return self.next_collides(obj1, now=next_coll[0])
+        KE0, p0, scale = self._pair_state(obj1, obj2)
+        vel1 = obj1.get_vel()
         obj1.collide(obj2)
+        if self._orbits:
+            self._start_orbits((obj1, obj2))
+        KE1, p1, _ = self._pair_state(obj1, obj2)
+        self._book_keep(KE1 - KE0, p1 - p0, KE0, scale)
+        if self._samples is not None:
+            self._sample(obj1, obj2, vel1)
+        if self._event_log is not None:
+            self._log([(obj1, obj2)])
+        self._add_nodes((obj1, obj2))
+        self._update_v_max((obj1, obj2))
         # First, recalculate for all the objects obj1 or obj2
         # collide with in the queue
         to_remove = []
@@ -106,12 +221,14 @@ class System:
                     if not isinstance(obj1, objects.Container):
                         obj = [i for i in collision[1] if i is not obj1][0]
                         to_remove.append(index)
-                        to_add.append(obj)
+                        if obj is not None:
+                            to_add.append(obj)
             elif obj2 in collision[1]:
                 if not isinstance(obj2, objects.Container):
                     obj = [i for i in collision[1] if i is not obj2][0]
                     to_remove.append(index)
-                    to_add.append(obj)
+                    if obj is not None:
+                        to_add.append(obj)
         # Then find what they actually collide with next
         for index in to_remove[::-1]:
             self._collisions.pop(index)
@@ -119,6 +236,289 @@ class System:
         for obj in to_add:
             self.next_collides(obj)
 
+    def _collide_batch(self):
+        """Perform next collision and any others within the tolerance
+
+        Collisions sharing a ball with one already in the batch are left
+        for later. The batch is carried out with the vectorised kernels,
+        then everything the balls in it collide with next is predicted
+        in one go.
+        """
+        t0, pair = heapq.heappop(self._collisions)
+        if pair[1] is None:
+            # reached the horizon without colliding, look again
+            return self._predict([pair[0]], now=t0)
+        batch = [pair]
+        busy = set(obj for obj in pair
+                   if not isinstance(obj, objects.Container))
+        deferred = []
+        rescans = []
+        while (len(self._collisions) > 0 and
+               self._collisions[0][0] <= t0 + self._batch_tol):
+            collision = heapq.heappop(self._collisions)
+            balls = [obj for obj in collision[1]
+                     if not isinstance(obj, objects.Container)]
+            if collision[1][1] is None:
+                rescans.append(collision[1][0])
+            elif any(ball in busy for ball in balls):
+                deferred.append(collision)
+            else:
+                batch.append(collision[1])
+                busy.update(balls)
+        core.logging.log(8, "batch of {} collisions".format(len(batch)))
+
+        KE0, p0, scale = self._pair_state(*busy)
+        vels = [pair[0].get_vel() for pair in batch]
+        self._resolve(batch)
+        if self._orbits:
+            self._start_orbits(busy)
+        KE1, p1, _ = self._pair_state(*busy)
+        self._book_keep(KE1 - KE0, p1 - p0, KE0, scale, len(batch))
+        if self._samples is not None:
+            for (obj1, obj2), vel1 in zip(batch, vels):
+                self._sample(obj1, obj2, vel1)
+        if self._event_log is not None:
+            self._log(batch)
+        self._add_nodes(busy)
+        self._update_v_max(busy)
+
+        # Drop everything queued for the balls in the batch, and
+        # predict again for them and whatever they were going to hit
+        to_add = set(busy)
+        to_add.update(rescans)
+        kept = []
+        for collision in self._collisions + deferred:
+            if any(obj in busy for obj in collision[1]):
+                to_add.update(obj for obj in collision[1]
+                              if obj is not None and
+                              not isinstance(obj, objects.Container))
+            else:
+                kept.append(collision)
+        heapq.heapify(kept)
+        self._collisions = kept
+        self._predict(list(to_add))
+
+    def _resolve(self, batch):
+        """Carry out every collision in *batch* at once
+
+        *batch* is a list of (Ball, Ball or Container) with no Ball in
+        more than one collision.
+        """
+        walls = [pair[0] for pair in batch
+                 if isinstance(pair[1], objects.Container)]
+        pairs = [pair for pair in batch
+                 if not isinstance(pair[1], objects.Container)]
+        if len(walls) > 0:
+            vel, dp = kernels.reflect(
+                _np.array([ball.get_pos() for ball in walls]),
+                _np.array([ball.get_vel() for ball in walls]),
+                _np.array([ball.get_mass() for ball in walls]),
+                _np.array([ball.get_radius() for ball in walls]),
+                self._container.get_axes())
+            for ball, v, p in zip(walls, vel, dp):
+                ball.set_vel(v)
+                self._container.add_momentum(p)
+        if len(pairs) > 0:
+            arrays = []
+            for k in (0, 1):
+                arrays += [_np.array([pair[k].get_pos() for pair in pairs]),
+                           _np.array([pair[k].get_vel() for pair in pairs]),
+                           _np.array([pair[k].get_mass() for pair in pairs])]
+            vel1, vel2 = kernels.elastic(*arrays)
+            for (ball1, ball2), v1, v2 in zip(pairs, vel1, vel2):
+                ball1.set_vel(v1)
+                ball2.set_vel(v2)
+
+    def _predict(self, balls, now=None):
+        """Queue the next collision of each of *balls* in one go
+
+        *now* is as in next_collides().
+        """
+        if len(balls) == 0:
+            return None
+        if self._orbits:
+            return self._predict_orbits(balls, now)
+        if now is None:
+            now = self._time
+        times, partners = kernels.predict(
+            self.get_positions(),
+            _np.array([ball.get_vel() for ball in self._balls]),
+            _np.array([ball.get_radius() for ball in self._balls]),
+            self._container.get_axes(),
+            [self._index[ball] for ball in balls])
+        for ball, t, partner in zip(balls, times, partners):
+            if self._horizon is not None and t > now - self._time + \
+                    self._horizon:
+                heapq.heappush(self._collisions,
+                               [now + self._horizon, (ball, None)])
+                continue
+            if t == _np.inf:
+                continue
+            if partner == -1:
+                other = self._container
+            else:
+                other = self._balls[partner]
+            heapq.heappush(self._collisions,
+                           [float(t) + self._time, (ball, other)])
+
+    def _start_orbits(self, balls):
+        """Start new orbits for *balls* from where they are now"""
+        idx = _np.array([self._index[ball] for ball in balls], dtype=int)
+        orb = kernels.orbit(
+            _np.array([ball.get_pos() for ball in balls]),
+            _np.array([ball.get_vel() for ball in balls]),
+            _np.array([ball.get_radius() for ball in balls]),
+            abs(self._container.get_radius()))
+        if self._orbit is None:
+            self._orbit = orb
+            self._orbit_start = _np.full(len(balls), self._time)
+            self._orbit_hits = _np.zeros(len(balls))
+            self._orbit_mass = _np.array([b.get_mass() for b in balls])
+            self._orbit_radius = _np.array([b.get_radius() for b in balls])
+            return None
+        for key, value in orb.items():
+            self._orbit[key][idx] = value
+        self._orbit_start[idx] = self._time
+        self._orbit_hits[idx] = 0
+
+    def _predict_orbits(self, balls, now=None):
+        """Queue the next collision with another ball of each of *balls*,
+        following every ball along its orbit
+
+        Every pair close enough to meet within the horizon is followed
+        in one call of kernels.contact. Horizons end on multiples of
+        the horizon, so balls that reach theirs are looked at again
+        together. *now* is as in next_collides().
+        """
+        if now is None:
+            now = self._time
+        pos, vel, _ = kernels.orbit_state(self._orbit,
+                                          now - self._orbit_start)
+        speed = _np.sqrt(_np.sum(vel * vel, axis=1))
+        radius = self._orbit_radius
+        if self._horizon is None:
+            end = _np.inf
+        else:
+            # the next multiple at least half a horizon away
+            end = self._horizon * (_np.floor(now / self._horizon + 0.5) + 1)
+        window = end - now
+        idx = _np.array([self._index[ball] for ball in balls], dtype=int)
+        r = pos[None, :, :] - pos[idx][:, None, :]
+        reach = ((speed[idx][:, None] + self._v_max) * window +
+                 radius[idx][:, None] + radius[None, :])
+        near = _np.sum(r * r, axis=2) <= reach * reach
+        near[_np.arange(len(idx)), idx] = False
+        row, col = _np.nonzero(near)
+        found = _np.full(len(idx), _np.inf)
+        limit = _np.full(len(idx), window)
+        partner = _np.full(len(idx), -1, dtype=int)
+        if len(row) > 0:
+            times, done = kernels.contact(
+                self._orbit, idx[row], col, radius[idx[row]] + radius[col],
+                now - self._orbit_start[idx[row]],
+                now - self._orbit_start[col], window)
+            _np.minimum.at(limit, row, done)
+            # earliest contact of each ball
+            order = _np.lexsort((times, row))
+            first = order[_np.concatenate(
+                ([True], row[order][1:] != row[order][:-1]))]
+            found[row[first]] = times[first]
+            partner[row[first]] = col[first]
+        for ball, t, j, lim in zip(balls, found, partner, limit):
+            if t < _np.inf and t <= lim:
+                heapq.heappush(self._collisions,
+                               [now + float(t), (ball, self._balls[j])])
+            elif lim >= window and end < _np.inf:
+                heapq.heappush(self._collisions, [end, (ball, None)])
+            elif lim < _np.inf:
+                heapq.heappush(self._collisions,
+                               [now + float(lim), (ball, None)])
+
+    def _tick_orbits(self, step):
+        """Move every ball *step* seconds along its orbit, and give the
+        container the impulse of every wall hit on the way"""
+        if self._orbit is None:
+            self._start_orbits(self._balls)
+        pos, vel, hits = kernels.orbit_state(
+            self._orbit, self._time + step - self._orbit_start)
+        new = hits - self._orbit_hits
+        moved = _np.nonzero(new > 0)[0]
+        if len(moved) > 0:
+            self._orbit_events(moved, new[moved])
+            old = _np.array([self._balls[i].get_vel() for i in moved])
+            mass = self._orbit_mass[moved]
+            dp = _np.sum(mass[:, None] * (old - vel[moved]), axis=0)
+            self._container.add_momentum(dp, _np.sum(
+                mass * self._orbit["kick"][moved] * new[moved]))
+            self._momentum -= dp
+            self._p_cont = self._container.get_momentum().copy()
+            for i in moved:
+                self._balls[i].set_vel(vel[i])
+        for ball, p in zip(self._balls, pos):
+            ball.set_pos(p)
+        self._orbit_hits = hits
+        self._time += step
+
+    def _orbit_events(self, moved, new):
+        """Pass on wall hits of balls *moved*, with *new* hits each, to
+        whatever is sampling, logging or recording them"""
+        tracked = any(self._balls[i].get_tracker() is not None
+                      for i in moved)
+        if (self._samples is None and self._event_log is None and
+                self._history is None and not tracked):
+            return None
+        # one row per hit, in time order
+        idx = _np.repeat(moved, new.astype(int))
+        k = self._orbit_hits[idx] + _np.arange(len(idx)) - _np.repeat(
+            _np.cumsum(new) - new, new.astype(int))
+        times = (self._orbit_start[idx] + self._orbit["first"][idx] +
+                 k * self._orbit["period"][idx])
+        order = _np.argsort(times, kind="mergesort")
+        idx, k, times = idx[order], k[order], times[order]
+        if self._samples is not None:
+            self._samples[0].extend(_np.column_stack(
+                (times, self._orbit_mass[idx] * self._orbit["kick"][idx],
+                 self._orbit_radius[idx])).tolist())
+        if self._event_log is not None:
+            self._event_log.extend((t, i, -1)
+                                   for t, i in zip(times, idx.tolist()))
+        if self._history is None and not tracked:
+            return None
+        pos, vel = kernels.bounce(self._orbit, idx, k)
+        for t, i, p, v in zip(times, idx, pos, vel):
+            tracker = self._balls[i].get_tracker()
+            if tracker is not None:
+                tracker.append(t, p)
+            if self._history is not None:
+                self._history.event(t, i, p, v)
+
+    def _reindex(self):
+        """Map each ball to its position in the list of balls"""
+        self._index = dict((ball, i) for i, ball in enumerate(self._balls))
+
+    def _add_nodes(self, objs):
+        """Add a node to the path of any of *objs* being tracked, and
+        to the history if recording"""
+        for obj in objs:
+            if not isinstance(obj, objects.Ball):
+                continue
+            if obj.get_tracker() is not None:
+                obj.get_tracker().append(self._time, obj.get_pos())
+            if self._history is not None:
+                self._history.event(self._time, self._index[obj],
+                                    obj.get_pos(), obj.get_vel())
+        if self._history is not None and self._history.due():
+            self._history.keyframe(self.get_state())
+
+    def _log(self, pairs):
+        """Add the collisions in *pairs* to the event log"""
+        for obj1, obj2 in pairs:
+            if isinstance(obj2, objects.Container):
+                other = -1
+            else:
+                other = self._index[obj2]
+            self._event_log.append((self._time, self._index[obj1], other))
+
     def check_collide(self, end_t=0):
         """
         Check to see if two objects collide before *end_t* or next frame
@@ -126,24 +526,41 @@ class System:
         If the next collision occurs before *end_t* or next frame, call
         collide().
         If animating, pass *end_t* = 0.
+        With orbits the balls are then moved up to *end_t*, since wall
+        hits are only resolved as they move.
         """
-        core.logging.log(11, "self._collisions {}".format(self._collisions))
-        t = self._time
+        core.logging.log(11, "self._collisions %s", self._collisions)
         f = self._frame
         # time at the next frame
         if end_t == 0:
             t_1 = (f + 1) / FRAMERATE
         else:
             t_1 = end_t
-        next_coll_t = self._collisions[0][0]
-        if next_coll_t <= t_1:
-            step = next_coll_t - t
-            self.tick(step)
+        # a loop rather than recursion, so long runs don't hit the
+        # recursion limit
+        while (len(self._collisions) > 0 and
+               self._collisions[0][0] <= t_1):
+            # horizon checks don't need the balls moved
+            if self._collisions[0][1][1] is not None:
+                self.tick(self._collisions[0][0] - self._time)
             self.collide()
-            self.check_collide(end_t)
-            return None
-        else:
-            return None
+            if (self._publisher is not None and
+                    self._events - self._published >= self._publish_every):
+                self._publish()
+        if self._orbits and t_1 > self._time:
+            # wall hits only reach the container as the orbits are moved
+            self.tick(t_1 - self._time)
+        if self._publisher is not None:
+            self._publish()
+        return None
+
+    def _publish(self):
+        """Write the current state to shared memory"""
+        self._published = self._events
+        self._publisher.publish(
+            self._time, self.get_positions(),
+            _np.array([ball.get_vel() for ball in self._balls]),
+            self._container.get_momentum())
 
     def advance(self, step):
         """Move the system forward in time by *step* seconds"""
@@ -156,23 +573,42 @@ class System:
         # Stop the balls from sneaking inside each other due to rounding errors
         if step > 1E-10:
             step -= 1E-10
+        if self._orbits:
+            return self._tick_orbits(step)
         for ball in self._balls:
             ball.move(step)
         self._time += step
 
-    def next_collides(self, obj):
+    def next_collides(self, obj, now=None):
         """
         Find what an object next collides with, and add it to the queue
+
+        *now* is the time of a horizon check, which may be after the
+        time balls were last moved to. Nothing has changed velocity
+        since then, so collisions can be found from where they are.
         """
-        core.logging.log(8, "next_collides on {}".format(obj))
+        core.logging.log(8, "next_collides on %s", obj)
         if isinstance(obj, objects.Container):
             return None
+        if self._orbits:
+            return self._predict_orbits([obj], now)
+        if now is None:
+            now = self._time
         collTimes = []
-        for other in self._objects:
-            core.logging.log(8, "other is {}".format(other))
+        reach = self._reach(obj, now)
+        if self._grid_kind is None:
+            others = self._objects
+        else:
+            others = self._neighbours(obj, now) + [self._container]
+        for other in others:
+            core.logging.log(8, "other is %s", other)
             if obj == other:
                 core.logging.log(8, "continuing")
                 continue
+            if reach is not None and other is not self._container:
+                r = other.get_pos() - obj.get_pos()
+                if _np.dot(r, r) > (reach + other.get_radius()) ** 2:
+                    continue
             time_to_coll = obj.time_to_collision(other)
             if time_to_coll is not None:
                 if close(time_to_coll, 0) is False:
@@ -180,12 +616,389 @@ class System:
                     collTimes.append(
                         [time_to_coll, (obj, other)]
                     )
-            core.logging.log(8, "collTimes = {}".format(collTimes))
-        if len(collTimes) > 0:
+            core.logging.log(8, "collTimes = %s", collTimes)
+        if self._horizon is not None and (
+                len(collTimes) == 0 or
+                min(collTimes)[0] > now + self._horizon):
+            heapq.heappush(self._collisions,
+                           [now + self._horizon, (obj, None)])
+        elif len(collTimes) > 0:
             heapq.heappush(self._collisions, min(collTimes))
 
-    def total_KE(self):
-        """Return total system KE as float"""
+    def _neighbours(self, obj, now):
+        """Return list of the balls that could hit *obj* before the
+        horizon after *now*
+
+        The lists are made with a grid, at the time they were made, for
+        balls up to a skin of 4 horizons at the fastest speed apart.
+        Two balls close the gap between them at no more than twice the
+        fastest speed, so they hold until the skin could be closed
+        before the horizon.
+        """
+        if self._near is None or 2 * self._v_max * (
+                now + self._horizon - self._near_time) > self._skin:
+            self._find_neighbours()
+        return [self._balls[k] for k in self._near[self._index[obj]]]
+
+    def _find_neighbours(self):
+        """Make the lists of nearby balls used by _neighbours()"""
+        pos = self.get_positions()
+        radius = _np.array([ball.get_radius() for ball in self._balls])
+        self._skin = 4 * self._v_max * self._horizon
+        kind = self._grid_kind
+        if kind == "auto":
+            if _np.max(radius) > 2 * _np.min(radius):
+                kind = "multi"
+            else:
+                kind = "uniform"
+        if kind == "multi":
+            index = grid.MultiGrid(radius, dim=self._dim, reach=self._skin)
+        else:
+            index = grid.CellGrid(float(2 * _np.max(radius) + self._skin),
+                                  dim=self._dim)
+        i, j = index.pairs(pos)
+        r = pos[i] - pos[j]
+        keep = (_np.sum(r * r, axis=1) <=
+                (radius[i] + radius[j] + self._skin) ** 2)
+        first = _np.concatenate((i[keep], j[keep]))
+        second = _np.concatenate((j[keep], i[keep]))
+        order = _np.argsort(first, kind='mergesort')
+        counts = _np.bincount(first, minlength=len(self._balls))
+        self._near = _np.split(second[order], _np.cumsum(counts)[:-1])
+        self._near_time = self._time
+        core.logging.log(11, "neighbour lists from {}, {} pairs".format(
+            index, _np.sum(keep)))
+
+    def _reach(self, obj, now):
+        """Return how far away a ball can be and still hit *obj* before
+        the horizon after *now*, not counting its radius. None if there
+        is no horizon.
+        """
+        if self._horizon is None:
+            return None
+        speed = _np.sqrt(_np.dot(obj.get_vel(), obj.get_vel()))
+        return ((speed + self._v_max) * (now - self._time + self._horizon) +
+                obj.get_radius())
+
+    def _update_v_max(self, objs):
+        """Raise the bound on the fastest ball to cover *objs*
+
+        The bound never goes down between resyncs, so it is always safe
+        to use for the horizon.
+        """
+        if self._horizon is None:
+            return None
+        for obj in objs:
+            if isinstance(obj, objects.Ball):
+                self._v_max = max(self._v_max, _np.sqrt(
+                    _np.dot(obj.get_vel(), obj.get_vel())))
+
+    def _pair_state(self, *objs):
+        """Return KE, momentum and momentum scale of colliding *objs*
+
+        Momentum includes that of the container, so it is conserved for
+        wall collisions too. Scale is the sum of the magnitudes of the
+        ball momenta, used to judge what counts as a violation.
+        """
+        KE = 0.
+        p = self._container.get_momentum().copy()
+        scale = 0.
+        for obj in objs:
+            if isinstance(obj, objects.Container):
+                continue
+            mass = obj.get_mass()
+            vel = obj.get_vel()
+            KE += 0.5 * mass * core.MASS * _np.dot(vel, vel)
+            p = p + mass * vel
+            scale += mass * _np.sqrt(_np.dot(vel, vel))
+        return KE, p, scale
+
+    def _book_keep(self, dKE, dp, KE, scale, n=1):
+        """Update running totals with the change from *n* collisions
+
+        *KE* and *scale* are the KE and momentum scale of the pair before
+        the collision, from _pair_state().
+        The change in momentum of the container is taken off again so
+        that the running total only holds the momentum of the balls.
+        Flags the first collision where energy or momentum is not
+        conserved, and resyncs with an exact sum every core.RESYNC
+        collisions to stop rounding errors building up.
+        """
+        self._events += n
+        dp_cont = self._container.get_momentum() - self._p_cont
+        self._p_cont = self._container.get_momentum().copy()
+        self._KE += dKE
+        self._momentum += dp - dp_cont
+        tol = core.CONSERVATION_TOL
+        if (abs(dKE) > tol * KE or
+                _np.sqrt(_np.dot(dp, dp)) > tol * scale):
+            self._num_violations += 1
+            if self._violation is None:
+                self._violation = (self._events, self._time, dKE, dp)
+                core.logging.log(50, "conservation broken at collision "
+                                 "{} t = {}, dKE = {}, dp = {}".format(
+                                     *self._violation))
+        if self._events // core.RESYNC != (self._events - n) // core.RESYNC:
+            self.resync()
+
+    def resync(self):
+        """Recalculate the running KE and momentum totals exactly
+
+        Also resets the bound on the fastest ball used for the horizon.
+        """
+        KE = self.total_KE(exact=True)
+        p = 0
+        for ball in self._balls:
+            p += ball.get_mass() * ball.get_vel()
+        if self._events > 0:
+            core.logging.log(11, "resync drift: KE {}, p {}".format(
+                self._KE - KE, self._momentum - p))
+        self._KE = KE
+        self._momentum = _np.array(p, dtype=float)
+        self._v_max = max(_np.sqrt(_np.dot(ball.get_vel(), ball.get_vel()))
+                          for ball in self._balls)
+        self._p_cont = self._container.get_momentum().copy()
+
+    def reset_queue(self):
+        """Throw away all queued collisions and predict them again
+
+        Call after changing balls other than through collisions.
+        """
+        if self._history is not None:
+            # ball indices may have changed too
+            self._history.keyframe(self.get_state())
+        self._collisions = []
+        self._near = None
+        if self._orbits:
+            self._orbit = None
+            self._start_orbits(self._balls)
+        if self._batch_tol is not None:
+            return self._predict(self._balls)
+        for ball in self._balls:
+            self.next_collides(ball)
+
+    def rescale_velocities(self, factor):
+        """Multiply the velocity of every ball by *factor*
+
+        Temperature changes by *factor* squared. The balls follow the
+        same paths, just faster, so an equilibrated system stays
+        equilibrated.
+        """
+        if factor <= 0:
+            raise ValueError("factor is {}, should be positive".format(
+                factor))
+        for ball in self._balls:
+            ball.set_vel(ball.get_vel() * factor)
+        self.resync()
+        self.reset_queue()
+
+    def _overlaps(self, pos, radius):
+        """Return True if a ball at *pos* with *radius* would overlap
+        the wall or any ball in the system"""
+        if not self._container.contains(pos, radius):
+            return True
+        for ball in self._balls:
+            r = ball.get_pos() - pos
+            if _np.dot(r, r) <= (ball.get_radius() + radius) ** 2:
+                return True
+        return False
+
+    def resize_balls(self, radius):
+        """Set the radius of every ball to *radius*
+
+        Shrinking is always possible. Raises ValueError if growing would
+        make any ball overlap another or the wall, leaving the balls
+        unchanged.
+        """
+        pos = self.get_positions()
+        for i, ball in enumerate(self._balls):
+            if radius > ball.get_radius():
+                r = pos[i + 1:] - pos[i]
+                if (_np.any(_np.sum(r * r, axis=1) <= (2 * radius) ** 2) or
+                        not self._container.contains(pos[i], radius)):
+                    raise ValueError(
+                        "radius {} makes balls overlap".format(radius))
+        for ball in self._balls:
+            ball.set_radius(radius)
+        self.reset_queue()
+
+    def add_ball(self, ball):
+        """Add *ball* to the system at its current position
+
+        Raises ValueError if it would overlap another ball or the wall.
+        """
+        self.add_balls([ball])
+
+    def add_balls(self, balls):
+        """Add each of *balls* to the system at its current position
+
+        The queue is predicted again once for all of them, rather than
+        once per ball. Raises ValueError if any would overlap the wall,
+        a ball in the system or each other, adding none of them.
+        """
+        for k, ball in enumerate(balls):
+            if not isinstance(ball, objects.Ball):
+                raise TypeError("ball is not instance of Ball")
+            if len(ball.get_pos()) != self._dim:
+                raise ValueError(
+                    "{} does not have {} components like container".format(
+                        ball, self._dim))
+            if self._overlaps(ball.get_pos(), ball.get_radius()):
+                raise ValueError("{} overlaps the system".format(ball))
+            for other in balls[:k]:
+                r = other.get_pos() - ball.get_pos()
+                if _np.dot(r, r) <= (other.get_radius() +
+                                     ball.get_radius()) ** 2:
+                    raise ValueError("{} overlaps {}".format(ball, other))
+        if len(balls) == 0:
+            return None
+        self._balls.extend(balls)
+        self._objects[-1:-1] = balls
+        self._reindex()
+        self.resync()
+        self.reset_queue()
+
+    def remove_ball(self, ball):
+        """Take *ball* out of the system"""
+        self.remove_balls([ball])
+
+    def remove_balls(self, balls):
+        """Take each of *balls* out of the system
+
+        The queue is predicted again once for all of them, rather than
+        once per ball. Raises ValueError if any are not in the system,
+        removing none of them.
+        """
+        for ball in balls:
+            if ball not in self._index:
+                raise ValueError("{} is not in the system".format(ball))
+        if len(balls) == 0:
+            return None
+        gone = set(balls)
+        self._balls[:] = [ball for ball in self._balls if ball not in gone]
+        self._objects[:] = [obj for obj in self._objects if obj not in gone]
+        self._reindex()
+        self.resync()
+        self.reset_queue()
+
+    def get_balls(self):
+        """Return list of balls in the system"""
+        return self._balls
+
+    def get_container(self):
+        """Return the container of the system"""
+        return self._container
+
+    def get_state(self):
+        """Return copy of the state of every ball as dict
+
+        Keys are time (float), and pos, vel, radius and mass, numpy.arrays
+        with one row per ball.
+        """
+        return {"time": self._time,
+                "pos": self.get_positions(),
+                "vel": _np.array([ball.get_vel() for ball in self._balls]),
+                "radius": _np.array([b.get_radius() for b in self._balls]),
+                "mass": _np.array([ball.get_mass() for ball in self._balls])}
+
+    def get_positions(self):
+        """Return positions of all balls as numpy.array, shape (n, dim)"""
+        return _np.array([ball.get_pos() for ball in self._balls])
+
+    def get_time(self):
+        """Return current time of system in seconds as float"""
+        return self._time
+
+    def track(self, balls=None, **kwargs):
+        """Start recording the paths of *balls*
+
+        *balls* is a list of Ball in the system, all of them if None.
+        Other keyword arguments are passed to trajectory.Trajectory.
+        Return list of the new Trajectory objects.
+        """
+        if balls is None:
+            balls = self._balls
+        trackers = []
+        for ball in balls:
+            if ball not in self._balls:
+                raise ValueError("{} is not in the system".format(ball))
+            tracker = trajectory.Trajectory(dim=len(ball.get_pos()),
+                                            **kwargs)
+            tracker.append(self._time, ball.get_pos())
+            ball.set_tracker(tracker)
+            trackers.append(tracker)
+        return trackers
+
+    def publish(self, name, capacity=None, every=100):
+        """Start sharing the state with other processes
+
+        The time, positions, velocities and container momentum are
+        written to shared memory called *name*, which live.Reader can
+        attach to, every *every* collisions and at the end of every
+        check_collide(), so long runs can be watched as they go.
+        *capacity* is the most balls that will be in the system, the
+        current number if None. Return the live.Publisher.
+        """
+        if every < 1:
+            raise ValueError("every is {}, should be at least 1".format(
+                every))
+        if capacity is None:
+            capacity = len(self._balls)
+        self.unpublish()
+        self._publisher = live.Publisher(name, capacity, dim=self._dim)
+        self._publish_every = every
+        self._publish()
+        return self._publisher
+
+    def unpublish(self, unlink=True):
+        """Stop sharing the state, closing the live.Publisher from
+        publish(). *unlink* is passed to its close()."""
+        if self._publisher is None:
+            return None
+        self._publisher.close(unlink)
+        self._publisher = None
+
+    def log_events(self):
+        """Start logging every collision
+
+        Return list, to which (time, i, j) is added for each collision
+        between balls i and j, with j = -1 for the wall. Indices are
+        positions in get_balls().
+        """
+        self._event_log = []
+        return self._event_log
+
+    def record(self, keyframe_every=1000):
+        """Start recording the state of every ball
+
+        Return trajectory.History, which can give the state at any time
+        from now on without running the system again.
+        """
+        self._history = trajectory.History(
+            dim=self._dim, keyframe_every=keyframe_every)
+        self._history.keyframe(self.get_state())
+        return self._history
+
+    def get_violation(self):
+        """Return the first collision that broke conservation
+
+        Returns None if there has not been one, otherwise a tuple of
+        (collision number, time, change in KE, change in momentum)
+        """
+        return self._violation
+
+    def get_num_violations(self):
+        """Return number of collisions that broke conservation as int"""
+        return self._num_violations
+
+    def total_KE(self, exact=False):
+        """Return total system KE as float
+
+        Uses the running total unless *exact* is True, in which case the
+        KE of every ball is summed.
+        """
+        if not exact:
+            return self._KE
         KE = 0
         for ball in self._balls:
             V2 = 0
@@ -201,8 +1014,12 @@ class System:
         return KE / len(self._balls)
 
     def temperature(self):
-        """Return temperature of system as float"""
-        return (2. / 3.) * self.mean_KE() / Kb
+        """Return temperature of system as float
+
+        Uses equipartition with one degree of freedom per component,
+        so a 2D container gives the temperature of a 2D gas.
+        """
+        return (2. / self._dim) * self.mean_KE() / Kb
 
     def pressure(self, step):
         """Return pressure of system averaged over *step* seconds as float"""
@@ -217,13 +1034,100 @@ class System:
         self.tick(t_remaining)
         dp = p1 - p0
         F = dp / step
-        P = F / (4 * _np.pi * self._container.get_radius() ** 2)
+        # force per unit length of wall in 2D
+        P = F / self._container.get_area()
         return P
 
-    def get_total_momentum(self):
-        """Return total momentum of container and all balls. Should be zero"""
+    def _sample(self, obj1, obj2, vel1):
+        """Record impulse of the collision that just happened
+
+        *obj1* is always a Ball, *vel1* is its velocity before the
+        collision. For the wall the magnitude of the impulse is kept,
+        with the radius of the Ball. For two Balls the virial
+        (r1 - r2).dp1 is kept.
+        """
+        dp = obj1.get_mass() * (obj1.get_vel() - vel1)
+        if isinstance(obj2, objects.Container):
+            self._samples[0].append(
+                (self._time, _np.sqrt(_np.dot(dp, dp)), obj1.get_radius()))
+        else:
+            r = obj1.get_pos() - obj2.get_pos()
+            self._samples[1].append((self._time, _np.dot(r, dp)))
+
+    def pressure_stats(self, step, blocks=10):
+        """Return pressure averaged over *step* seconds, with error bars
+
+        Uses the virial theorem, which for hard spheres gives
+            P = (2 KE + W / step) A' / (A dim V')
+        where W is the sum over ball-ball collisions of (r1 - r2).dp1,
+        A is the area of the wall, and A' and V' the area and volume of
+        the container shrunk by r, the radius of the balls hitting it
+        weighted by their wall impulses. In a sphere of radius R,
+        A' / (dim V') is 1 / (R - r). KE is conserved, so only W
+        fluctuates and the estimate converges several times faster than
+        the wall impulse alone, which is also returned for comparison.
+        Errors are the standard error over *blocks* equal blocks of
+        the window.
+
+        Returns dict with keys:
+            pressure, pressure_err: float, virial estimate
+            wall_pressure, wall_pressure_err: float, wall impulse estimate
+            collision_rate: float, ball-ball collisions per ball per second
+            mean_free_path: float, mean speed / collision_rate
+        """
+        if blocks < 2:
+            raise ValueError("blocks is {}, should be 2 or more".format(
+                blocks))
+        t0 = self._time
+        self._samples = ([], [])
+        self.check_collide(end_t=t0 + step)
+        self.tick(t0 + step - self._time)
+        wall = _np.array(self._samples[0]).reshape(-1, 3)
+        pair = _np.array(self._samples[1]).reshape(-1, 2)
+        self._samples = None
+
+        tau = float(step) / blocks
+        edges = t0 + tau * _np.arange(blocks + 1)
+        impulse = _np.histogram(wall[:, 0], edges, weights=wall[:, 1])[0]
+        virial = _np.histogram(pair[:, 0], edges, weights=pair[:, 1])[0]
+        A = self._container.get_area()
+        if len(wall) > 0:
+            r = _np.sum(wall[:, 1] * wall[:, 2]) / _np.sum(wall[:, 1])
+        else:
+            r = _np.mean([ball.get_radius() for ball in self._balls])
+        wall_P = impulse * core.MASS / (tau * A)
+        # centres reach the surface r inside the wall
+        virial_P = ((2 * self.total_KE() + virial * core.MASS / tau) *
+                    self._container.get_area(r) /
+                    (A * self._dim * self._container.get_volume(r)))
+
+        rate = 2. * len(pair) / (len(self._balls) * step)
+        speed = _np.mean([_np.sqrt(_np.dot(ball.get_vel(), ball.get_vel()))
+                          for ball in self._balls])
+        if rate > 0:
+            path = speed / rate
+        else:
+            path = _np.inf
+        root_n = _np.sqrt(blocks)
+        stats = {"pressure": _np.mean(virial_P),
+                 "pressure_err": _np.std(virial_P, ddof=1) / root_n,
+                 "wall_pressure": _np.mean(wall_P),
+                 "wall_pressure_err": _np.std(wall_P, ddof=1) / root_n,
+                 "collision_rate": rate,
+                 "mean_free_path": path}
+        core.logging.log(15, "pressure_stats {}".format(stats))
+        return stats
+
+    def get_total_momentum(self, exact=False):
+        """Return total momentum of container and all balls. Should be zero
+
+        Uses the running total unless *exact* is True, in which case the
+        momentum of every ball is summed.
+        """
+        if not exact:
+            return self._momentum + self._container.get_momentum()
         p = 0
         for ball in self._balls:
-            p += ball.get_mass() * ball.get_vel() 
+            p += ball.get_mass() * ball.get_vel()
         p += self._container.get_momentum()
         return p
@@ -8,17 +8,37 @@ command line options:
     b: basicTest(), single particle animated in container
     s: animGenTest(n=4, ballsize=1.), four balls animated
     a: animGenTest(n=16, ballsize=0.25)
+    l: animGenTest(n=400, ballsize=0.2, collection=True), many balls
+        drawn as one collection
+    w: animGenTest(n=400, ballsize=0.2, worker=True), many balls
+        simulated in a separate process
     p: physicsTest(num_balls=40), Compare pressure and temperature
+    f: steppedTest(), compare fixed time step engine with System
     t: timingTest(), time things. This was just so I could decide what
         parameters to use
     c: conservationTest(5), check momentum and energy conservation 
+    h: historyTest(), check states rebuilt from a recorded History
+    e: equivalenceTest(), compare fast engines with the reference
+        System on the same balls
+    g: dsmcTest(), pressure of a million balls with the DSMC engine
+    o: orbitTest(), compare orbit and event pressure of a gas too
+        dilute for any balls to meet
+    r: idealGTest(), g(r) of uniform random points in an ellipsoid,
+        which should be 1
 
 """
 import sys
 
+import dsmc
+import equivalence
 import objects
+import stepped
+import structure
 import system
+import trajectory
 import core
+import video
+import viewer
 
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
@@ -73,21 +93,31 @@ def genTest(n=6):
     mySys = system.System(balls, cont)
 
 
-def animGenTest(n=6, r=12., ballsize=1.):
+def animGenTest(n=6, r=12., ballsize=1., collection=False, worker=False):
     """
     Create animation with *n* balls, size *ballsize* in container radius *r*
+
+    If *collection* is True draw the balls as a single collection.
+    If *worker* is True simulate in a separate process with
+    viewer.Viewer, so the window keeps up at large *n*.
     """
     global mySys, fig, ax
     reload(objects)
     reload(system)
     reload(core)
-    balls = objects.distributeBalls(n, r, ballsize=ballsize)
-    cont = objects.Container(r)
-    mySys = system.System(balls, cont)
+    balls = objects.distributeBalls(n, r, ballsize=ballsize, planar=True)
+    cont = objects.Container(r, dim=2)
     fig = plt.figure()
     ax = plt.axes(xlim=(-20, 20), ylim=(-20, 20))
     ax.axes.set_aspect('equal')
-    mySys.init_system(ax)
+    if worker:
+        mySys = viewer.Viewer(balls, cont)
+        anim = mySys.show(ax)
+        plt.show()
+        mySys.stop()
+        return None
+    mySys = system.System(balls, cont)
+    mySys.init_system(ax, collection=collection)
     anim = animation.FuncAnimation(
         fig, mySys.next_frame,
         interval=20, blit=True
@@ -121,6 +151,152 @@ def physicsTest(num_balls=200, ballsize=0.01):
     print "frac", a / b
     print "P(V-bn)", c
     print "frac", c / b
+    stats = mySys.pressure_stats(5)
+    print "virial pressure", stats["pressure"], "+/-", stats["pressure_err"]
+    print "wall pressure", stats["wall_pressure"], "+/-", \
+        stats["wall_pressure_err"]
+    print "collision rate", stats["collision_rate"]
+    print "mean free path", stats["mean_free_path"]
+
+
+def steppedTest(num_balls=60, ballsize=0.5, dt=None):
+    """Compare SteppedSystem with System on the same starting balls"""
+    global mySys, mySteppedSys
+    sys.setrecursionlimit(10000)
+    reload(objects)
+    reload(system)
+    reload(stepped)
+    reload(core)
+    balls = objects.distributeBalls(
+        n=num_balls, radius=12, ballsize=ballsize, dim=3)
+    # SteppedSystem copies the balls, so make it before System moves them
+    mySteppedSys = stepped.SteppedSystem(balls, objects.Container(12), dt)
+    mySys = system.System(balls, objects.Container(12))
+    mySys.init_system(None)
+    for name, s in (("event", mySys), ("stepped", mySteppedSys)):
+        start = core.time.time()
+        s.check_collide(2)
+        P = s.pressure(5)
+        T = s.temperature()
+        core.logging.log(20, "{} P {} T {} in {} s".format(
+            name, P, T, core.time.time() - start))
+        print name, "pressure", P, "temp", T
+
+
+def historyTest(num_balls=60, ballsize=0.5, step=0.5, frames=20):
+    """Check states rebuilt from a History match the running system"""
+    global mySys, myHistory
+    reload(objects)
+    reload(system)
+    reload(trajectory)
+    balls = objects.distributeBalls(
+        n=num_balls, radius=12, ballsize=ballsize, dim=3)
+    mySys = system.System(balls, objects.Container(12))
+    myHistory = mySys.record(keyframe_every=100)
+    mySys.init_system(None)
+    states = []
+    for i in xrange(1, frames + 1):
+        mySys.advance(step)
+        states.append(mySys.get_state())
+    err = 0.
+    for state in states:
+        rebuilt = myHistory.get_state(state["time"])
+        err = max(err, np.max(np.abs(rebuilt["pos"] - state["pos"])),
+                  np.max(np.abs(rebuilt["vel"] - state["vel"])))
+    core.logging.log(20, "{} events, {} keyframes, largest error {}".format(
+        len(myHistory), len(myHistory.get_keyframe_times()), err))
+    print "largest error in rebuilt states", err
+
+
+def equivalenceTest():
+    """Compare the fast engines with the reference System"""
+    global results
+    reload(objects)
+    reload(system)
+    reload(stepped)
+    reload(equivalence)
+    results = equivalence.check()
+
+
+def orbitTest(num_balls=20, ballsize=1E-4, step=5):
+    """Compare pressure of the orbit and event engines on the same balls
+
+    The balls are too small to meet, so both follow the same paths and
+    the pressures should agree to rounding.
+    """
+    global results
+    reload(objects)
+    reload(system)
+    results = {}
+    for engine in ("event", "orbit"):
+        balls, cont = equivalence.make_balls(0, n=num_balls,
+                                             ballsize=ballsize)
+        mySys = system.System(balls, cont, orbits=(engine == "orbit"))
+        log = mySys.log_events()
+        mySys.init_system(None)
+        P = mySys.pressure(step)
+        met = sum(1 for t, i, j in log if j >= 0)
+        results[engine] = P
+        core.logging.log(20, "{}: P {} at t {}, {} ball collisions".format(
+            engine, P, mySys.get_time(), met))
+    print "pressure", results
+    if results["event"] > 0 and core.close(
+            float(results["orbit"] / results["event"]), 1.):
+        core.logging.log(20, "Orbit pressure agrees")
+    else:
+        core.logging.log(50, "Orbit pressure differs: {}".format(results))
+
+
+def idealGTest(axes=(12., 6., 4.), n=2000, snapshots=50, bins=50, r_max=2.,
+               ballsize=1.):
+    """Check g(r) is 1 for uniform random points in an ellipsoid
+
+    Points are spread over where the centres of balls of radius
+    *ballsize* can reach. Each bin is compared with 1 in units of its
+    Poisson error.
+    """
+    global rdf
+    reload(structure)
+    cont = objects.EllipticalContainer(axes)
+    rdf = structure.RadialDistribution(cont, r_max, bins=bins,
+                                       ballsize=ballsize)
+    for k in xrange(snapshots):
+        p = np.random.uniform(-1, 1, (4 * n, len(axes))) * axes
+        p = p[cont.contains(p, ballsize)][:n]
+        rdf.add(p)
+    g = rdf.get_g()
+    z = (g - 1) * np.sqrt(rdf.get_counts())
+    core.logging.log(20, "g from {} to {}, largest error {} sigma".format(
+        np.min(g), np.max(g), np.max(np.abs(z))))
+    print "g from", np.min(g), "to", np.max(g), "largest error", \
+        np.max(np.abs(z)), "sigma"
+    if np.all(np.isfinite(g)) and np.max(np.abs(z)) < 5:
+        core.logging.log(20, "Ideal g(r) is 1")
+    else:
+        core.logging.log(50, "Ideal g(r) is not 1")
+
+
+def dsmcTest(num_balls=10**6, radius=1000., ballsize=0.05, measure=20):
+    """Compare the pressure of a very dilute gas from the DSMC engine
+    with the ideal gas law"""
+    global myGas
+    reload(dsmc)
+    start = core.time.time()
+    myGas = dsmc.makeGas(num_balls, radius, ballsize=ballsize, v=10.,
+                         dim=3)
+    # a few crossings of the container for the lattice to spread out
+    myGas.check_collide(5 * 2 * radius / 10.)
+    P = myGas.pressure(measure * myGas.get_dt())
+    T = myGas.temperature()
+    cont = myGas.get_container()
+    ideal = num_balls * core.Kb * T / cont.get_volume(ballsize) * (
+        cont.get_area(ballsize) / cont.get_area())
+    core.logging.log(20, "{}: P {} ideal {} T {} collisions {} in {} s".format(
+        myGas, P, ideal, T, myGas.get_num_collisions(),
+        core.time.time() - start))
+    print "pressure", P, "ideal gas", ideal, "temp", T
+    print "collisions", myGas.get_num_collisions(), "in", \
+        core.time.time() - start, "s"
 
 
 def timingTest():
@@ -143,11 +319,23 @@ def conservationTest(step=5):
     cont = objects.Container(12)
     mySys = system.System(balls, cont)
     mySys.init_system(None)
-    E0 = mySys.total_KE()
-    p0 = mySys.get_total_momentum()
+    E0 = mySys.total_KE(exact=True)
+    p0 = mySys.get_total_momentum(exact=True)
     mySys.check_collide(step)
-    E1 = mySys.total_KE()
-    p1 = mySys.get_total_momentum()
+    E1 = mySys.total_KE(exact=True)
+    p1 = mySys.get_total_momentum(exact=True)
+    if mySys.get_violation() is None:
+        core.logging.log(20, "No collision broke conservation")
+    else:
+        core.logging.log(50, "{} collisions broke conservation".format(
+            mySys.get_num_violations()))
+        core.logging.log(50, "first {}".format(mySys.get_violation()))
+    # relative, KE is far below the absolute tolerance of core.close
+    if abs(E1 - mySys.total_KE()) <= core.CONSERVATION_TOL * E1:
+        core.logging.log(20, "Running KE total agrees")
+    else:
+        core.logging.log(50, "Running KE total drifted")
+        core.logging.log(50, mySys.total_KE())
     if core.close(p0, p1):
         core.logging.log(20, "Momentum conserved")
     else:
@@ -168,22 +356,14 @@ def brownTest():
     reload(objects)
     reload(system)
     reload(core)
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=core.FRAMERATE, bitrate=1800)
-    balls = objects.distributeBalls(60, 5, ballsize=0.1, v=20.)
-    big_ball = objects.BigBall(pos=[7,0,0], radius=1., mass=5)
+    balls = objects.distributeBalls(60, 5, ballsize=0.1, v=20., planar=True)
+    big_ball = objects.BigBall(pos=[7, 0], vel=[0, 0], radius=1., mass=5)
     balls.append(big_ball)
-    cont = objects.Container(9)
+    cont = objects.Container(9, dim=2)
     mySys = system.System(balls, cont)
-    fig = plt.figure()
-    ax = plt.axes(xlim=(-20, 20), ylim=(-20, 20))
-    ax.axes.set_aspect('equal')
-    mySys.init_system(ax)
-    anim = animation.FuncAnimation(
-        fig, mySys.next_frame, frames=200,
-        interval=20, blit=True, repeat=False
-    )
-    anim.save("mov.mp4", writer=writer)
+    # the big ball brighter than the rest
+    shades = [160] * (len(balls) - 1) + [255]
+    video.record(mySys, 200, "mov.mp4", shades=shades)
     fig2 = plt.figure(2)
     ax2 = plt.axes(xlim=(-20, 20), ylim=(-20, 20))
     ax2.add_artist(plt.Circle((0, 0), 9, fill=False))
@@ -200,12 +380,28 @@ def run(args):
         animGenTest(4, ballsize=1.)
     elif args[1] == "a":
         animGenTest(16, ballsize=0.25)
+    elif args[1] == "l":
+        animGenTest(400, ballsize=0.2, collection=True)
+    elif args[1] == "w":
+        animGenTest(400, ballsize=0.2, worker=True)
     elif args[1] == "p":
         physicsTest(num_balls=40)
+    elif args[1] == "f":
+        steppedTest()
     elif args[1] == "t":
         timingTest()
     elif args[1] == "c":
         conservationTest(5)
+    elif args[1] == "h":
+        historyTest()
+    elif args[1] == "e":
+        equivalenceTest()
+    elif args[1] == "g":
+        dsmcTest()
+    elif args[1] == "o":
+        orbitTest()
+    elif args[1] == "r":
+        idealGTest()
 
 
 if __name__ == '__main__':
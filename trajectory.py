@@ -0,0 +1,308 @@
+"""
+Compact record of the path taken by a particle, or by a whole system
+
+Defines:
+    Trajectory, Class
+    History, Class
+    load(filename), function, read a History written by History.save()
+
+Ethan Mills
+"""
+import bisect
+import os
+
+import numpy as _np
+
+
+class Trajectory:
+    """Growable array of the times and positions where the velocity of a
+    particle changed.
+
+    Nodes are held in one numpy array which doubles in size when full,
+    so appending is amortised O(1) and costs 8 bytes per component.
+    Only every *decimate*-th node is kept. If *spill* is a filename,
+    the buffer is written to the end of that file whenever it holds
+    *max_nodes* nodes, so memory use stays fixed for long runs.
+
+    Methods:
+        append(t, pos)
+        flush()
+        get_data()
+        get_times()
+        get_nodes()
+    """
+
+    def __init__(self, dim=3, capacity=256, decimate=1, spill=None,
+                 max_nodes=65536):
+        """Initialise empty Trajectory
+
+        Args:
+            dim: int, number of position components, 2 or 3
+            capacity: int, number of nodes to allocate space for at first
+            decimate: int, keep one in every *decimate* nodes
+            spill: str or None, file to move full buffers to. Must not
+                exist already, so nothing is ever overwritten.
+            max_nodes: int, nodes to hold in memory before spilling
+        """
+        # input checking
+        if dim not in (2, 3):
+            raise ValueError("dim is {}, should be 2 or 3".format(dim))
+        if type(capacity) is not int:
+            raise TypeError(
+                "capacity is type {}, should be int".format(type(capacity)))
+        if capacity <= 0:
+            raise ValueError(
+                "capacity is {}, should be positive".format(capacity))
+        if type(decimate) is not int:
+            raise TypeError(
+                "decimate is type {}, should be int".format(type(decimate)))
+        if decimate <= 0:
+            raise ValueError(
+                "decimate is {}, should be positive".format(decimate))
+        if spill is not None and max_nodes <= 0:
+            raise ValueError(
+                "max_nodes is {}, should be positive".format(max_nodes))
+        if spill is not None and os.path.exists(spill):
+            raise ValueError("spill file {} already exists".format(spill))
+
+        self._dim = dim
+        # each row is [t, x, y(, z)]
+        self._buf = _np.empty((capacity, dim + 1))
+        self._len = 0
+        self._seen = 0
+        self._spilled = 0
+        self._decimate = decimate
+        self._spill = spill
+        self._max_nodes = max_nodes
+        if spill is not None:
+            # start with an empty file
+            open(spill, "ab").close()
+
+    def __repr__(self):
+        return "Trajectory(dim={}, decimate={}, spill={})".format(
+            self._dim, self._decimate, repr(self._spill))
+
+    def __len__(self):
+        return self._spilled + self._len
+
+    def append(self, t, pos):
+        """Add node at time *t*, position *pos*
+
+        *t* is float, *pos* is numpy.array with dim components
+        """
+        self._seen += 1
+        if (self._seen - 1) % self._decimate != 0:
+            return None
+        if self._len == len(self._buf):
+            if self._spill is not None and self._len >= self._max_nodes:
+                self.flush()
+            else:
+                grown = _np.empty((2 * len(self._buf), self._dim + 1))
+                grown[:self._len] = self._buf[:self._len]
+                self._buf = grown
+        row = self._buf[self._len]
+        row[0] = t
+        row[1:] = pos[:self._dim]
+        self._len += 1
+
+    def flush(self):
+        """Move nodes held in memory to the end of the spill file"""
+        if self._spill is None or self._len == 0:
+            return None
+        with open(self._spill, "ab") as f:
+            self._buf[:self._len].tofile(f)
+        self._spilled += self._len
+        self._len = 0
+
+    def get_data(self):
+        """Return all nodes as numpy.array, shape (n, dim + 1)
+
+        Each row is [t, x, y(, z)]. Includes nodes spilled to disk.
+        """
+        held = self._buf[:self._len]
+        if self._spilled == 0:
+            return held.copy()
+        spilled = _np.fromfile(self._spill).reshape(-1, self._dim + 1)
+        return _np.concatenate((spilled, held))
+
+    def get_times(self):
+        """Return times of nodes as numpy.array"""
+        return self.get_data()[:, 0]
+
+    def get_nodes(self):
+        """Return positions of nodes as numpy.array, shape (dim, n)
+
+        nodes[0] is all x components, nodes[1] all y and so on, so it can
+        be passed straight to plotting functions.
+        """
+        return self.get_data()[:, 1:].T
+
+
+class History:
+    """Seekable record of every ball in a system.
+
+    Holds a full keyframe of the state every *keyframe_every* events,
+    and between them one row [t, index, pos, vel] for each ball whose
+    velocity changed. Balls move in straight lines between events, so
+    the state at any time is found by loading the keyframe before it,
+    replaying only the events since, and moving every ball on from its
+    last event. Made with System.record().
+
+    Methods:
+        event(t, index, pos, vel)
+        keyframe(state)
+        due()
+        get_state(t)
+        snapshots(times)
+        get_keyframe_times()
+        get_end()
+        save(filename)
+    """
+
+    def __init__(self, dim=3, keyframe_every=1000, capacity=1024):
+        """Initialise empty History
+
+        Args:
+            dim: int, number of position components, 2 or 3
+            keyframe_every: int, number of events between keyframes
+            capacity: int, number of events to allocate space for at
+                first
+        """
+        if dim not in (2, 3):
+            raise ValueError("dim is {}, should be 2 or 3".format(dim))
+        if type(keyframe_every) is not int:
+            raise TypeError("keyframe_every is type {}, should be int".format(
+                type(keyframe_every)))
+        if keyframe_every <= 0:
+            raise ValueError("keyframe_every is {}, should be positive".format(
+                keyframe_every))
+        self._dim = dim
+        self._keyframe_every = keyframe_every
+        # each row is [t, index, pos, vel]
+        self._buf = _np.empty((capacity, 2 + 2 * dim))
+        self._len = 0
+        self._since = 0
+        # keyframe times, states and the event row each one starts at
+        self._key_times = []
+        self._keys = []
+        self._offsets = []
+
+    def __repr__(self):
+        return "History(dim={}, keyframe_every={})".format(
+            self._dim, self._keyframe_every)
+
+    def __len__(self):
+        return self._len
+
+    def event(self, t, index, pos, vel):
+        """Add that ball *index* was at *pos* with velocity *vel* from
+        time *t*"""
+        if self._len == len(self._buf):
+            grown = _np.empty((2 * len(self._buf), self._buf.shape[1]))
+            grown[:self._len] = self._buf[:self._len]
+            self._buf = grown
+        row = self._buf[self._len]
+        row[0] = t
+        row[1] = index
+        row[2:2 + self._dim] = pos
+        row[2 + self._dim:] = vel
+        self._len += 1
+        self._since += 1
+
+    def keyframe(self, state):
+        """Add full *state*, a dict from System.get_state()
+
+        Ball indices in events after this refer to the rows of *state*.
+        """
+        if len(self._key_times) > 0 and state["time"] < self._key_times[-1]:
+            raise ValueError("keyframe at {} is before the last one".format(
+                state["time"]))
+        self._key_times.append(state["time"])
+        self._keys.append(dict((key, _np.array(value))
+                               for key, value in state.items()))
+        self._offsets.append(self._len)
+        self._since = 0
+
+    def due(self):
+        """Return True if *keyframe_every* events have passed since the
+        last keyframe"""
+        return self._since >= self._keyframe_every
+
+    def get_keyframe_times(self):
+        """Return times of keyframes as numpy.array"""
+        return _np.array(self._key_times)
+
+    def get_end(self):
+        """Return time of the last keyframe or event as float"""
+        if self._len > 0:
+            return max(self._key_times[-1], self._buf[self._len - 1, 0])
+        return self._key_times[-1]
+
+    def get_state(self, t):
+        """Return state of the system at time *t* as dict
+
+        Same keys as System.get_state(). Only correct up to the time the
+        system had reached when recording stopped.
+        """
+        if len(self._keys) == 0 or t < self._key_times[0]:
+            raise ValueError("no keyframe before time {}".format(t))
+        k = bisect.bisect_right(self._key_times, t) - 1
+        key = self._keys[k]
+        pos = key["pos"].copy()
+        vel = key["vel"].copy()
+        last = _np.full(len(pos), self._key_times[k])
+        start = self._offsets[k]
+        if k + 1 < len(self._offsets):
+            stop = self._offsets[k + 1]
+        else:
+            stop = self._len
+        times = self._buf[start:stop, 0]
+        rows = self._buf[start:start + _np.searchsorted(times, t, 'right')]
+        if len(rows) > 0:
+            index = rows[:, 1].astype(int)
+            # only the latest event of each ball matters
+            _, first = _np.unique(index[::-1], return_index=True)
+            latest = rows[len(rows) - 1 - first]
+            index = latest[:, 1].astype(int)
+            pos[index] = latest[:, 2:2 + self._dim]
+            vel[index] = latest[:, 2 + self._dim:]
+            last[index] = latest[:, 0]
+        pos += vel * (t - last)[:, None]
+        return {"time": t, "pos": pos, "vel": vel,
+                "radius": key["radius"].copy(), "mass": key["mass"].copy()}
+
+    def snapshots(self, times):
+        """Return generator of get_state() at each of *times*"""
+        for t in times:
+            yield self.get_state(t)
+
+    def save(self, filename):
+        """Write history to *filename* with numpy.savez, read with load()"""
+        arrays = {"events": self._buf[:self._len],
+                  "key_times": self.get_keyframe_times(),
+                  "offsets": _np.array(self._offsets),
+                  "settings": _np.array([self._dim, self._keyframe_every])}
+        for i, key in enumerate(self._keys):
+            for name, value in key.items():
+                if name != "time":
+                    arrays["key{}_{}".format(i, name)] = value
+        _np.savez(filename, **arrays)
+
+
+def load(filename):
+    """Return History read from *filename*, written by History.save()"""
+    data = _np.load(filename)
+    dim, keyframe_every = [int(i) for i in data["settings"]]
+    events = data["events"]
+    history = History(dim=dim, keyframe_every=keyframe_every,
+                      capacity=max(len(events), 1))
+    history._buf[:len(events)] = events
+    history._len = len(events)
+    for i, (t, offset) in enumerate(zip(data["key_times"], data["offsets"])):
+        key = dict((name, data["key{}_{}".format(i, name)])
+                   for name in ("pos", "vel", "radius", "mass"))
+        key["time"] = float(t)
+        history._key_times.append(float(t))
+        history._keys.append(key)
+        history._offsets.append(int(offset))
+    return history
@@ -0,0 +1,217 @@
+"""
+Write animations straight to ffmpeg, without drawing matplotlib figures
+
+Balls are drawn as filled discs into a numpy image for each frame, and
+the raw frames are piped to an ffmpeg process. Drawing a frame is a few
+array operations, so the time taken is mostly ffmpeg encoding rather
+than matplotlib rendering every patch.
+
+Defines:
+    Raster, Class
+    VideoWriter, Class
+    record(mySys, frames, filename, size=512, extent=None, shades=None),
+        function, run a system and write every frame to a video
+
+Ethan Mills
+"""
+import subprocess
+
+import core
+
+import numpy as _np
+
+from core import FRAMERATE
+
+
+class Raster:
+    """Draw balls at given positions into greyscale images
+
+    The offsets of the pixels covered by a disc are worked out once for
+    each ball size, so drawing a frame is one fancy-indexed assignment
+    per size.
+
+    Methods:
+        get_shape()
+        background()
+        render(pos)
+    """
+
+    def __init__(self, radius, R, size=512, extent=None, shades=None):
+        """Initialise raster
+
+        Args:
+            radius: list or numpy.array, radius of each ball
+            R: float, radius of the container, or its semi-axes, drawn
+                as a ring
+            size: int, width and height of the image in pixels. Must be
+                even for most video codecs.
+            extent: float, half the width of the area shown. If None,
+                just larger than the container.
+            shades: list or numpy.array, grey level 0-255 of each ball.
+                If None, all are white.
+        """
+        if size <= 0 or size % 2 != 0:
+            raise ValueError("size is {}, should be positive and even".format(
+                size))
+        R = _np.atleast_1d(R).astype(float)
+        R = _np.resize(R, max(len(R), 2))[:2]
+        if extent is None:
+            extent = 1.05 * _np.max(R)
+        self._size = int(size)
+        self._scale = size / (2. * extent)
+        radius = _np.asarray(radius, dtype=float)
+        if shades is None:
+            shades = _np.full(len(radius), 255, dtype=_np.uint8)
+        self._shades = _np.asarray(shades, dtype=_np.uint8)
+        # balls grouped by radius in pixels, with the pixels of one disc.
+        # Balls smaller than a pixel are still drawn.
+        pixels = _np.maximum(_np.round(radius * self._scale), 1).astype(int)
+        self._groups = []
+        for r in _np.unique(pixels):
+            y, x = _np.mgrid[-r:r + 1, -r:r + 1]
+            inside = x * x + y * y <= r * r
+            self._groups.append((_np.nonzero(pixels == r)[0],
+                                 y[inside], x[inside]))
+        self._background = self._ring(R)
+
+    def __repr__(self):
+        return "Raster(size={}, scale={})".format(self._size, self._scale)
+
+    def get_shape(self):
+        """Return (height, width) of images in pixels"""
+        return self._size, self._size
+
+    def _pixel(self, pos):
+        """Return row and column of positions *pos*, numpy.array (n, 2)"""
+        col = _np.round(pos[:, 0] * self._scale + self._size / 2.)
+        row = _np.round(self._size / 2. - pos[:, 1] * self._scale)
+        return row.astype(int), col.astype(int)
+
+    def _ring(self, R):
+        """Return blank image with the container drawn on it"""
+        image = _np.zeros((self._size, self._size), dtype=_np.uint8)
+        y, x = _np.mgrid[:self._size, :self._size]
+        # distance from the centre in units of the semi-axes, so the
+        # ring is about one pixel either side of 1
+        x = (x + 0.5 - self._size / 2.) / (R[0] * self._scale)
+        y = (y + 0.5 - self._size / 2.) / (R[1] * self._scale)
+        dist = _np.hypot(x, y)
+        image[_np.abs(dist - 1) * _np.min(R) * self._scale < 1.] = 128
+        return image
+
+    def background(self):
+        """Return copy of the image with no balls on it"""
+        return self._background.copy()
+
+    def render(self, pos):
+        """Return image of balls at *pos* as numpy.array of uint8
+
+        *pos* is numpy.array (n, dim), only x and y are drawn. Discs
+        off the edge of the image are clipped.
+        """
+        image = self._background.copy()
+        row, col = self._pixel(_np.asarray(pos))
+        for idx, dy, dx in self._groups:
+            rows = row[idx, None] + dy[None, :]
+            cols = col[idx, None] + dx[None, :]
+            shade = _np.broadcast_to(self._shades[idx, None], rows.shape)
+            keep = ((rows >= 0) & (rows < self._size) &
+                    (cols >= 0) & (cols < self._size))
+            image[rows[keep], cols[keep]] = shade[keep]
+        return image
+
+
+class VideoWriter:
+    """Pipe raw greyscale frames to an ffmpeg process
+
+    Can be used in a with statement, which closes the file at the end.
+
+    Methods:
+        write(frame)
+        close()
+    """
+
+    def __init__(self, filename, shape, fps=FRAMERATE, ffmpeg="ffmpeg",
+                 crf=23):
+        """Start ffmpeg writing to *filename*
+
+        Args:
+            filename: str, video file to write, format from its extension
+            shape: tuple, (height, width) of frames in pixels
+            fps: float, frames per second
+            ffmpeg: str, ffmpeg executable
+            crf: int, quality passed to libx264, lower is better
+        """
+        self._filename = filename
+        self._shape = tuple(shape)
+        self._frames = 0
+        args = [ffmpeg, "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "gray",
+                "-s", "{}x{}".format(self._shape[1], self._shape[0]),
+                "-r", str(fps), "-i", "-",
+                "-an", "-c:v", "libx264", "-crf", str(crf),
+                "-pix_fmt", "yuv420p", filename]
+        core.logging.log(15, "starting {}".format(" ".join(args)))
+        try:
+            self._proc = subprocess.Popen(args, stdin=subprocess.PIPE)
+        except OSError:
+            raise OSError("could not run {}, is ffmpeg installed?".format(
+                ffmpeg))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return False
+        # ffmpeg has most likely failed already, keep the error from the
+        # with block
+        try:
+            self.close()
+        except (IOError, OSError, RuntimeError) as err:
+            core.logging.log(30, "closing {}: {}".format(self._filename,
+                                                         err))
+        return False
+
+    def write(self, frame):
+        """Send one frame, numpy.array of uint8 with shape *shape*"""
+        if frame.shape != self._shape:
+            raise ValueError("frame is shape {}, should be {}".format(
+                frame.shape, self._shape))
+        self._proc.stdin.write(
+            _np.ascontiguousarray(frame, dtype=_np.uint8).tobytes())
+        self._frames += 1
+
+    def close(self):
+        """Finish writing and wait for ffmpeg to exit"""
+        if self._proc is None:
+            return None
+        self._proc.stdin.close()
+        code = self._proc.wait()
+        self._proc = None
+        if code != 0:
+            raise RuntimeError("ffmpeg exited with code {}".format(code))
+        core.logging.log(20, "wrote {} frames to {}".format(
+            self._frames, self._filename))
+
+
+def record(mySys, frames, filename, size=512, extent=None, shades=None):
+    """Run *mySys* for *frames* frames and write them to *filename*
+
+    *mySys* is a system.System or stepped.SteppedSystem, moved on with
+    next_frame() as matplotlib.animation would. *size*, *extent* and
+    *shades* are passed to Raster.
+    """
+    balls = mySys.get_balls()
+    raster = Raster([ball.get_radius() for ball in balls],
+                    mySys.get_container().get_axes(), size=size,
+                    extent=extent, shades=shades)
+    mySys.init_system(None)
+    with VideoWriter(filename, raster.get_shape()) as writer:
+        # frame 0 is the starting state. next_frame(0) would do the
+        # collisions before frame 1, then try to move back to time 0
+        writer.write(raster.render(mySys.get_positions()))
+        for f in xrange(1, frames):
+            mySys.next_frame(f)
+            writer.write(raster.render(mySys.get_positions()))
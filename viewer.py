@@ -0,0 +1,192 @@
+"""
+Real-time animation with the simulation running in a separate process
+
+The worker process moves the system on one frame at a time and writes
+the positions of every ball into a ring buffer of shared memory. The
+window reads whichever frame is due by the wall clock, skipping any it
+is too late for, so a frame with many collisions slows the worker down
+rather than freezing the window. When the worker gets a whole ring
+ahead of the window it waits, so memory use is fixed. If the worker
+fails, its traceback is sent back and raised in the window.
+
+Defines:
+    Viewer, Class
+
+Ethan Mills
+"""
+import multiprocessing
+import Queue
+import time
+import traceback
+
+import core
+import engines
+
+import matplotlib.animation as _animation
+import matplotlib.collections as _collections
+import numpy as _np
+
+from core import FRAMERATE
+
+
+def _run(balls, container, engine, buf, head, tail, stop, slots, errors):
+    """Worker process: write frames into *buf* until *stop* is set
+
+    Frame f goes in slot f % *slots*. *head* is the number of frames
+    written, and frames before *tail* may be overwritten. The traceback
+    of any exception is put on *errors* before the worker exits.
+    """
+    try:
+        _frames(balls, container, engine, buf, head, tail, stop, slots)
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def _frames(balls, container, engine, buf, head, tail, stop, slots):
+    """Move the system on and write frames, for _run()"""
+    mySys = engines.makeSystem(balls, container, engine)
+    mySys.init_system(None)
+    ring = _np.frombuffer(buf).reshape(slots, len(balls), -1)
+    # frame 0 is the starting state, as in video.record
+    ring[0] = mySys.get_positions()
+    head.value = 1
+    f = 1
+    while not stop.value:
+        mySys.next_frame(f)
+        while f - tail.value >= slots:
+            if stop.value:
+                return None
+            time.sleep(0.2 / FRAMERATE)
+        ring[f % slots] = mySys.get_positions()
+        head.value = f + 1
+        f += 1
+
+
+class Viewer:
+    """Animate balls in real time, simulating them in a worker process
+
+    Methods:
+        start()
+        stop()
+        latest()
+        get_skipped()
+        show(figure)
+    """
+
+    def __init__(self, balls, container, engine="stepped", slots=64):
+        """Initialise viewer
+
+        Args:
+            balls: list, objects.Ball to simulate. The worker gets its
+                own copy, these are not moved.
+            container: objects.Container for the system
+            engine: str, passed to engines.makeSystem. The stepped
+                engine takes about the same time for every frame, which
+                suits real time.
+            slots: int, number of frames the ring buffer holds
+        """
+        if slots < 2:
+            raise ValueError("slots is {}, should be 2 or more".format(slots))
+        self._balls = balls
+        self._container = container
+        self._engine = engine
+        self._slots = slots
+        dim = len(balls[0].get_pos())
+        self._buf = multiprocessing.RawArray('d', slots * len(balls) * dim)
+        self._ring = _np.frombuffer(self._buf).reshape(slots, len(balls), dim)
+        self._head = multiprocessing.RawValue('l', 0)
+        self._tail = multiprocessing.RawValue('l', 0)
+        self._stop = multiprocessing.RawValue('b', 0)
+        self._errors = multiprocessing.Queue(1)
+        self._process = None
+        self._start_time = None
+        self._shown = -1
+        self._skipped = 0
+        self._collection = None
+        self._animation = None
+
+    def start(self):
+        """Start the worker process and the clock"""
+        if self._process is not None:
+            return None
+        self._process = multiprocessing.Process(
+            target=_run,
+            args=(self._balls, self._container, self._engine, self._buf,
+                  self._head, self._tail, self._stop, self._slots,
+                  self._errors))
+        self._process.daemon = True
+        self._process.start()
+        self._start_time = time.time()
+
+    def stop(self):
+        """Stop the worker process"""
+        if self._process is None:
+            return None
+        self._stop.value = 1
+        self._process.join()
+        self._process = None
+        core.logging.log(20, "viewer showed {} frames, skipped {}".format(
+            self._shown + 1 - self._skipped, self._skipped))
+
+    def latest(self):
+        """Return (frame, positions) of the frame due now, or None if
+        it is the one already shown or no frame is ready yet
+
+        Frames the window was too late for are skipped. Raises
+        RuntimeError with the worker's traceback if it failed.
+        """
+        self._check_worker()
+        head = self._head.value
+        due = int((time.time() - self._start_time) * FRAMERATE)
+        f = min(due, head - 1)
+        if f <= self._shown:
+            return None
+        # the worker may now reuse every slot before this one
+        self._tail.value = f
+        pos = self._ring[f % self._slots].copy()
+        self._skipped += f - self._shown - 1
+        self._shown = f
+        return f, pos
+
+    def _check_worker(self):
+        """Raise RuntimeError if the worker process has failed"""
+        try:
+            error = self._errors.get_nowait()
+        except Queue.Empty:
+            return None
+        self.stop()
+        raise RuntimeError("viewer worker failed:\n" + error)
+
+    def get_skipped(self):
+        """Return number of frames skipped so far as int"""
+        return self._skipped
+
+    def _draw(self, i):
+        """Called by matplotlib.animation.FuncAnimation()"""
+        try:
+            frame = self.latest()
+        except RuntimeError:
+            # stop drawing rather than wait for frames that never come
+            self._animation.event_source.stop()
+            raise
+        if frame is not None:
+            self._collection.set_offsets(frame[1][:, :2])
+        return [self._collection]
+
+    def show(self, figure):
+        """Draw the balls on *figure* and start animating
+
+        Starts the worker if it is not running. Return the
+        matplotlib.animation.FuncAnimation, which must be kept.
+        """
+        figure.add_artist(self._container.get_patch())
+        diameters = [2 * ball.get_radius() for ball in self._balls]
+        self._collection = _collections.EllipseCollection(
+            diameters, diameters, _np.zeros(len(self._balls)), units='xy',
+            offsets=_np.array([ball.get_pos()[:2] for ball in self._balls]),
+            transOffset=figure.transData)
+        figure.add_collection(self._collection)
+        self.start()
+        self._animation = _animation.FuncAnimation(
+            figure.figure, self._draw, interval=1000. / FRAMERATE, blit=True)
+        return self._animation